@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+
+# Non-interactive batch runner: recommendations for many user profiles, streamed to a JSONL file.
+# Usage: python batch_recommend.py profiles.jsonl|profiles.csv --output results.jsonl [--workers 4] [--prefork]
+#   profile fields: age, interests_query, preferred_platform_names (list, or "a, b" / "a; b" in CSV), country_code
+# Profiles with the same interest / age band / country share one candidate pool (Agents 2-3), and every
+# worker process shares the on-disk TMDb response cache, so repeated TMDb fetches are paid once.
+# Very large groups are split into chunks so they still spread over the workers; later chunks rebuild
+# their pool almost entirely from that cache.
+# --prefork imports the heavy modules (requests, numpy, google.generativeai) once in the parent and forks the
+# workers from it, so none of them pays that import again.
+
+PROGRESS_REPORT_EVERY = 50 # Profiles between throughput reports
+
+def read_profiles(input_path):
+    # Yields raw profile dicts from a JSONL or CSV file.
+    with open(input_path, encoding='utf-8', newline='') as input_file:
+        if input_path.lower().endswith('.csv'):
+            yield from csv.DictReader(input_file)
+        else:
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+
+def recommend_for_profile_group(indexed_profiles):
+    # Worker: runs one group of profiles that share a candidate pool, as one traced run. Agent banners are silenced.
+    candidate_pools = {}
+    results = []
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull), main.trace_run():
+        for profile_index, user_context in indexed_profiles:
+            try:
+                pool_key = main.get_candidate_pool_key(user_context)
+                if pool_key not in candidate_pools:
+                    candidate_pools[pool_key] = main.build_candidate_pool(user_context)
+                final_recommendations, fallback_mode_was_engaged = main.recommend_from_candidate_pool(candidate_pools[pool_key], user_context)
+                results.append({
+                    'profile_index': profile_index, 'profile': user_context, 'used_fallback_search': fallback_mode_was_engaged,
+                    'recommendations': [main.recommendation_to_output(rec) for rec in final_recommendations],
+                })
+            except Exception as e:
+                results.append({'profile_index': profile_index, 'profile': user_context, 'error': str(e), 'recommendations': []})
+    return results
+
+def run_batch(input_path, output_path, workers, chunk_size, prefork=False):
+    profile_groups = {}
+    invalid_profiles = []
+    for profile_index, raw_profile in enumerate(read_profiles(input_path)):
+        try:
+            user_context = main.build_user_context(raw_profile)
+        except (KeyError, TypeError, ValueError) as e:
+            invalid_profiles.append({'profile_index': profile_index, 'profile': raw_profile, 'error': f"perfil inválido: {e}", 'recommendations': []})
+            continue
+        profile_groups.setdefault(main.get_candidate_pool_key(user_context), []).append((profile_index, user_context))
+
+    work_units = [group[start:start + chunk_size] for group in profile_groups.values() for start in range(0, len(group), chunk_size)]
+    total_profiles = sum(len(group) for group in profile_groups.values()) + len(invalid_profiles)
+    print(f"📋 {total_profiles} perfis em {len(profile_groups)} grupos de candidatos (interesse/idade/país). Processando com {workers} processo(s)...") # User-facing: Portuguese
+    started_at = time.time()
+    done_profiles = 0
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        def write_results(results):
+            nonlocal done_profiles
+            for result in results:
+                output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+            previous_done = done_profiles
+            done_profiles += len(results)
+            if done_profiles // PROGRESS_REPORT_EVERY != previous_done // PROGRESS_REPORT_EVERY:
+                elapsed = time.time() - started_at
+                print(f"⏱️  {done_profiles}/{total_profiles} perfis ({done_profiles / elapsed:.2f} perfis/s)") # User-facing: Portuguese
+
+        write_results(invalid_profiles)
+        if workers <= 1:
+            for work_unit in work_units:
+                write_results(recommend_for_profile_group(work_unit))
+        else:
+            executor_context = None
+            if prefork and "fork" in multiprocessing.get_all_start_methods():
+                preload_seconds = main.preload_heavy_modules()
+                executor_context = multiprocessing.get_context("fork")
+                print(f"🔥 Módulos carregados em {preload_seconds:.2f}s antes de criar os processos (pre-fork).") # User-facing: Portuguese
+            with ProcessPoolExecutor(max_workers=workers, mp_context=executor_context) as executor:
+                futures = [executor.submit(recommend_for_profile_group, work_unit) for work_unit in work_units]
+                for future in as_completed(futures):
+                    write_results(future.result())
+
+    elapsed = time.time() - started_at
+    print(f"✅ {done_profiles} perfis processados em {elapsed:.1f}s ({done_profiles / elapsed if elapsed else 0:.2f} perfis/s). Resultados em '{output_path}'.") # User-facing: Portuguese
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera recomendações em lote para perfis de usuários (JSONL ou CSV).")
+    parser.add_argument("input", help="Arquivo de perfis (.jsonl ou .csv).")
+    parser.add_argument("--output", default="recommendations.jsonl", help="Arquivo JSONL de saída.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos em paralelo.")
+    parser.add_argument("--chunk-size", type=int, default=100, help="Máximo de perfis de um mesmo grupo por tarefa.")
+    parser.add_argument("--prefork", action="store_true", help="Carrega os módulos pesados uma vez e cria os processos por fork, já aquecidos.")
+    args = parser.parse_args()
+
+    if not main.TMDB_API_KEY:
+        sys.exit("🔴 TMDB_API_KEY ausente. Configure-a no arquivo .env.")
+    run_batch(args.input, args.output, max(1, args.workers), max(1, args.chunk_size), args.prefork)
@@ -0,0 +1,137 @@
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import main
+
+# Measures the memory held by candidate pools and per-user candidate lists, comparing:
+#   - "dicts": the former flow, emulated here (a dict per prospect, a copy per stage, TMDb's full
+#     multi-region watch/providers listing kept on every item),
+#   - "records": the current flow (main.Prospect filled in place, main.UserCandidate views per user,
+#     interned names, flatrate-only providers).
+# The TMDb details payloads are synthetic but shaped like the real ones (~60 regions with flatrate/rent/buy
+# lists, release_dates), so the comparison runs offline.
+# Usage: python benchmark_memory.py [--pools 50] [--pool-size 30] [--users-per-pool 20] [--regions 60] [--seed 42]
+
+GENRE_NAMES = ("Animação", "Aventura", "Comédia", "Família", "Fantasia", "Ficção científica", "Mistério", "Documentário")
+PROVIDER_NAMES = {8: "Netflix", 337: "Disney Plus", 119: "Amazon Prime Video", 307: "Globoplay", 1899: "Max",
+                  350: "Apple TV Plus", 2: "Apple TV", 3: "Google Play Movies", 531: "Paramount Plus", 283: "Crunchyroll"}
+REGION_CODES = ("BR", "US", "PT", "AR", "MX", "CA", "GB", "DE", "FR", "ES", "IT", "JP", "KR", "AU", "NZ", "IN", "CL", "CO", "PE", "UY",
+                "NL", "BE", "SE", "NO", "DK", "FI", "PL", "CZ", "AT", "CH", "IE", "IL", "TR", "ZA", "EG", "SA", "AE", "SG", "MY", "TH",
+                "PH", "ID", "VN", "TW", "HK", "RO", "HU", "GR", "BG", "HR", "SK", "SI", "EE", "LV", "LT", "UA", "EC", "VE", "BO", "PY")
+USER_PROVIDER_IDS = ({8, 337}, {119}, {8, 307}, {337, 1899, 531})
+
+def synthetic_details(tmdb_id, media_type, region_count, rng):
+    # A TMDb details payload with append_to_response=release_dates|content_ratings,watch/providers.
+    def provider_entries(count):
+        return [{'logo_path': f"/{rng.getrandbits(64):x}.jpg", 'provider_id': provider_id, 'provider_name': PROVIDER_NAMES[provider_id],
+                 'display_priority': rng.randint(0, 40)} for provider_id in rng.sample(sorted(PROVIDER_NAMES), count)]
+    providers = {
+        region: {'link': f"https://www.themoviedb.org/{media_type}/{tmdb_id}/watch?locale={region}",
+                 'flatrate': provider_entries(rng.randint(1, 3)), 'rent': provider_entries(rng.randint(0, 4)), 'buy': provider_entries(rng.randint(0, 4))}
+        for region in REGION_CODES[:region_count]
+    }
+    details = {
+        'id': tmdb_id, 'genres': [{'id': index, 'name': name} for index, name in enumerate(rng.sample(GENRE_NAMES, 3))],
+        'vote_average': round(rng.uniform(5, 9), 1), 'vote_count': rng.randint(10, 20000),
+        'watch/providers': {'results': providers},
+    }
+    if media_type == 'movie':
+        details['release_dates'] = {'results': [{'iso_3166_1': region, 'release_dates': [{'certification': rng.choice(("L", "10", "12")), 'type': 3}]}
+                                                for region in REGION_CODES[:region_count]]}
+    else:
+        details['content_ratings'] = {'results': [{'iso_3166_1': region, 'rating': rng.choice(("L", "10", "12"))} for region in REGION_CODES[:region_count]]}
+    return details
+
+def search_result(tmdb_id, media_type):
+    return {'tmdb_id': tmdb_id, 'media_type': media_type, 'title': f"Título {tmdb_id}", 'overview': f"Sinopse do título {tmdb_id}. " * 8,
+            'popularity': float(tmdb_id % 997)}
+
+def dicts_flow(search_results, details_by_id, user_provider_sets, country_code):
+    # The former pipeline: Agent 2 dicts, Agent 3 copies with the raw provider listing, Agent 4 copies per user.
+    enriched_pool = []
+    for result in search_results:
+        prospect = dict(result)
+        details = details_by_id[prospect['tmdb_id']]
+        enriched_item = prospect.copy()
+        enriched_item['genres'] = [genre['name'] for genre in details.get('genres', [])]
+        enriched_item['tmdb_vote_average'] = details.get('vote_average', 0.0)
+        enriched_item['tmdb_vote_count'] = details.get('vote_count', 0)
+        enriched_item['age_certification_country'] = main.extract_age_certification(details, prospect['media_type'], country_code)
+        enriched_item['watch_providers'] = details.get('watch/providers', {}).get('results', {})
+        enriched_pool.append(enriched_item)
+    user_candidates = []
+    for target_provider_ids in user_provider_sets:
+        for item in enriched_pool:
+            item_copy = item.copy()
+            item_copy['available_on_user_platforms'] = sorted({
+                provider['provider_name'] for provider in item['watch_providers'].get(country_code, {}).get('flatrate', [])
+                if provider['provider_id'] in target_provider_ids
+            })
+            user_candidates.append(item_copy)
+    return enriched_pool, user_candidates
+
+def records_flow(search_results, details_by_id, user_provider_sets, country_code):
+    enriched_pool = []
+    for result in search_results:
+        prospect = main.Prospect(result['tmdb_id'], result['media_type'], result['title'], result['overview'], result['popularity'])
+        enriched_pool.append(main.apply_tmdb_details(prospect, details_by_id[prospect.tmdb_id]))
+    user_candidates = [main.check_streaming_for_item(item, country_code, target_provider_ids)
+                       for target_provider_ids in user_provider_sets for item in enriched_pool]
+    return enriched_pool, user_candidates
+
+def measure(flow, workload, country_code):
+    # Bytes still held once every pool and user list is built (the details payloads are freed as TMDb's
+    # cache would drop them), plus the peak during the build.
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    retained = []
+    for search_results, user_provider_sets, make_details in workload:
+        details_by_id = make_details()
+        retained.append(flow(search_results, details_by_id, user_provider_sets, country_code))
+        del details_by_id
+    elapsed = time.perf_counter() - started_at
+    gc.collect()
+    held_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held_bytes, peak_bytes, elapsed, retained
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara a memória dos candidatos em dicionários com os registros compactos.")
+    parser.add_argument("--pools", type=int, default=50, help="Pools de candidatos (consultas distintas).")
+    parser.add_argument("--pool-size", type=int, default=30, help="Títulos por pool.")
+    parser.add_argument("--users-per-pool", type=int, default=20, help="Usuários atendidos por pool (Agente 4 por usuário).")
+    parser.add_argument("--regions", type=int, default=60, help="Regiões na listagem de provedores de cada título (máx. 60).")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    main.AVAILABILITY_INDEX_PATH = "" # Agent 4 reads the providers kept on each record, as on a cold start
+    country_code = main.TARGET_COUNTRY_CODE
+    workload = []
+    for pool_index in range(args.pools):
+        ids = [(pool_index * args.pool_size + offset + 1, 'movie' if offset % 3 else 'tv') for offset in range(args.pool_size)]
+        search_results = [search_result(tmdb_id, media_type) for tmdb_id, media_type in ids]
+        user_provider_sets = [USER_PROVIDER_IDS[user_index % len(USER_PROVIDER_IDS)] for user_index in range(args.users_per_pool)]
+        # Regenerated per run from the same seed, so both flows see identical payloads
+        make_details = lambda ids=ids: {
+            tmdb_id: synthetic_details(tmdb_id, media_type, min(args.regions, len(REGION_CODES)), random.Random(args.seed * 100003 + tmdb_id))
+            for tmdb_id, media_type in ids
+        }
+        workload.append((search_results, user_provider_sets, make_details))
+
+    results = {}
+    for flow_name, flow in (("dicts", dicts_flow), ("records", records_flow)):
+        held_bytes, peak_bytes, elapsed, retained = measure(flow, workload, country_code)
+        results[flow_name] = (held_bytes, peak_bytes, elapsed, retained)
+
+    dict_users = [item['available_on_user_platforms'] for _, user_candidates in results['dicts'][3] for item in user_candidates]
+    record_users = [item['available_on_user_platforms'] for _, user_candidates in results['records'][3] for item in user_candidates]
+    candidates_total = args.pools * args.pool_size * args.users_per_pool
+    print(f"{args.pools} pools x {args.pool_size} títulos x {args.users_per_pool} usuários = {candidates_total} candidatos (visões por usuário)") # User-facing: Portuguese
+    print(f"{'fluxo':<9} {'retido MB':>10} {'pico MB':>9} {'bytes/candidato':>16} {'tempo s':>8}")
+    for flow_name, (held_bytes, peak_bytes, elapsed, _) in results.items():
+        print(f"{flow_name:<9} {held_bytes / 2**20:>10.1f} {peak_bytes / 2**20:>9.1f} {held_bytes / candidates_total:>16.0f} {elapsed:>8.2f}")
+    print(f"Mesmas plataformas por candidato nos dois fluxos: {'sim' if dict_users == record_users else 'NÃO'}") # User-facing: Portuguese
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import main
+
+# Reproducible end-to-end benchmark: drives the full pipeline (Agents 2-5 + existence check) against a local
+# mock TMDb server and a fake Gemini model, so throughput/latency regressions can be measured offline.
+# Usage: python benchmark_pipeline.py [--scenario all] [--sessions 20] [--concurrency 4] [--tmdb-latency-ms 20]
+#        [--tmdb-error-rate 0.02] [--gemini-latency-ms 300] [--gemini-error-rate 0] [--fixtures fixtures.json]
+#        [--save-fixtures fixtures.json] [--record-live] [--regions BR,PT,US] [--seed 42]
+#        [--tmdb-retry-after 1] [--tmdb-rate-limit 40] [--gemini-rate-limit 300] [--max-tmdb-calls 20] [--max-gemini-tokens 2000]
+# Responses come from --fixtures when the request is there (keys: "/endpoint?sorted&params", without api_key),
+# otherwise they are generated deterministically from the seed. --save-fixtures writes every response served;
+# with --record-live, requests missing from the fixtures are fetched from the real TMDb (needs TMDB_API_KEY).
+# The persistent TMDb/Gemini caches and the local catalog are turned off, so every session runs cold.
+# Call counts are identical run to run with --concurrency 1 and PYTHONHASHSEED fixed (the prospector iterates a
+# set of search terms); with concurrency, identical in-flight requests across sessions may also be coalesced.
+# With --regions (more than one), each session recommends for every region from one candidate pool; the mock
+# titles carry certifications and providers for all of them, so HTTP calls per session should not grow.
+# The simulated 429s carry "Retry-After: --tmdb-retry-after"; main's shared rate limiter pauses on them (the
+# "429" column counts them, "espera s" is the time threads spent queued for a TMDb token). The limiters' rates are
+# off unless --tmdb-rate-limit / --gemini-rate-limit are given, so results stay comparable with runs that had no limiter. --max-tmdb-calls
+# and --max-gemini-tokens set the per-run budgets: sessions that exhaust them degrade to the Stage 4 fallback.
+
+BENCHMARK_SCENARIOS = {
+    # Few /search/multi hits -> Stage 3 discover by Gemini's genre hints, then enrichment.
+    'direct_search': {'search_results_per_page': 6, 'discover_results_per_page': 20, 'gemini_genre_hints': True},
+    # Nothing found by search and no genre hints -> Stage 4 generic age-band fallback.
+    'stage4_fallback': {'search_results_per_page': 0, 'discover_results_per_page': 20, 'gemini_genre_hints': False},
+    # Search alone fills the 30-candidate pool; the cost is dominated by enriching all 30.
+    'enrichment_30': {'search_results_per_page': 20, 'discover_results_per_page': 20, 'gemini_genre_hints': True},
+}
+BENCHMARK_PROVIDERS = {8: "Netflix", 337: "Disney Plus", 119: "Amazon Prime Video", 307: "Globoplay"}
+BENCHMARK_CERTIFICATIONS = ("L", "L", "10", "12", "14", "16", "")
+BENCHMARK_REGION_CERTIFICATIONS = { # Extra regions served by the mock (the target region uses BENCHMARK_CERTIFICATIONS)
+    "PT": ("M/3", "M/6", "M/12", "M/14", "M/16", ""), "US": ("G", "PG", "PG", "PG-13", "R", ""),
+    "MX": ("AA", "A", "B", "B-15", "C", ""), "GB": ("U", "PG", "12A", "15", "18", ""),
+}
+BENCHMARK_PROFILE = {'age': 9, 'preferred_platform_names': ["netflix", "disney+"], 'country_code': main.TARGET_COUNTRY_CODE}
+
+def build_fixture_key(path, query_params):
+    return f"{path}?{urlencode(sorted((k, v) for k, v in query_params.items() if k != 'api_key'))}"
+
+def synthetic_title(tmdb_id, media_type):
+    title_random = random.Random(tmdb_id)
+    return {
+        'id': tmdb_id, 'media_type': media_type, ('title' if media_type == 'movie' else 'name'): f"Título de teste {tmdb_id}",
+        'overview': f"Sinopse sintética do título {tmdb_id}, usada apenas no benchmark.", 'popularity': round(title_random.uniform(1, 500), 3),
+    }
+
+class MockTMDbServer(ThreadingHTTPServer):
+    # Local stand-in for api.themoviedb.org/3 with configurable latency, error rate and fixtures.
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, scenario, latency_seconds, error_rate, seed, fixtures=None, live_base_url=None, live_api_key=None, retry_after_seconds=0):
+        super().__init__(("127.0.0.1", 0), MockTMDbRequestHandler)
+        self.scenario = scenario
+        self.regions = [main.TARGET_COUNTRY_CODE] + [region for region in BENCHMARK_REGION_CERTIFICATIONS if region != main.TARGET_COUNTRY_CODE]
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.fixtures = dict(fixtures or {})
+        self.live_base_url = live_base_url
+        self.live_api_key = live_api_key
+        self.served_responses = {}
+        self.request_count = 0
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}/3"
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.error_count = 0
+
+    def should_fail(self):
+        with self._lock:
+            self.request_count += 1
+            failed = self._random.random() < self.error_rate
+            self.error_count += failed
+            return failed
+
+    def build_response(self, path, query_params):
+        fixture_key = build_fixture_key(path, query_params)
+        if fixture_key in self.fixtures:
+            payload = self.fixtures[fixture_key]
+        elif self.live_base_url:
+            live_params = {**query_params, 'api_key': self.live_api_key}
+            response = main.get_tmdb_session().get(f"{self.live_base_url}{path}", params=live_params, timeout=(main.TMDB_CONNECT_TIMEOUT, main.TMDB_READ_TIMEOUT))
+            response.raise_for_status()
+            payload = response.json()
+        else:
+            payload = self.synthetic_payload(path, query_params)
+        with self._lock:
+            self.served_responses[fixture_key] = payload
+        return payload
+
+    def synthetic_payload(self, path, query_params):
+        path_parts = path.strip('/').split('/')
+        page_num = int(query_params.get('page', 1))
+        if path_parts[0] == 'search':
+            results_per_page = self.scenario['search_results_per_page']
+            base_id = 100000 + (sum(query_params.get('query', '').encode('utf-8')) * 131 % 9000) * 100 + page_num * 40
+            return {'page': page_num, 'results': [synthetic_title(base_id + offset, 'movie' if offset % 2 else 'tv') for offset in range(results_per_page)]}
+        if path_parts[0] == 'watch':
+            return {'results': [
+                {'provider_id': provider_id, 'provider_name': provider_name, 'display_priorities': {region: priority for region in self.regions}}
+                for priority, (provider_id, provider_name) in enumerate(BENCHMARK_PROVIDERS.items())
+            ]}
+        if path_parts[0] == 'discover':
+            base_id = 2000000 + sum(query_params.get('with_genres', '').encode('utf-8')) * 1000 + page_num * 40
+            media_type = path_parts[1]
+            return {'page': page_num, 'results': [synthetic_title(base_id + offset, media_type) for offset in range(self.scenario['discover_results_per_page'])]}
+        if len(path_parts) >= 2 and path_parts[1].isdigit():
+            media_type, tmdb_id = path_parts[0], int(path_parts[1])
+            title_random = random.Random(tmdb_id)
+            providers = {main.TARGET_COUNTRY_CODE: {'flatrate': [
+                {'provider_id': provider_id, 'provider_name': BENCHMARK_PROVIDERS[provider_id]}
+                for provider_id in title_random.sample(list(BENCHMARK_PROVIDERS), title_random.randint(0, 2))
+            ]}}
+            if path.endswith("/watch/providers"):
+                return {'id': tmdb_id, 'results': providers}
+            certifications = {main.TARGET_COUNTRY_CODE: title_random.choice(BENCHMARK_CERTIFICATIONS)}
+            title = synthetic_title(tmdb_id, media_type)
+            details = {
+                **title, 'original_title': title.get('title'), 'original_name': title.get('name'),
+                'genres': [{'id': 16, 'name': "Animação"}, {'id': 10751, 'name': "Família"}],
+                'vote_average': round(title_random.uniform(5, 9), 1), 'vote_count': title_random.randint(20, 5000),
+            }
+            for region in self.regions[1:]: # Drawn after the target region's values, which stay the same as before
+                certifications[region] = title_random.choice(BENCHMARK_REGION_CERTIFICATIONS[region])
+                providers[region] = {'flatrate': [
+                    {'provider_id': provider_id, 'provider_name': BENCHMARK_PROVIDERS[provider_id]}
+                    for provider_id in title_random.sample(list(BENCHMARK_PROVIDERS), title_random.randint(0, 2))
+                ]}
+            details['release_dates'] = {'results': [{'iso_3166_1': region, 'release_dates': [{'certification': certification, 'type': 3}]}
+                                                    for region, certification in certifications.items()]}
+            details['content_ratings'] = {'results': [{'iso_3166_1': region, 'rating': certification} for region, certification in certifications.items()]}
+            details['watch/providers'] = {'results': providers}
+            return details
+        return {}
+
+class MockTMDbRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path[len("/3"):] if parsed_url.path.startswith("/3/") else parsed_url.path
+        query_params = dict(parse_qsl(parsed_url.query))
+        time.sleep(self.server.latency_seconds)
+        if self.server.should_fail():
+            status_code, payload = 429, {'status_code': 25, 'status_message': "Simulated rate limit."}
+        else:
+            try:
+                status_code, payload = 200, self.server.build_response(path, query_params)
+            except Exception as e:
+                status_code, payload = 502, {'status_message': str(e)}
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status_code == 429:
+            self.send_header("Retry-After", str(self.server.retry_after_seconds))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGeminiModel:
+    # Stand-in for genai.GenerativeModel: fixed latency, random failures and canned (or fixture) answers per call kind.
+    def __init__(self, latency_seconds, error_rate, seed, genre_hints=True, fixtures=None):
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.genre_hints = genre_hints
+        self.fixtures = fixtures or {}
+        self.call_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None):
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            self.call_count += 1
+            if self._random.random() < self.error_rate:
+                raise RuntimeError("Falha simulada do Gemini (benchmark).")
+        if generation_config:
+            if 'batched' in self.fixtures:
+                return FakeGeminiResponse(self.fixtures['batched'])
+            title_ids = [entry['id'] for entry in json.loads(prompt.split("Títulos selecionados (JSON):\n", 1)[1].split("\n", 1)[0])]
+            return FakeGeminiResponse(json.dumps([
+                {'id': title_id, 'justificativa': "Uma ótima escolha para hoje!", 'existencia': "SIM", 'adequado': True, 'plataforma_mencionada': False}
+                for title_id in title_ids
+            ]))
+        if "TERMOS:" in prompt:
+            interest = prompt.split("interessada em '", 1)[1].split("'", 1)[0] # Per-session terms -> per-session searches
+            genre_line = "\nGENEROS_IDS: 16, 12" if self.genre_hints else ""
+            return FakeGeminiResponse(self.fixtures.get('interest_analysis', f"TERMOS: {interest} aventura, {interest} desenho" + genre_line))
+        if "Pesquisa Google" in prompt:
+            return FakeGeminiResponse(self.fixtures.get('verification', "SIM, é um título real e adequado."))
+        return FakeGeminiResponse(self.fixtures.get('justification', "Uma ótima escolha para hoje, cheia de aventura e diversão!"))
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))] if sorted_values else float('nan')
+
+def run_scenario(scenario_name, args, fixtures):
+    scenario = BENCHMARK_SCENARIOS[scenario_name]
+    live_api_key = main.TMDB_API_KEY if args.record_live else None
+    if args.record_live and not live_api_key:
+        raise SystemExit("🔴 --record-live precisa de TMDB_API_KEY no .env.")
+    server = MockTMDbServer(scenario, args.tmdb_latency_ms / 1000, args.tmdb_error_rate, args.seed, fixtures.get('tmdb'),
+                            "https://api.themoviedb.org/3" if args.record_live else None, live_api_key, args.tmdb_retry_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fake_gemini = FakeGeminiModel(args.gemini_latency_ms / 1000, args.gemini_error_rate, args.seed, scenario['gemini_genre_hints'], fixtures.get('gemini'))
+    main.TMDB_BASE_URL = server.base_url
+    main.TMDB_API_KEY = "benchmark"
+    main.gemini_model = fake_gemini
+    regions = main.parse_region_codes(args.regions)
+
+    def run_session(session_index):
+        # Each session gets its own interest text, so sessions don't share in-flight TMDb requests.
+        user_context = {**BENCHMARK_PROFILE, 'interests_query': f"dinossauros {session_index}"}
+        started_at = time.perf_counter()
+        if len(regions) > 1:
+            results_by_region = main.run_recommendation_pipeline_multi_region(user_context, regions)
+            return (time.perf_counter() - started_at, sum(len(recommendations) for recommendations, _ in results_by_region.values()),
+                    any(fallback for _, fallback in results_by_region.values()))
+        if args.pipeline_mode == "async":
+            final_recommendations, fallback_mode_was_engaged = asyncio.run(main.run_recommendation_pipeline_async(user_context))
+        elif args.pipeline_mode == "lazy":
+            final_recommendations, fallback_mode_was_engaged = main.run_recommendation_pipeline_lazy(user_context)
+        else:
+            final_recommendations, fallback_mode_was_engaged = main.run_recommendation_pipeline(user_context)
+        return time.perf_counter() - started_at, len(final_recommendations), fallback_mode_was_engaged
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_session(-1) # Warm-up: session pool, imports, thread pools
+            server.reset_counters()
+            fake_gemini.call_count = 0
+            main.tmdb_rate_limiter = main.AdaptiveTokenBucket("tmdb", args.tmdb_rate_limit, main.TMDB_RATE_LIMIT_BURST) # Fresh counters per scenario
+            main.gemini_rate_limiter = main.AdaptiveTokenBucket("gemini", args.gemini_rate_limit / 60, main.GEMINI_RATE_LIMIT_BURST)
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                session_results = list(executor.map(run_session, range(args.sessions)))
+            elapsed = time.perf_counter() - started_at
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    latencies_ms = sorted(seconds * 1000 for seconds, _, _ in session_results)
+    return {
+        'scenario': scenario_name, 'sessions': args.sessions, 'concurrency': args.concurrency,
+        'p50_ms': percentile(latencies_ms, 50), 'p95_ms': percentile(latencies_ms, 95),
+        'sessions_per_second': args.sessions / elapsed if elapsed else float('nan'),
+        'http_calls_per_session': server.request_count / args.sessions,
+        'http_errors_injected': server.error_count,
+        'gemini_calls_per_session': fake_gemini.call_count / args.sessions,
+        'recommendations_per_session': sum(count for _, count, _ in session_results) / args.sessions,
+        'fallback_sessions': sum(1 for _, _, fallback in session_results if fallback),
+        'throttled': main.tmdb_rate_limiter.throttled,
+        'rate_limit_wait_seconds': main.tmdb_rate_limiter.waited_seconds,
+    }, server.served_responses
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark reprodutível do pipeline completo com TMDb e Gemini simulados.")
+    parser.add_argument("--scenario", default="all", choices=["all"] + list(BENCHMARK_SCENARIOS))
+    parser.add_argument("--sessions", type=int, default=20, help="Sessões (execuções completas do pipeline) por cenário.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessões simultâneas.")
+    parser.add_argument("--pipeline-mode", default=main.PIPELINE_MODE, choices=["sequential", "async", "lazy"])
+    parser.add_argument("--tmdb-latency-ms", type=float, default=20)
+    parser.add_argument("--tmdb-error-rate", type=float, default=0.0, help="Fração de respostas 429 simuladas (testa as novas tentativas).")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--fixtures", help='JSON {"tmdb": {"/endpoint?params": resposta}, "gemini": {"interest_analysis": "..."}}.')
+    parser.add_argument("--save-fixtures", help="Grava todas as respostas do TMDb servidas neste arquivo de fixtures.")
+    parser.add_argument("--record-live", action="store_true", help="Busca no TMDb real as requisições ausentes das fixtures.")
+    parser.add_argument("--regions", default=main.TARGET_COUNTRY_CODE,
+                        help=f"Regiões recomendadas por sessão (ex.: BR,PT,US; o TMDb simulado serve {main.TARGET_COUNTRY_CODE},{','.join(BENCHMARK_REGION_CERTIFICATIONS)}).")
+    parser.add_argument("--tmdb-retry-after", type=float, default=0, help="Segundos no cabeçalho Retry-After dos 429 simulados.")
+    parser.add_argument("--tmdb-rate-limit", type=float, default=0, help="Chamadas/s do limitador de taxa do TMDb (0 = sem limite).")
+    parser.add_argument("--gemini-rate-limit", type=float, default=0, help="Chamadas/min do limitador de taxa do Gemini (0 = sem limite).")
+    parser.add_argument("--max-tmdb-calls", type=int, default=0, help="Orçamento de chamadas HTTP ao TMDb por sessão (0 = sem limite).")
+    parser.add_argument("--max-gemini-tokens", type=int, default=0, help="Orçamento de tokens do Gemini por sessão (0 = sem limite).")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    main.RUN_MAX_TMDB_CALLS = args.max_tmdb_calls
+    main.RUN_MAX_GEMINI_TOKENS = args.max_gemini_tokens
+    main.TMDB_CACHE_PATH = ""
+    main.GEMINI_CACHE_PATH = ""
+    main.LOCAL_CATALOG_PATH = ""
+    main.WARM_POOLS_PATH = "" # Pools warmed against the real TMDb would skip the simulated one
+    main.AVAILABILITY_INDEX_PATH = "" # An index built against the real TMDb would answer the simulated availability checks
+    main.SESSION_STORE_PATH = "" # Titles persisted as already seen would be filtered out of the simulated sessions
+    fixtures = {}
+    if args.fixtures:
+        with open(args.fixtures, encoding='utf-8') as fixtures_file:
+            fixtures = json.load(fixtures_file)
+
+    scenario_names = list(BENCHMARK_SCENARIOS) if args.scenario == "all" else [args.scenario]
+    recorded_responses = dict(fixtures.get('tmdb', {}))
+    print(f"{'cenário':<16} {'p50 ms':>9} {'p95 ms':>9} {'sessões/s':>10} {'HTTP/sessão':>12} {'Gemini/sessão':>14} {'recs/sessão':>12} {'fallback':>9} {'erros inj.':>11} {'429':>5} {'espera s':>9}")
+    for scenario_name in scenario_names:
+        result, served_responses = run_scenario(scenario_name, args, fixtures)
+        recorded_responses.update(served_responses)
+        print(f"{result['scenario']:<16} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['sessions_per_second']:>10.2f} "
+              f"{result['http_calls_per_session']:>12.1f} {result['gemini_calls_per_session']:>14.1f} {result['recommendations_per_session']:>12.1f} "
+              f"{result['fallback_sessions']:>9} {result['http_errors_injected']:>11} {result['throttled']:>5} {result['rate_limit_wait_seconds']:>9.2f}")
+    if args.save_fixtures:
+        with open(args.save_fixtures, 'w', encoding='utf-8') as fixtures_file:
+            json.dump({'tmdb': recorded_responses, 'gemini': fixtures.get('gemini', {})}, fixtures_file, ensure_ascii=False)
+        print(f"💾 {len(recorded_responses)} respostas do TMDb salvas em '{args.save_fixtures}'.") # User-facing: Portuguese
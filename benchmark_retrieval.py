@@ -0,0 +1,92 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import main
+
+# Compares candidate retrieval strategies on recall and latency:
+#   - "multi-stage": the live agent_content_prospector (Gemini terms -> /search/multi -> /discover fallbacks),
+#   - "semantic": top-k cosine search over the local overview embeddings (SemanticIndex).
+# Relevance labels come from TMDb's own keyword tags: a title is relevant to a query if it is tagged with
+# one of the query's keywords, and only titles present in the local catalog count (both methods can reach them).
+# Usage: python benchmark_retrieval.py [--queries queries.jsonl] [--k 30]
+#   queries.jsonl lines: {"query": "animais falantes", "keywords": ["talking animal"], "age": 7}
+
+DEFAULT_BENCHMARK_QUERIES = [
+    {"query": "dinossauros", "keywords": ["dinosaur"], "age": 8},
+    {"query": "animais falantes", "keywords": ["talking animal"], "age": 6},
+    {"query": "aventura espacial", "keywords": ["space travel", "outer space"], "age": 10},
+    {"query": "princesas", "keywords": ["princess"], "age": 6},
+    {"query": "super-heróis", "keywords": ["superhero"], "age": 11},
+    {"query": "futebol", "keywords": ["soccer"], "age": 9},
+]
+
+def fetch_keyword_ground_truth(keywords, pages=2):
+    # Ids of (movie and TV) titles TMDb tags with any of the given keyword names.
+    relevant_ids = set()
+    for keyword_name in keywords:
+        keyword_search = main.make_tmdb_request("/search/keyword", params={'query': keyword_name, 'page': 1})
+        if not keyword_search or not keyword_search.get('results'):
+            continue
+        keyword_id = keyword_search['results'][0]['id']
+        for media_type in ('movie', 'tv'):
+            for page_num in range(1, pages + 1):
+                data = main.make_tmdb_request(f"/discover/{media_type}", params={'with_keywords': keyword_id, 'page': page_num, 'sort_by': 'popularity.desc'})
+                if not data or not data.get('results'):
+                    break
+                relevant_ids.update(item['id'] for item in data['results'])
+    return relevant_ids
+
+def run_multi_stage(benchmark_query):
+    user_context = {'age': benchmark_query.get('age', 8), 'interests_query': benchmark_query['query'],
+                    'preferred_platform_names': [], 'country_code': main.TARGET_COUNTRY_CODE}
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        prospects, _ = main.agent_content_prospector(user_context, use_local_index=False)
+    return [prospect['tmdb_id'] for prospect in prospects], time.perf_counter() - started_at
+
+def run_semantic(benchmark_query, local_catalog, semantic_index, k):
+    started_at = time.perf_counter()
+    matches = semantic_index.search(benchmark_query['query'], k)
+    retrieved_ids = [local_catalog.tmdb_ids[row] for row, _ in matches]
+    return retrieved_ids, time.perf_counter() - started_at
+
+def recall(retrieved_ids, relevant_ids):
+    return len(set(retrieved_ids) & relevant_ids) / len(relevant_ids) if relevant_ids else float('nan')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara a busca em múltiplas etapas com a busca semântica local.")
+    parser.add_argument("--queries", help="Arquivo JSONL com consultas e palavras-chave do TMDb usadas como gabarito.")
+    parser.add_argument("--k", type=int, default=30, help="Quantidade de candidatos avaliados por método.")
+    args = parser.parse_args()
+
+    local_catalog = main.get_local_catalog()
+    semantic_index = main.get_semantic_index()
+    if not main.TMDB_API_KEY or not local_catalog or not semantic_index:
+        raise SystemExit("🔴 É preciso TMDB_API_KEY e um catálogo local + índice semântico atualizados (rode build_catalog.py).")
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as queries_file:
+            benchmark_queries = [json.loads(line) for line in queries_file if line.strip()]
+    else:
+        benchmark_queries = DEFAULT_BENCHMARK_QUERIES
+
+    catalog_ids = set(local_catalog.tmdb_ids)
+    totals = {'multi-stage': [], 'semantic': []}
+    print(f"{'consulta':<22} {'relevantes':>10} {'recall múltiplas etapas':>24} {'recall semântica':>17} {'ms múltiplas':>13} {'ms semântica':>13}")
+    for benchmark_query in benchmark_queries:
+        relevant_ids = fetch_keyword_ground_truth(benchmark_query['keywords']) & catalog_ids
+        multi_stage_ids, multi_stage_seconds = run_multi_stage(benchmark_query)
+        semantic_ids, semantic_seconds = run_semantic(benchmark_query, local_catalog, semantic_index, args.k)
+        multi_stage_recall = recall(multi_stage_ids[:args.k], relevant_ids)
+        semantic_recall = recall(semantic_ids, relevant_ids)
+        totals['multi-stage'].append((multi_stage_recall, multi_stage_seconds))
+        totals['semantic'].append((semantic_recall, semantic_seconds))
+        print(f"{benchmark_query['query'][:22]:<22} {len(relevant_ids):>10} {multi_stage_recall:>24.2f} {semantic_recall:>17.2f} "
+              f"{multi_stage_seconds * 1000:>13.1f} {semantic_seconds * 1000:>13.2f}")
+    for method_name, results in totals.items():
+        valid_recalls = [value for value, _ in results if value == value] # Skips NaN (no relevant titles in catalog)
+        mean_recall = sum(valid_recalls) / len(valid_recalls) if valid_recalls else float('nan')
+        mean_ms = sum(seconds for _, seconds in results) / len(results) * 1000
+        print(f"Média {method_name}: recall@{args.k} = {mean_recall:.2f}, latência = {mean_ms:.2f} ms")
@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start benchmark: how long a fresh interpreter takes to `import main`, measured with `python -X importtime`.
+#   - "lazy": the plain import (requests, numpy, google.generativeai and asyncio are deferred until first use),
+#   - "warm": the import plus main.preload_heavy_modules() and the Gemini client setup, i.e. what a pre-fork
+#     parent (batch_recommend.py --prefork, service.py) pays once so its workers/requests start warm.
+# Usage: python benchmark_startup.py [--runs 5] [--top 10]
+# Each run is a new process, so module caches are cold (the .pyc files are not: run it twice after edits).
+
+STARTUP_SCENARIOS = {
+    'lazy': "import main",
+    'warm': "import main; main.preload_heavy_modules(); main.get_gemini_model()",
+}
+
+def parse_importtime(stderr_text):
+    # "import time: self [us] | cumulative | <indent>imported package" lines -> [(module name, depth, cumulative_us)].
+    # Depth 0 is a top-level import; nested imports are indented two spaces per level.
+    modules = []
+    for line in stderr_text.splitlines():
+        if not line.startswith("import time:") or line.count("|") < 2:
+            continue
+        _, cumulative_us, indented_name = line[len("import time:"):].split("|", 2)
+        if not cumulative_us.strip().isdigit():
+            continue # The header line
+        module_name = indented_name[1:]
+        modules.append((module_name.strip(), (len(module_name) - len(module_name.lstrip())) // 2, int(cumulative_us)))
+    return modules
+
+def run_startup(code, environment):
+    # One fresh interpreter: (wall seconds for the whole process, parsed importtime lines).
+    started_at = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=environment,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    elapsed = time.perf_counter() - started_at
+    if completed.returncode != 0:
+        raise SystemExit(f"🔴 Falha ao executar '{code}':\n{completed.stderr[-2000:]}")
+    return elapsed, parse_importtime(completed.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede o tempo de inicialização (import main) com python -X importtime.")
+    parser.add_argument("--runs", type=int, default=5, help="Processos novos por cenário (a mediana é reportada).")
+    parser.add_argument("--top", type=int, default=10, help="Módulos mais lentos listados para o cenário 'lazy'.")
+    args = parser.parse_args()
+
+    # Placeholder keys: the startup path is measured without touching the network.
+    environment = {**os.environ, 'TMDB_API_KEY': os.environ.get('TMDB_API_KEY') or "startup-benchmark",
+                   'GEMINI_API_KEY': os.environ.get('GEMINI_API_KEY') or "startup-benchmark"}
+    print(f"{'cenário':<8} {'import main ms':>15} {'após import ms':>15} {'processo ms':>12}")
+    lazy_modules = []
+    for scenario_name, code in STARTUP_SCENARIOS.items():
+        run_results = [run_startup(code, environment) for _ in range(max(1, args.runs))]
+        main_import_ms = statistics.median(
+            next((cumulative_us for name, _, cumulative_us in modules if name == "main"), 0) / 1000 for _, modules in run_results
+        )
+        # Top-level imports after main finished: the deferred modules, in the "warm" scenario
+        after_main_ms = statistics.median(
+            sum(cumulative_us for _, depth, cumulative_us in modules[[name for name, _, _ in modules].index("main") + 1:] if depth == 0) / 1000
+            for _, modules in run_results
+        )
+        process_ms = statistics.median(elapsed for elapsed, _ in run_results) * 1000
+        print(f"{scenario_name:<8} {main_import_ms:>15.1f} {after_main_ms:>15.1f} {process_ms:>12.1f}")
+        if scenario_name == 'lazy':
+            lazy_modules = run_results[-1][1]
+
+    print("\nMódulos mais lentos no 'import main' (tempo acumulado):") # User-facing: Portuguese
+    for module_name, _, cumulative_us in sorted(lazy_modules, key=lambda module: -module[2])[:args.top]:
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {module_name}")
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+import main
+
+# Refresh job for the availability inverted index ((region, provider) -> titles streaming there), read by
+# Agent 4 as a membership check instead of per-title provider lookups. Run it from cron (a few times a day),
+# or let service.py refresh it in the background with --availability-refresh-hours.
+# Usage: python build_availability_index.py [--regions BR,US] [--providers 8,337] [--max-pages 50] [--output availability_index.json.gz]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Constrói o índice de disponibilidade (provedor -> títulos) a partir do /discover do TMDb.")
+    parser.add_argument("--regions", default=main.TARGET_COUNTRY_CODE, help="Países separados por vírgula (ex.: BR,US).")
+    parser.add_argument("--providers", help="IDs de provedores do TMDb separados por vírgula. Padrão: os mais relevantes de cada país.")
+    parser.add_argument("--max-pages", type=int, default=main.AVAILABILITY_MAX_PAGES, help="Páginas do /discover (20 títulos cada) por provedor e tipo.")
+    parser.add_argument("--output", default=main.AVAILABILITY_INDEX_PATH or "availability_index.json.gz", help="Arquivo de saída.")
+    args = parser.parse_args()
+
+    if not main.TMDB_API_KEY:
+        raise SystemExit("🔴 TMDB_API_KEY ausente. Configure-a no arquivo .env.")
+    regions = [region.strip().upper() for region in args.regions.split(',') if region.strip()]
+    provider_ids = [int(provider_id) for provider_id in args.providers.split(',')] if args.providers else None
+    started_at = time.time()
+    availability_index = main.refresh_availability_index(regions, provider_ids, args.max_pages, args.output)
+    for (region, provider_id, media_type), ids in sorted(availability_index.postings.items()):
+        completeness = "completo" if (region, provider_id, media_type) in availability_index.complete_keys else "parcial (mais populares)"
+        print(f"  {region} provedor {provider_id:>5} {media_type:<5}: {len(ids):>6} títulos, {completeness}") # User-facing: Portuguese
+    print(f"✅ Índice de disponibilidade salvo em '{args.output}' ({time.time() - started_at:.1f}s).") # User-facing: Portuguese
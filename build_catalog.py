@@ -0,0 +1,84 @@
+import argparse
+import gzip
+import heapq
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import main
+
+# Offline ingestion: builds the local catalog index read by agent_content_prospector.
+# Usage: python build_catalog.py [--date YYYY-MM-DD] [--limit-per-type 5000] [--output catalog_index.json.gz]
+# Also writes the overview embeddings (SemanticIndex) used by the prospector's semantic retrieval stage.
+
+TMDB_EXPORTS_BASE_URL = "https://files.tmdb.org/p/exports"
+EXPORT_FILE_PREFIXES = {'movie': "movie_ids", 'tv': "tv_series_ids"}
+
+def iter_daily_export(media_type, export_date):
+    # Streams one TMDb daily ID export (gzip'd JSON lines: id, original_title/name, popularity, adult...).
+    export_url = f"{TMDB_EXPORTS_BASE_URL}/{EXPORT_FILE_PREFIXES[media_type]}_{export_date.strftime('%m_%d_%Y')}.json.gz"
+    print(f"⬇️  Baixando exportação diária do TMDb: {export_url}") # User-facing: Portuguese
+    response = main.get_tmdb_session().get(export_url, stream=True, timeout=(main.TMDB_CONNECT_TIMEOUT, main.TMDB_READ_TIMEOUT))
+    response.raise_for_status()
+    with gzip.GzipFile(fileobj=response.raw) as export_file:
+        for line in export_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get('adult') or entry.get('video'):
+                continue
+            yield entry
+
+def fetch_catalog_record(media_type, tmdb_id, region):
+    # One details call (with certification + providers appended) -> one catalog record, or None.
+    append_param = "release_dates" if media_type == 'movie' else "content_ratings"
+    details = main.make_tmdb_request(f"/{media_type}/{tmdb_id}", params={
+        'append_to_response': f"{append_param},watch/providers", 'language': main.TARGET_LANGUAGE_TMDB
+    })
+    if not details:
+        return None
+    title = details.get('title') if media_type == 'movie' else details.get('name')
+    if not title:
+        return None
+    region_providers = details.get('watch/providers', {}).get('results', {}).get(region, {})
+    return {
+        'tmdb_id': tmdb_id, 'media_type': media_type, 'title': title,
+        'original_title': details.get('original_title') if media_type == 'movie' else details.get('original_name'),
+        'overview': details.get('overview', ''),
+        'popularity': details.get('popularity', 0.0),
+        'vote_average': details.get('vote_average', 0.0),
+        'vote_count': details.get('vote_count', 0),
+        'certification': main.extract_age_certification(details, media_type, region),
+        'genres': [(genre['id'], genre['name']) for genre in details.get('genres', [])],
+        'providers': [(provider['provider_id'], provider['provider_name']) for provider in region_providers.get('flatrate', [])],
+    }
+
+def build_local_catalog(export_date, limit_per_type, region):
+    # Keeps the limit_per_type most popular ids of each export and fetches their details concurrently.
+    records = []
+    for media_type in EXPORT_FILE_PREFIXES:
+        top_entries = heapq.nlargest(limit_per_type, iter_daily_export(media_type, export_date), key=lambda entry: entry.get('popularity', 0.0))
+        print(f"🧩 Buscando detalhes de {len(top_entries)} títulos ({media_type})...") # User-facing: Portuguese
+        fetched = main.run_bounded_concurrently(lambda entry: fetch_catalog_record(media_type, entry['id'], region), top_entries)
+        records.extend(record for record in fetched if record is not None)
+    return main.LocalCatalog.from_records(records, region, main.TARGET_LANGUAGE_TMDB)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Constrói o catálogo local a partir das exportações diárias do TMDb.")
+    parser.add_argument("--date", help="Data da exportação (AAAA-MM-DD). Padrão: ontem (UTC).")
+    parser.add_argument("--limit-per-type", type=int, default=5000, help="Títulos mais populares mantidos por tipo (filme/série).")
+    parser.add_argument("--region", default=main.TARGET_COUNTRY_CODE, help="País usado para classificação indicativa e provedores.")
+    parser.add_argument("--output", default=main.LOCAL_CATALOG_PATH or "catalog_index.json.gz", help="Arquivo de saída.")
+    parser.add_argument("--semantic-output", default=main.SEMANTIC_INDEX_PATH or "semantic_index.npz", help="Arquivo do índice semântico (sinopses).")
+    args = parser.parse_args()
+
+    if not main.TMDB_API_KEY:
+        raise SystemExit("🔴 TMDB_API_KEY ausente. Configure-a no arquivo .env.")
+    export_date = datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.now(timezone.utc) - timedelta(days=1)
+    started_at = time.time()
+    catalog = build_local_catalog(export_date, args.limit_per_type, args.region)
+    catalog.save(args.output)
+    main.SemanticIndex.build(catalog).save(args.semantic_output)
+    print(f"✅ Catálogo local salvo em '{args.output}': {len(catalog)} títulos, {len(catalog.title_index)} tokens de título, "
+          f"{len(catalog.genre_index)} gêneros ({time.time() - started_at:.1f}s).") # User-facing: Portuguese
+    print(f"✅ Índice semântico salvo em '{args.semantic_output}'.") # User-facing: Portuguese
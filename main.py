@@ -1,9 +1,56 @@
 import os
-import requests
-import google.generativeai as genai
+import sys
+import bisect
+import contextlib
+import contextvars
+from collections import Counter, OrderedDict, deque
+import difflib
+import functools
+import importlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
 import json
 import unicodedata # Adicione esta linha
+import gzip
+import zlib
+from array import array
+import hashlib
+import re
+import sqlite3
+import pickle
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+
+# --- LAZY IMPORTS ---
+# requests, numpy and google.generativeai take most of the import time (python -X importtime, or benchmark_startup.py),
+# so they are only imported when first used. Runs that never reach Gemini (TMDb-only, cached) never import it.
+
+class LazyModule:
+    # Stand-in for a module, imported on first attribute access (np.zeros, requests.Session, ...).
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name) # Thread-safe: importlib holds a per-module lock
+        return getattr(self._module, attribute)
+
+requests = LazyModule("requests")
+np = LazyModule("numpy")
+genai = LazyModule("google.generativeai")
+asyncio = LazyModule("asyncio") # Only PIPELINE_MODE=async needs it
+HEAVY_MODULES = ("requests", "urllib3.util.retry", "numpy", "google.generativeai", "asyncio")
+
+def preload_heavy_modules():
+    # Imports every deferred module now (pre-fork warm-up: forked workers inherit them already imported).
+    # Returns the seconds it took.
+    started_at = time.perf_counter()
+    for module_name in HEAVY_MODULES:
+        importlib.import_module(module_name)
+    return time.perf_counter() - started_at
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -12,48 +59,830 @@ TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 # Nova linha para carregar o ID do modelo Gemini do .env
 GEMINI_MODEL_ID_FROM_ENV = os.getenv("GEMINI_MODEL_ID", 'gemini-1.5-flash-latest') # Define um fallback
 
-gemini_model = None
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        # Usa a variável carregada do .env (ou o fallback)
-        gemini_model = genai.GenerativeModel(GEMINI_MODEL_ID_FROM_ENV) 
-        print(f"✅ API do Gemini configurada com sucesso usando o modelo: {GEMINI_MODEL_ID_FROM_ENV}.") # User-facing: Portuguese
-    except Exception as e:
-        print(f"🔴 Erro ao configurar a API do Gemini com o modelo '{GEMINI_MODEL_ID_FROM_ENV}': {e}. Funcionalidades do Gemini serão puladas.") # User-facing: Portuguese
-else:
+gemini_model = None # Created on first use by get_gemini_model (benchmarks may assign a stand-in instead)
+_gemini_model_initialized = False
+_gemini_model_lock = threading.Lock()
+if not GEMINI_API_KEY:
     print("⚠️  GEMINI_API_KEY não encontrada no arquivo .env. Funcionalidades do Gemini serão puladas.") # User-facing: Portuguese
 
+def get_gemini_model():
+    # The Gemini model, or None without GEMINI_API_KEY (or when setup failed). google.generativeai is imported
+    # and configured on the first call, not at import time.
+    global gemini_model, _gemini_model_initialized
+    if gemini_model is None and not _gemini_model_initialized and GEMINI_API_KEY:
+        with _gemini_model_lock:
+            if gemini_model is None and not _gemini_model_initialized:
+                try:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                    # Usa a variável carregada do .env (ou o fallback)
+                    gemini_model = genai.GenerativeModel(GEMINI_MODEL_ID_FROM_ENV) 
+                    print(f"✅ API do Gemini configurada com sucesso usando o modelo: {GEMINI_MODEL_ID_FROM_ENV}.") # User-facing: Portuguese
+                except Exception as e:
+                    print(f"🔴 Erro ao configurar a API do Gemini com o modelo '{GEMINI_MODEL_ID_FROM_ENV}': {e}. Funcionalidades do Gemini serão puladas.") # User-facing: Portuguese
+                _gemini_model_initialized = True
+    return gemini_model
+
+def is_gemini_available():
+    # Cheap check that gates the Gemini steps: it imports and configures nothing, so cached answers never pay for setup.
+    return gemini_model is not None or (bool(GEMINI_API_KEY) and not _gemini_model_initialized)
+
 if not TMDB_API_KEY:
     print("🔴 TMDB_API_KEY não encontrada no arquivo .env. Funcionalidades do TMDb não funcionarão. Por favor, configure-a e reinicie.") # User-facing: Portuguese
 
 TMDB_BASE_URL = "https://api.themoviedb.org/3"
-TARGET_COUNTRY_CODE = "BR" # Hardcoded for Brazil
-TARGET_LANGUAGE_TMDB = "pt-BR" # For TMDb results in Portuguese
+TARGET_COUNTRY_CODE = os.getenv("TARGET_COUNTRY_CODE", "BR").strip().upper() # Default region for profiles that don't set one
+TARGET_LANGUAGE_TMDB = os.getenv("TARGET_LANGUAGE_TMDB", "pt-BR") # For TMDb results in Portuguese; one language for every region, so details are fetched once per title
+RECOMMENDATION_REGIONS = [region.strip().upper() for region in os.getenv("RECOMMENDATION_REGIONS", "").split(',') if region.strip()] # CLI: recommend for several regions at once (e.g. "BR,PT,US")
+CERTIFICATION_TABLES_PATH = os.getenv("CERTIFICATION_TABLES_PATH", "") # Optional JSON {"REGION": {"certification": min_age}} merged over the built-in tables
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential").lower() # "sequential", "async" (overlapped stages) or "lazy" (stops once the top 3 is final)
+LAZY_PIPELINE_LOOKAHEAD = max(1, int(os.getenv("LAZY_PIPELINE_LOOKAHEAD", "4"))) # Lazy mode: candidates enriched/checked ahead of the one being judged (1 = strictly one at a time)
+GEMINI_BATCHED_CALLS = os.getenv("GEMINI_BATCHED_CALLS", "false").lower() in ("1", "true", "yes") # One Gemini call for all justifications + verifications
+
+# HTTP connection pooling / retry settings for TMDb (overridable via .env)
+TMDB_POOL_SIZE = int(os.getenv("TMDB_POOL_SIZE", "10")) # Max keep-alive connections kept open to TMDb
+TMDB_MAX_RETRIES = int(os.getenv("TMDB_MAX_RETRIES", "3")) # Retries for 429/5xx responses and connection errors
+TMDB_BACKOFF_FACTOR = float(os.getenv("TMDB_BACKOFF_FACTOR", "0.5")) # Exponential backoff base (0.5s, 1s, 2s...)
+TMDB_CONNECT_TIMEOUT = float(os.getenv("TMDB_CONNECT_TIMEOUT", "3.05")) # Seconds to establish the connection
+TMDB_READ_TIMEOUT = float(os.getenv("TMDB_READ_TIMEOUT", "10")) # Seconds to wait for response bytes
+TMDB_RETRY_STATUS_CODES = (500, 502, 503, 504) # 429s are retried by fetch_tmdb_payload, through the shared rate limiter
+TMDB_MAX_CONCURRENCY = max(1, int(os.getenv("TMDB_MAX_CONCURRENCY", "8"))) # Global cap on in-flight TMDb requests (1 = serial)
+TMDB_RATE_LIMIT_PER_SECOND = float(os.getenv("TMDB_RATE_LIMIT_PER_SECOND", "40")) # TMDb HTTP calls per second, per process (TMDb allows ~50/s per IP); 0 = no limit
+TMDB_RATE_LIMIT_BURST = float(os.getenv("TMDB_RATE_LIMIT_BURST", "40")) # Calls that may go out back to back before the rate applies (one CLI run never waits)
+GEMINI_RATE_LIMIT_PER_MINUTE = float(os.getenv("GEMINI_RATE_LIMIT_PER_MINUTE", "300")) # Gemini calls (cache misses) per minute, per process - match your quota; 0 = no limit
+GEMINI_RATE_LIMIT_BURST = float(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2")) # Retries after a quota error (429 / ResourceExhausted)
+UPSTREAM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_SECONDS", "30")) # Longest wait for a rate-limit token before the call counts as failed
+RUN_MAX_TMDB_CALLS = int(os.getenv("RUN_MAX_TMDB_CALLS", "0")) # TMDb HTTP calls per run (cache hits are free); past it the run degrades to the Stage 4 fallback. 0 = unlimited
+RUN_MAX_GEMINI_TOKENS = int(os.getenv("RUN_MAX_GEMINI_TOKENS", "0")) # Gemini tokens (prompt + answer) per run; past it the Gemini steps use their non-Gemini fallbacks. 0 = unlimited
+LOCAL_CATALOG_PATH = os.getenv("LOCAL_CATALOG_PATH", "catalog_index.json.gz") # Built by build_catalog.py; ignored if missing
+LOCAL_CATALOG_MAX_AGE_HOURS = float(os.getenv("LOCAL_CATALOG_MAX_AGE_HOURS", "36")) # Older catalogs are ignored (daily exports)
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "semantic_index.npz") # Overview embeddings built alongside the local catalog
+SEMANTIC_TOP_K = int(os.getenv("SEMANTIC_TOP_K", "20")) # Semantic matches added to the prospect pool (0 disables the stage)
+SEMANTIC_MIN_SIMILARITY = float(os.getenv("SEMANTIC_MIN_SIMILARITY", "0.12")) # Cosine similarity floor for a semantic match
+PROSPECTOR_FAN_OUT = os.getenv("PROSPECTOR_FAN_OUT", "false").lower() in ("1", "true", "yes") # Issue each search stage's queries concurrently
+AVAILABILITY_INDEX_PATH = os.getenv("AVAILABILITY_INDEX_PATH", "availability_index.json.gz") # (region, provider) -> titles; built by build_availability_index.py
+AVAILABILITY_INDEX_MAX_AGE_HOURS = float(os.getenv("AVAILABILITY_INDEX_MAX_AGE_HOURS", "24")) # Older indexes are ignored
+AVAILABILITY_PROVIDERS_PER_REGION = int(os.getenv("AVAILABILITY_PROVIDERS_PER_REGION", "10")) # Providers indexed per region (by TMDb display priority)
+AVAILABILITY_MAX_PAGES = int(os.getenv("AVAILABILITY_MAX_PAGES", "50")) # /discover pages (20 titles each) per provider and media type; TMDb stops at 500
+PROSPECTOR_RESTRICT_TO_USER_PROVIDERS = os.getenv("PROSPECTOR_RESTRICT_TO_USER_PROVIDERS", "false").lower() in ("1", "true", "yes") # /discover stages only return titles on the user's platforms
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", ".recommendation_sessions.sqlite3") # Follow-up sessions + each profile's seen/rejected titles; empty = memory only
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600))) # How long a session's candidate pool keeps serving "3 more" / "not this one"
+SESSION_MAX_IN_MEMORY = int(os.getenv("SESSION_MAX_IN_MEMORY", "256")) # Live sessions kept unpickled (least recently used ones are reloaded from disk)
+PROFILE_SEEN_TTL_DAYS = float(os.getenv("PROFILE_SEEN_TTL_DAYS", "90")) # Titles already shown to a profile come back after this; rejected ones never do
+SESSION_REJECTED_GENRE_WEIGHT = 0.5 # Follow-up ranking: popularity multiplier per genre shared with a title rejected in the session
+WARM_POOLS_PATH = os.getenv("WARM_POOLS_PATH", "warm_pools.pkl.gz") # Ready-to-rank candidate pools built by warm_pools.py (or service.py); ignored if missing
+WARM_POOL_TTL_SECONDS = int(os.getenv("WARM_POOL_TTL_SECONDS", str(6 * 3600))) # Older warm pools are ignored (providers change as often as TMDb's provider cache)
+WARM_POOLS_TOP_QUERIES = int(os.getenv("WARM_POOLS_TOP_QUERIES", "50")) # Most frequent logged interest queries warmed besides the age-band fallbacks
+WARM_POOLS_LOG_WINDOW_DAYS = float(os.getenv("WARM_POOLS_LOG_WINDOW_DAYS", "7")) # Query log entries counted when ranking the interests to warm
+WARM_POOLS_ANSWER_COLD_REQUESTS = os.getenv("WARM_POOLS_ANSWER_COLD_REQUESTS", "true").lower() in ("1", "true", "yes") # service.py: answer a cold query from its age-band pool while the real one is built
+INTEREST_QUERY_LOG_PATH = os.getenv("INTEREST_QUERY_LOG_PATH", "interest_queries.jsonl") # One JSON line per request (no profile_id), read by the warmer; empty = no log
+TRACE_PATH = os.getenv("TRACE_PATH", "") # Chrome trace JSON (chrome://tracing, Perfetto) written after each run; empty = tracing off
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "100000")) # Spans kept per run; later ones are only counted (0 = no cap)
+
+# Persistent TMDb response cache (SQLite). Set TMDB_CACHE_PATH to an empty string to disable it.
+TMDB_CACHE_PATH = os.getenv("TMDB_CACHE_PATH", ".tmdb_cache.sqlite3")
+TMDB_CACHE_MAX_ENTRIES = int(os.getenv("TMDB_CACHE_MAX_ENTRIES", "20000")) # Least-recently-used entries are evicted past this
+TMDB_CACHE_PROVIDERS_TTL_SECONDS = 6 * 3600 # Streaming catalogs change often
+PROVIDER_REGISTRY_TTL_SECONDS = int(os.getenv("PROVIDER_REGISTRY_TTL_SECONDS", str(7 * 24 * 3600))) # Per-region provider lists (names/ids) change rarely
+PROVIDER_REGISTRY_RETRY_SECONDS = 300 # Retry interval after a failed provider list load
+TMDB_CACHE_TTL_SECONDS = [ # First matching endpoint pattern wins
+    (re.compile(r"^/watch/providers/(movie|tv)$"), PROVIDER_REGISTRY_TTL_SECONDS),
+    (re.compile(r"/watch/providers$"), TMDB_CACHE_PROVIDERS_TTL_SECONDS),
+    # No entry for /movie/{id} and /tv/{id}: details are always fetched with append_to_response=watch/providers,
+    # so they expire with the providers (get_tmdb_cache_ttl) rather than after a longer details TTL.
+    (re.compile(r"^/discover/"), 24 * 3600),
+    (re.compile(r"^/search/"), 24 * 3600),
+]
+TMDB_CACHE_DEFAULT_TTL_SECONDS = 3600
+
+# Persistent Gemini response cache (SQLite), keyed on model + normalized prompt inputs. Empty path disables it.
+GEMINI_CACHE_PATH = os.getenv("GEMINI_CACHE_PATH", ".gemini_cache.sqlite3")
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "5000")) # Least-recently-used entries are evicted past this
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GEMINI_CACHE_NEAR_DUPLICATE_SIMILARITY = float(os.getenv("GEMINI_CACHE_NEAR_DUPLICATE_SIMILARITY", "0")) # e.g. 0.9 reuses the interest analysis of a near-identical query (0 = exact only)
+
+# --- TRACING ---
+# Spans for every agent, TMDb request and Gemini call, exported as Chrome trace "complete" events plus a
+# per-run summary table. Each run (a CLI execution, a service request, a batch work unit) gets its own tracer
+# through trace_run, held in a context variable like the run budget, and writes it to TRACE_PATH when it ends.
+# With tracing off, trace_span hands back a shared no-op span and @traced is one context variable lookup,
+# so the disabled cost is a function call.
+
+class TraceSpan:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'started_at')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.started_at = 0.0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self, time.perf_counter())
+        return False
+
+class NullTraceSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_TRACE_SPAN = NullTraceSpan()
+
+class Tracer:
+    # Collects finished spans (thread-safe) for one run, up to max_events of them.
+    def __init__(self, max_events=None):
+        self._lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.max_events = TRACE_MAX_EVENTS if max_events is None else max_events
+        self.events = []
+        self.dropped_events = 0
+        self.exported_path = None # Set by trace_run once the trace is written
+
+    def span(self, name, category, **args):
+        return TraceSpan(self, name, category, args)
+
+    def record(self, span, finished_at):
+        event = {
+            'name': span.name, 'cat': span.category, 'ph': "X", 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': round((span.started_at - self.origin) * 1e6, 1), 'dur': round((finished_at - span.started_at) * 1e6, 1),
+            'args': span.args,
+        }
+        with self._lock:
+            if self.max_events and len(self.events) >= self.max_events:
+                self.dropped_events += 1
+            else:
+                self.events.append(event)
+
+    def write_chrome_trace(self, path):
+        # Written beside the target and renamed over it, so runs finishing together (service requests, batch
+        # workers) leave the whole trace of one of them rather than an interleaving of both.
+        with self._lock:
+            events = list(self.events)
+            dropped_events = self.dropped_events
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms", 'otherData': {'dropped_events': dropped_events}},
+                      trace_file, ensure_ascii=False, default=str)
+        os.replace(temporary_path, path)
+
+    def summary_rows(self):
+        # One row per span name: calls, total/mean/p95/max ms, cache hits and payload bytes.
+        with self._lock:
+            events = list(self.events)
+        grouped = {}
+        for event in events:
+            grouped.setdefault((event['cat'], event['name']), []).append(event)
+        rows = []
+        for (category, name), group in grouped.items():
+            durations_ms = sorted(event['dur'] / 1000 for event in group)
+            rows.append({
+                'category': category, 'name': name, 'calls': len(group),
+                'total_ms': sum(durations_ms), 'mean_ms': sum(durations_ms) / len(durations_ms),
+                'p95_ms': durations_ms[min(len(durations_ms) - 1, int(len(durations_ms) * 0.95))], 'max_ms': durations_ms[-1],
+                'cache_hits': sum(1 for event in group if event['args'].get('cache') in ("hit", "near_duplicate")),
+                'bytes': sum(event['args'].get('bytes', 0) for event in group),
+            })
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def format_summary(self):
+        lines = [f"{'categoria':<8} {'etapa':<44} {'chamadas':>8} {'total ms':>10} {'média ms':>9} {'p95 ms':>9} {'máx ms':>9} {'cache':>6} {'bytes':>10}"]
+        for row in self.summary_rows():
+            lines.append(
+                f"{row['category']:<8} {row['name'][:44]:<44} {row['calls']:>8} {row['total_ms']:>10.1f} {row['mean_ms']:>9.1f} "
+                f"{row['p95_ms']:>9.1f} {row['max_ms']:>9.1f} {row['cache_hits']:>6} {row['bytes']:>10}"
+            )
+        if self.dropped_events:
+            lines.append(f"(+{self.dropped_events} etapas não registradas: limite de {self.max_events} por execução)") # User-facing: Portuguese
+        return "\n".join(lines)
+
+_current_tracer = contextvars.ContextVar("tracer", default=None)
+
+@contextlib.contextmanager
+def trace_run(path=None):
+    # Opens a run's tracer when tracing is on (path, or TRACE_PATH by default), or joins the one already open.
+    # The run that opened it writes the trace when it ends and drops it, so no spans outlive their run.
+    tracer = _current_tracer.get()
+    path = TRACE_PATH if path is None else path
+    if tracer is not None or not path:
+        yield tracer
+        return
+    tracer = Tracer()
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+        try:
+            tracer.write_chrome_trace(path)
+            tracer.exported_path = path
+        except OSError as e:
+            print(f"⚠️  Não foi possível salvar o trace em '{path}': {e}") # User-facing: Portuguese
+
+def enable_tracing():
+    # Starts a fresh trace in the current context (for tools that trace without TRACE_PATH and export it
+    # themselves) and returns the tracer.
+    tracer = Tracer()
+    _current_tracer.set(tracer)
+    return tracer
+
+def get_tracer():
+    return _current_tracer.get()
+
+def trace_span(name, category, **args):
+    tracer = _current_tracer.get()
+    return tracer.span(name, category, **args) if tracer is not None else NULL_TRACE_SPAN
+
+def traced(category):
+    # Decorator: records a span named after the function around each call while tracing is on.
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _current_tracer.get()
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(function.__name__, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- UPSTREAM RATE LIMITS AND RUN BUDGETS ---
+# Every TMDb HTTP call and every Gemini call (cache misses only) first takes a token from its upstream's bucket.
+# - The buckets adapt: a 429 / quota error halves the rate and pauses the bucket for Retry-After, so every
+#   thread backs off together; each success then creeps the rate back up to the configured ceiling.
+# - Priority lanes: while an interactive caller is waiting, background callers (index refreshes, prefetch)
+#   get no tokens, so user-facing calls such as justifications go first.
+# - Run budgets cap the TMDb calls and Gemini tokens one pipeline run may spend. The run budget and the lane
+#   travel in context variables (copied into worker threads by submit_with_context / run_bounded_concurrently).
+# The buckets are per process: with batch_recommend.py --workers N, each worker gets the configured rates.
+
+UPSTREAM_LANE_INTERACTIVE = 0
+UPSTREAM_LANE_BACKGROUND = 1
+UPSTREAM_LANE_COUNT = 2
+UPSTREAM_RATE_DECREASE_FACTOR = 0.5 # Multiplicative decrease on a 429
+UPSTREAM_RATE_RECOVERY_STEP = 0.05 # Additive increase per success, as a fraction of the ceiling
+UPSTREAM_MIN_RATE_FRACTION = 0.05 # The rate never drops below this fraction of the ceiling
+GEMINI_CHARS_PER_TOKEN = 4 # Rough prompt size estimate, checked against the budget before the call
+GEMINI_ESTIMATED_OUTPUT_TOKENS = 300 # Answer size assumed until usage_metadata reports the real one
+
+class AdaptiveTokenBucket:
+    # Token bucket for one upstream, shared by every thread. rate_per_second <= 0 means no rate limit
+    # (429 pauses still apply).
+    def __init__(self, name, rate_per_second, burst):
+        self.name = name
+        self.max_rate = rate_per_second
+        self.rate = rate_per_second
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting_by_lane = [0] * UPSTREAM_LANE_COUNT
+        self.granted = 0
+        self.throttled = 0
+        self.timed_out = 0
+        self.waited_seconds = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def acquire(self, lane=UPSTREAM_LANE_INTERACTIVE, timeout=None):
+        # Blocks until a token is free and no more urgent lane is waiting. Returns False if timeout runs out first.
+        started_at = time.monotonic()
+        deadline = None if timeout is None else started_at + timeout
+        with self._condition:
+            self.waiting_by_lane[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    has_token = self.rate <= 0 or self.tokens >= 1
+                    if now >= self.paused_until and has_token and not any(self.waiting_by_lane[:lane]):
+                        if self.rate > 0:
+                            self.tokens -= 1
+                        self.granted += 1
+                        self.waited_seconds += now - started_at
+                        return True
+                    if now < self.paused_until:
+                        wait_seconds = self.paused_until - now
+                    elif not has_token:
+                        wait_seconds = (1 - self.tokens) / self.rate
+                    else: # A more urgent lane is waiting; it notifies when it takes its token
+                        wait_seconds = 1 / self.rate if self.rate > 0 else 0.05
+                    if deadline is not None:
+                        if now >= deadline:
+                            self.timed_out += 1
+                            return False
+                        wait_seconds = min(wait_seconds, deadline - now)
+                    self._condition.wait(wait_seconds)
+            finally:
+                self.waiting_by_lane[lane] -= 1
+                self._condition.notify_all()
+
+    def on_throttled(self, retry_after_seconds=None):
+        # The upstream said "too many requests": pause everyone for Retry-After (or one token's worth) and halve
+        # the rate. 429s from calls already in flight during the pause don't halve it again.
+        with self._condition:
+            now = time.monotonic()
+            self.throttled += 1
+            if now >= self.paused_until and self.max_rate > 0:
+                self.rate = max(self.max_rate * UPSTREAM_MIN_RATE_FRACTION, self.rate * UPSTREAM_RATE_DECREASE_FACTOR)
+            pause_seconds = retry_after_seconds if retry_after_seconds is not None else (1 / self.rate if self.rate > 0 else 1.0)
+            self.paused_until = max(self.paused_until, now + pause_seconds)
+            self.tokens = 0.0
+            self.updated_at = self.paused_until
+            self._condition.notify_all()
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            with self._condition:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * UPSTREAM_RATE_RECOVERY_STEP)
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'rate_per_second': round(self.rate, 3), 'max_rate_per_second': self.max_rate,
+                'granted': self.granted, 'throttled': self.throttled, 'timed_out': self.timed_out,
+                'waited_seconds': round(self.waited_seconds, 3), 'waiting': sum(self.waiting_by_lane),
+            }
+
+tmdb_rate_limiter = AdaptiveTokenBucket("tmdb", TMDB_RATE_LIMIT_PER_SECOND, TMDB_RATE_LIMIT_BURST)
+gemini_rate_limiter = AdaptiveTokenBucket("gemini", GEMINI_RATE_LIMIT_PER_MINUTE / 60, GEMINI_RATE_LIMIT_BURST)
+
+def parse_retry_after(header_value):
+    # Retry-After is either delay-seconds or an HTTP date. Returns seconds (>= 0), or None if absent/unreadable.
+    if not header_value:
+        return None
+    try:
+        return max(0.0, float(header_value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(header_value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_gemini_quota_retry_after(error):
+    # Seconds to back off if error is a Gemini quota/rate error (google.api_core ResourceExhausted, HTTP 429), else None.
+    if getattr(error, 'code', None) != 429 and type(error).__name__ not in ("ResourceExhausted", "TooManyRequests"):
+        return None
+    retry_delay_match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)|retry in ([\d.]+)\s*s", str(error))
+    if retry_delay_match:
+        return float(retry_delay_match.group(1) or retry_delay_match.group(2))
+    return 1.0
+
+class UpstreamBudgetExceeded(RuntimeError):
+    pass
+
+class RunBudget:
+    # What one pipeline run may spend upstream (0 = unlimited). Shared by the run's worker threads.
+    def __init__(self, max_tmdb_calls=0, max_gemini_tokens=0):
+        self.max_tmdb_calls = max_tmdb_calls
+        self.max_gemini_tokens = max_gemini_tokens
+        self.tmdb_calls = 0
+        self.gemini_tokens = 0
+        self.exhausted = set() # Upstreams that refused a call in this run
+        self._lock = threading.Lock()
+
+    def spend_tmdb_call(self):
+        # Counts one TMDb HTTP call; False (with a one-time notice) once the budget is spent.
+        with self._lock:
+            if not self.max_tmdb_calls or self.tmdb_calls < self.max_tmdb_calls:
+                self.tmdb_calls += 1
+                return True
+            first_refusal = "tmdb" not in self.exhausted
+            self.exhausted.add("tmdb")
+        if first_refusal:
+            print(f"⚠️  Orçamento de {self.max_tmdb_calls} chamadas ao TMDb desta execução esgotado. Só respostas já em cache serão usadas.") # User-facing: Portuguese
+        return False
+
+    def reserve_gemini_tokens(self, estimated_tokens):
+        # Reserves a call's estimated tokens or raises UpstreamBudgetExceeded; settle_gemini_tokens fixes the estimate.
+        with self._lock:
+            if self.max_gemini_tokens and self.gemini_tokens + estimated_tokens > self.max_gemini_tokens:
+                self.exhausted.add("gemini")
+                raise UpstreamBudgetExceeded(f"orçamento de {self.max_gemini_tokens} tokens do Gemini desta execução esgotado")
+            self.gemini_tokens += estimated_tokens
+
+    def settle_gemini_tokens(self, estimated_tokens, actual_tokens):
+        with self._lock:
+            self.gemini_tokens += actual_tokens - estimated_tokens
+
+    def is_exhausted(self, upstream):
+        return upstream in self.exhausted
+
+_current_run_budget = contextvars.ContextVar("run_budget", default=None)
+_current_upstream_lane = contextvars.ContextVar("upstream_lane", default=UPSTREAM_LANE_INTERACTIVE)
+
+@contextlib.contextmanager
+def run_budget(max_tmdb_calls=None, max_gemini_tokens=None):
+    # Opens a run's budget (RUN_MAX_TMDB_CALLS / RUN_MAX_GEMINI_TOKENS by default), or joins the one already
+    # open, so a runner that calls build_candidate_pool and then Agent 5 spends a single budget.
+    budget = _current_run_budget.get()
+    if budget is not None:
+        yield budget
+        return
+    budget = RunBudget(RUN_MAX_TMDB_CALLS if max_tmdb_calls is None else max_tmdb_calls,
+                       RUN_MAX_GEMINI_TOKENS if max_gemini_tokens is None else max_gemini_tokens)
+    token = _current_run_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_run_budget.reset(token)
+
+def is_run_budget_exhausted(upstream):
+    budget = _current_run_budget.get()
+    return budget is not None and budget.is_exhausted(upstream)
+
+@contextlib.contextmanager
+def upstream_lane(lane):
+    # Calls made inside the block (and in the worker threads it starts) queue in this priority lane.
+    token = _current_upstream_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_upstream_lane.reset(token)
+
+def submit_with_context(executor, function, *args):
+    # executor.submit, carrying the caller's run budget, lane and tracer (context variables don't follow threads on their own).
+    return executor.submit(contextvars.copy_context().run, function, *args)
+
+def get_rate_limit_stats():
+    return {bucket.name: bucket.snapshot() for bucket in (tmdb_rate_limiter, gemini_rate_limiter)}
 
 # --- HELPER FUNCTIONS ---
 
+_tmdb_session = None
+_tmdb_session_lock = threading.Lock()
+# Shared by every thread that talks to TMDb, so the in-flight cap holds no matter how many pools are running.
+_tmdb_inflight_limiter = threading.BoundedSemaphore(TMDB_MAX_CONCURRENCY)
+
+def get_tmdb_session():
+    # Returns the shared, pooled requests.Session used for every TMDb call.
+    # Keep-alive connections are reused across calls (no new TCP+TLS handshake per request),
+    # and 5xx responses are retried with exponential backoff (429s go back through the rate limiter instead).
+    global _tmdb_session
+    if _tmdb_session is None:
+        with _tmdb_session_lock:
+            if _tmdb_session is None:
+                from urllib3.util.retry import Retry # Deferred with requests (see LAZY IMPORTS)
+                retry_policy = Retry(
+                    total=TMDB_MAX_RETRIES,
+                    connect=TMDB_MAX_RETRIES,
+                    read=TMDB_MAX_RETRIES,
+                    status=TMDB_MAX_RETRIES,
+                    backoff_factor=TMDB_BACKOFF_FACTOR,
+                    status_forcelist=TMDB_RETRY_STATUS_CODES,
+                    allowed_methods=frozenset(["GET"]),
+                    respect_retry_after_header=False, # Otherwise urllib3 would retry 429s itself, behind the rate limiter's back
+                    raise_on_status=False, # Hand the last response back so raise_for_status() reports it
+                )
+                adapter = requests.adapters.HTTPAdapter(pool_connections=TMDB_POOL_SIZE, pool_maxsize=TMDB_POOL_SIZE, max_retries=retry_policy)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"accept": "application/json"})
+                _tmdb_session = session
+    return _tmdb_session
+
+def get_tmdb_cache_ttl(endpoint, params):
+    # TTL for one endpoint family. Anything carrying provider availability expires as fast as the providers.
+    if 'watch/providers' in str(params.get('append_to_response', '')) or 'with_watch_providers' in params:
+        return TMDB_CACHE_PROVIDERS_TTL_SECONDS
+    for endpoint_pattern, ttl_seconds in TMDB_CACHE_TTL_SECONDS:
+        if endpoint_pattern.search(endpoint):
+            return ttl_seconds
+    return TMDB_CACHE_DEFAULT_TTL_SECONDS
+
+def build_tmdb_cache_key(endpoint, params):
+    # Endpoint + normalized params (sorted, stringified). The api_key never becomes part of the key.
+    normalized_params = sorted((str(k), str(v)) for k, v in params.items() if k != 'api_key')
+    return hashlib.sha256(json.dumps([endpoint, normalized_params]).encode('utf-8')).hexdigest()
+
+class SQLiteResponseCache:
+    # Size-bounded (LRU) on-disk cache of JSON payloads with per-entry expiry and hit/miss counters.
+    # One table per upstream (TMDb responses, Gemini responses); several tables can share one file.
+    COLUMNS = ('cache_key', 'namespace', 'match_text', 'payload', 'expires_at', 'last_access')
+
+    def __init__(self, db_path, max_entries, table_name):
+        self.max_entries = max_entries
+        self.table_name = table_name
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'near_duplicate_hits': 0}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        existing_columns = tuple(row[1] for row in self._connection.execute(f"PRAGMA table_info({table_name})"))
+        if existing_columns and existing_columns != self.COLUMNS: # Table from an older layout: it's only a cache, start over
+            self._connection.execute(f"DROP TABLE {table_name}")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} ("
+            "cache_key TEXT PRIMARY KEY, namespace TEXT, match_text TEXT, payload TEXT, expires_at REAL, last_access REAL)"
+        )
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_last_access ON {table_name}(last_access)")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_namespace ON {table_name}(namespace)")
+        self._connection.commit()
+
+    def get(self, cache_key):
+        # Lock contention or a damaged file (e.g. several batch worker processes sharing the cache) is a miss, never an error.
+        try:
+            return self._get(cache_key)
+        except sqlite3.Error:
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, cache_key, namespace, payload, ttl_seconds, match_text=None):
+        try:
+            self._put(cache_key, namespace, payload, ttl_seconds, match_text)
+        except sqlite3.Error:
+            pass
+
+    def find_similar(self, namespace, match_text, similarity_function, min_similarity, candidate_limit=500):
+        # Payload of the most similar live entry of a namespace (compared on match_text), or None.
+        # Only the candidate_limit most recently used entries are scanned.
+        try:
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT match_text, payload FROM {self.table_name} WHERE namespace = ? AND match_text IS NOT NULL "
+                    "AND expires_at >= ? ORDER BY last_access DESC LIMIT ?", (namespace, time.time(), candidate_limit)
+                ).fetchall()
+        except sqlite3.Error:
+            return None
+        best_similarity, best_payload = min_similarity, None
+        for candidate_text, payload in rows:
+            similarity = similarity_function(match_text, candidate_text)
+            if similarity >= best_similarity:
+                best_similarity, best_payload = similarity, payload
+        if best_payload is None:
+            return None
+        self.stats['near_duplicate_hits'] += 1
+        return json.loads(best_payload)
+
+    def _get(self, cache_key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT payload, expires_at FROM {self.table_name} WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            if row[1] < now:
+                self._connection.execute(f"DELETE FROM {self.table_name} WHERE cache_key = ?", (cache_key,))
+                self._connection.commit()
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._connection.execute(f"UPDATE {self.table_name} SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+            self._connection.commit()
+            self.stats['hits'] += 1
+        return json.loads(row[0])
+
+    def _put(self, cache_key, namespace, payload, ttl_seconds, match_text):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table_name} (cache_key, namespace, match_text, payload, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, namespace, match_text, json.dumps(payload), now + ttl_seconds, now),
+            )
+            entry_count = self._connection.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+            if entry_count > self.max_entries:
+                overflow = entry_count - self.max_entries
+                self._connection.execute(
+                    f"DELETE FROM {self.table_name} WHERE cache_key IN "
+                    f"(SELECT cache_key FROM {self.table_name} ORDER BY last_access ASC LIMIT ?)", (overflow,)
+                )
+                self.stats['evictions'] += overflow
+            self._connection.commit()
+
+_tmdb_cache = None
+_tmdb_cache_lock = threading.Lock()
+
+def get_tmdb_cache():
+    # Lazily opens the shared response cache; returns None when caching is disabled or the file can't be opened.
+    global _tmdb_cache
+    if not TMDB_CACHE_PATH:
+        return None
+    if _tmdb_cache is None:
+        with _tmdb_cache_lock:
+            if _tmdb_cache is None:
+                try:
+                    _tmdb_cache = SQLiteResponseCache(TMDB_CACHE_PATH, TMDB_CACHE_MAX_ENTRIES, "tmdb_responses")
+                except sqlite3.Error as e:
+                    print(f"⚠️  Não foi possível abrir o cache do TMDb em '{TMDB_CACHE_PATH}': {e}. Seguindo sem cache.") # User-facing: Portuguese
+                    return None
+    return _tmdb_cache
+
+def get_tmdb_cache_stats():
+    # Hit/miss/expired/eviction counters for this process (all zeros when the cache is disabled).
+    cache = get_tmdb_cache()
+    return dict(cache.stats) if cache else {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'near_duplicate_hits': 0}
+
+_gemini_cache = None
+_gemini_cache_lock = threading.Lock()
+
+def get_gemini_cache():
+    # Lazily opens the shared Gemini response cache; None when disabled or the file can't be opened.
+    global _gemini_cache
+    if not GEMINI_CACHE_PATH:
+        return None
+    if _gemini_cache is None:
+        with _gemini_cache_lock:
+            if _gemini_cache is None:
+                try:
+                    _gemini_cache = SQLiteResponseCache(GEMINI_CACHE_PATH, GEMINI_CACHE_MAX_ENTRIES, "gemini_responses")
+                except sqlite3.Error as e:
+                    print(f"⚠️  Não foi possível abrir o cache do Gemini em '{GEMINI_CACHE_PATH}': {e}. Seguindo sem cache.") # User-facing: Portuguese
+                    return None
+    return _gemini_cache
+
+def get_gemini_cache_stats():
+    cache = get_gemini_cache()
+    return dict(cache.stats) if cache else {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'near_duplicate_hits': 0}
+
+def interest_query_similarity(first_query, second_query):
+    # Cosine similarity of the hashed word-stem / character 4-gram vectors of two normalized interest queries.
+    first_vector = SemanticIndex._hashed_term_frequencies(first_query)
+    second_vector = SemanticIndex._hashed_term_frequencies(second_query)
+    norms = float(np.linalg.norm(first_vector) * np.linalg.norm(second_vector))
+    return float(first_vector @ second_vector) / norms if norms else 0.0
+
+def extract_gemini_text(response):
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    if hasattr(response, 'parts') and response.parts:
+        return "".join(part.text for part in response.parts if hasattr(part, 'text'))
+    return ""
+
+def generate_gemini_text(prompt, cache_kind, cache_key_parts, near_duplicate_text=None, generation_config=None):
+    # model.generate_content behind the content-addressed response cache. The key is the model id +
+    # the kind of call + the normalized inputs the prompt is built from (not the raw prompt text), so
+    # "Dinossauros " and "dinossauros" share one answer. Only non-empty answers are cached; errors propagate.
+    # With near_duplicate_text set, a miss may still be served by the most similar cached query of the same kind.
+    cache = get_gemini_cache()
+    cache_namespace = f"{GEMINI_MODEL_ID_FROM_ENV}:{cache_kind}"
+    cache_key = hashlib.sha256(json.dumps([cache_namespace, cache_key_parts], ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+    with trace_span("generate_content", "gemini", kind=cache_kind, cache="off" if cache is None else "miss", prompt_chars=len(prompt)) as span:
+        if cache:
+            cached_text = cache.get(cache_key)
+            if cached_text is not None:
+                span.set(cache="hit", bytes=len(cached_text.encode('utf-8')))
+                return cached_text
+            if near_duplicate_text and GEMINI_CACHE_NEAR_DUPLICATE_SIMILARITY > 0:
+                cached_text = cache.find_similar(cache_namespace, near_duplicate_text, interest_query_similarity, GEMINI_CACHE_NEAR_DUPLICATE_SIMILARITY)
+                if cached_text is not None:
+                    span.set(cache="near_duplicate", bytes=len(cached_text.encode('utf-8')))
+                    return cached_text
+        model = get_gemini_model() # Only a cache miss sets up the client
+        if model is None:
+            raise RuntimeError("modelo Gemini indisponível")
+        budget = _current_run_budget.get()
+        estimated_tokens = len(prompt) // GEMINI_CHARS_PER_TOKEN + ((generation_config or {}).get('max_output_tokens') or GEMINI_ESTIMATED_OUTPUT_TOKENS)
+        if budget is not None:
+            budget.reserve_gemini_tokens(estimated_tokens)
+        try:
+            for attempt in range(GEMINI_MAX_RETRIES + 1):
+                if not gemini_rate_limiter.acquire(_current_upstream_lane.get(), timeout=UPSTREAM_QUEUE_TIMEOUT_SECONDS):
+                    raise RuntimeError("tempo esgotado aguardando o limite de taxa do Gemini")
+                try:
+                    if generation_config:
+                        response = model.generate_content(prompt, generation_config=generation_config)
+                    else:
+                        response = model.generate_content(prompt)
+                    break
+                except Exception as e:
+                    retry_after_seconds = get_gemini_quota_retry_after(e)
+                    if retry_after_seconds is None or attempt == GEMINI_MAX_RETRIES:
+                        raise
+                    gemini_rate_limiter.on_throttled(retry_after_seconds)
+        except Exception:
+            if budget is not None:
+                budget.settle_gemini_tokens(estimated_tokens, 0) # Nothing was answered
+            raise
+        gemini_rate_limiter.on_success()
+        response_text = extract_gemini_text(response)
+        span.set(bytes=len(response_text.encode('utf-8')))
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            span.set(prompt_tokens=getattr(usage, 'prompt_token_count', None), output_tokens=getattr(usage, 'candidates_token_count', None))
+            if budget is not None and getattr(usage, 'total_token_count', None):
+                budget.settle_gemini_tokens(estimated_tokens, usage.total_token_count)
+        if cache and response_text.strip():
+            cache.put(cache_key, cache_namespace, response_text, GEMINI_CACHE_TTL_SECONDS, match_text=near_duplicate_text)
+        return response_text
+
+class SingleFlight:
+    # Collapses concurrent calls that share a key into one execution; every waiting caller gets its result
+    # (or its exception). Nothing is remembered once the call finishes - that's the caches' job.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {} # key -> Future of the leader's call
+        self.coalesced_calls = 0
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced_calls += 1
+        if not is_leader:
+            return future.result()
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+tmdb_single_flight = SingleFlight()
+_TMDB_BUDGET_REFUSED = object() # Single-flight result when the leader's run budget refused the HTTP call
+
 def make_tmdb_request(endpoint, params=None, method="GET"):
     # Helper function to make requests to TMDb API.
     if not TMDB_API_KEY:
         print("ℹ️ Chave da API do TMDb não disponível. Pulando requisição ao TMDb.") # User-facing: Portuguese
         return None
+    if method.upper() != "GET":
+        print(f"🔴 Método HTTP não suportado: {method}") # User-facing: Portuguese
+        return None
     if params is None:
         params = {}
     params['api_key'] = TMDB_API_KEY
     if 'language' not in params: # Default language for TMDb
         params['language'] = TARGET_LANGUAGE_TMDB
-    
-    headers = {"accept": "application/json"}
+
+    cache_key = build_tmdb_cache_key(endpoint, params)
+    cache = get_tmdb_cache()
+    with trace_span("make_tmdb_request", "tmdb", endpoint=endpoint, cache="off" if cache is None else "miss") as span:
+        if cache:
+            cached_payload = cache.get(cache_key)
+            if cached_payload is not None:
+                span.set(cache="hit")
+                return cached_payload
+        run_budget_in_use = _current_run_budget.get()
+
+        def fetch_within_run_budget():
+            # Run by the single-flight leader only, so a caller joining an in-flight request spends no budget.
+            if run_budget_in_use is not None and not run_budget_in_use.spend_tmdb_call():
+                return _TMDB_BUDGET_REFUSED
+            return fetch_tmdb_payload(endpoint, params, cache, cache_key)
+
+        # Identical requests already in flight (e.g. concurrent service requests for the same interest) share one HTTP call.
+        while True:
+            payload = tmdb_single_flight.do(cache_key, fetch_within_run_budget)
+            if payload is not _TMDB_BUDGET_REFUSED:
+                return payload
+            if run_budget_in_use is None or run_budget_in_use.is_exhausted("tmdb"):
+                span.set(budget="exhausted")
+                return None
+            # The request we joined was refused by its leader's budget; ours still has room, so ask again.
+
+def fetch_tmdb_payload(endpoint, params, cache=None, cache_key=None):
+    # One GET to TMDb through the rate limiter, the pooled session and the in-flight cap; successful payloads go
+    # into the cache. A 429 pauses the shared bucket for Retry-After and the call queues again (up to TMDB_MAX_RETRIES).
     full_url = f"{TMDB_BASE_URL}{endpoint}"
     try:
-        if method.upper() == "GET":
-            response = requests.get(full_url, params=params, headers=headers)
-        else:
-            print(f"🔴 Método HTTP não suportado: {method}") # User-facing: Portuguese
-            return None
+        for attempt in range(TMDB_MAX_RETRIES + 1):
+            if not tmdb_rate_limiter.acquire(_current_upstream_lane.get(), timeout=UPSTREAM_QUEUE_TIMEOUT_SECONDS):
+                print(f"🔴 Tempo esgotado aguardando o limite de taxa do TMDb para {endpoint}.") # User-facing: Portuguese
+                return None
+            with _tmdb_inflight_limiter, trace_span("tmdb_http_get", "http", endpoint=endpoint, attempt=attempt) as span:
+                response = get_tmdb_session().get(full_url, params=params, timeout=(TMDB_CONNECT_TIMEOUT, TMDB_READ_TIMEOUT))
+                span.set(status=response.status_code, bytes=len(response.content))
+            if response.status_code != 429:
+                break
+            tmdb_rate_limiter.on_throttled(parse_retry_after(response.headers.get("Retry-After")))
         response.raise_for_status()
-        return response.json()
+        tmdb_rate_limiter.on_success()
+        payload = response.json()
+        if cache:
+            cache.put(cache_key, endpoint, payload, get_tmdb_cache_ttl(endpoint, params))
+        return payload
     except requests.exceptions.HTTPError as http_err:
         error_details = ""
         try:
@@ -65,18 +894,155 @@ def make_tmdb_request(endpoint, params=None, method="GET"):
         print(f"🔴 Erro geral ao fazer requisição ao TMDb para {endpoint}: {e}") # User-facing: Portuguese
     return None
 
+def run_bounded_concurrently(worker_function, items, max_workers=None):
+    # Applies worker_function to every item using a bounded thread pool and returns the
+    # results in the same order as the input (so popularity ordering is preserved).
+    # max_workers=1 (or a single item) runs serially in the calling thread.
+    if max_workers is None:
+        max_workers = TMDB_MAX_CONCURRENCY
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [worker_function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [submit_with_context(executor, worker_function, item) for item in items]
+        return [future.result() for future in futures]
+
+class TMDbFetchBatch:
+    # The planned TMDb GETs of one prospector stage, keyed by the caller (e.g. (page_num, term)).
+    # With fan_out, the caller announces each page with prefetch(keys) once the previous page is merged and the
+    # 30-candidate budget is still open. The page's first request is fetched on get(); only if it returns results
+    # are the rest of the page submitted to a bounded pool, since an empty result ends the serial loop. So fan-out
+    # never fetches a page (or a page after an empty first result) the serial loop would skip. Without fan_out each
+    # request is fetched lazily on get(), exactly like the original serial loops. Either way the caller consumes
+    # results in its own order, so merging/dedup stays deterministic.
+    def __init__(self, planned_requests, fan_out=False):
+        self._planned_requests = planned_requests
+        self._futures = {}
+        self._page_rest = [] # Keys submitted once the announced page's first request has results
+        self._executor = None
+        if fan_out and len(planned_requests) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=min(TMDB_MAX_CONCURRENCY, len(planned_requests)))
+
+    def prefetch(self, keys):
+        if self._executor is not None:
+            self._page_rest = list(keys)[1:]
+
+    def get(self, key):
+        if key in self._futures:
+            return self._futures[key].result()
+        endpoint, params = self._planned_requests[key]
+        data = make_tmdb_request(endpoint, params=params)
+        page_rest, self._page_rest = self._page_rest, []
+        if data and data.get('results'):
+            for rest_key in page_rest:
+                if rest_key != key and rest_key not in self._futures:
+                    rest_endpoint, rest_params = self._planned_requests[rest_key]
+                    self._futures[rest_key] = submit_with_context(self._executor, make_tmdb_request, rest_endpoint, rest_params)
+        return data
+
+    def close(self):
+        # Drops submitted requests that haven't started yet (e.g. the rest of a page after an empty result).
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Other ways users type a service -> official TMDb provider names, first one the region lists wins.
+# ("Disney+" vs "Disney Plus" needs no alias: normalization already maps "+" to "plus".)
+PROVIDER_NAME_ALIASES = {
+    "prime video": ("Amazon Prime Video",), "amazon prime": ("Amazon Prime Video",), "prime": ("Amazon Prime Video",),
+    "amazon video": ("Amazon Video",), "max": ("Max", "HBO Max"), "hbo max": ("HBO Max", "Max"), "hbo": ("HBO Max", "Max"),
+    "apple tv": ("Apple TV Plus", "Apple TV+"), "star": ("Star Plus",), "paramount": ("Paramount Plus", "Paramount+"),
+}
+# Used only when a region's provider list can't be loaded from TMDb (ids as listed for Brazil).
+OFFLINE_PROVIDER_IDS = {
+    "netflix": 8, "amazon prime video": 119, "prime video": 119, "amazon video": 9,
+    "disney plus": 337, "disney+": 337, "max": 1899, "hbo max": 384,
+    "apple tv plus": 350, "appletv+": 350, "apple tv+": 350,
+    "globoplay": 307, "star plus": 619, "star+": 619, "claro video": 167,
+    "looke": 484, "paramount plus": 531, "paramount+": 531,
+}
+PROVIDER_FUZZY_MATCH_CUTOFF = 0.85 # difflib ratio for typos ("netflx"); resolved once, then memoized
+
+def normalize_provider_name(provider_name):
+    # "Disney+", "disney plus" and "Dísney Plus " all become "disneyplus".
+    folded = unicodedata.normalize('NFKD', provider_name or "").encode('ascii', 'ignore').decode('ascii').casefold()
+    return re.sub(r"[^a-z0-9]", "", folded.replace("+", "plus"))
+
+class ProviderRegistry:
+    # Streaming providers of one watch region, indexed by normalized name (official names, "plus"-less
+    # variants and the aliases above). Resolution is a dict lookup; fuzzy matches are memoized into the index.
+    def __init__(self, region, providers, loaded_at, complete=True):
+        self.region = region
+        self.loaded_at = loaded_at
+        self.complete = complete # False when TMDb couldn't be reached: aliases only, retried sooner
+        self.provider_names = {}
+        self.name_index = {}
+        for provider in providers: # Best display priority first, so it wins name collisions
+            self.provider_names.setdefault(provider['provider_id'], provider['provider_name'])
+            normalized_name = normalize_provider_name(provider['provider_name'])
+            self.name_index.setdefault(normalized_name, provider['provider_id'])
+            if normalized_name.endswith("plus") and len(normalized_name) > 4:
+                self.name_index.setdefault(normalized_name[:-4], provider['provider_id'])
+        for alias, official_names in PROVIDER_NAME_ALIASES.items():
+            provider_id = next((self.name_index[normalize_provider_name(name)] for name in official_names
+                                if normalize_provider_name(name) in self.name_index), None)
+            if provider_id is not None:
+                self.name_index.setdefault(normalize_provider_name(alias), provider_id)
+        if not self.provider_names:
+            for provider_name, provider_id in OFFLINE_PROVIDER_IDS.items():
+                self.name_index.setdefault(normalize_provider_name(provider_name), provider_id)
+
+    def is_stale(self):
+        max_age = PROVIDER_REGISTRY_TTL_SECONDS if self.complete else PROVIDER_REGISTRY_RETRY_SECONDS
+        return time.time() - self.loaded_at > max_age
+
+    def resolve(self, provider_name):
+        normalized_name = normalize_provider_name(provider_name)
+        if not normalized_name:
+            return None
+        if normalized_name in self.name_index:
+            return self.name_index[normalized_name]
+        close_matches = difflib.get_close_matches(normalized_name, list(self.name_index), n=1, cutoff=PROVIDER_FUZZY_MATCH_CUTOFF)
+        provider_id = self.name_index[close_matches[0]] if close_matches else None
+        self.name_index[normalized_name] = provider_id # Misses are memoized too
+        return provider_id
+
+def load_provider_registry(region):
+    # /watch/providers/movie + /tv for one region (persisted by the TMDb response cache for PROVIDER_REGISTRY_TTL_SECONDS).
+    providers_by_id = {}
+    loaded_lists = 0
+    for media_type in ('movie', 'tv'):
+        data = make_tmdb_request(f"/watch/providers/{media_type}", params={'watch_region': region, 'language': TARGET_LANGUAGE_TMDB})
+        if not data or 'results' not in data:
+            continue
+        loaded_lists += 1
+        for provider in data['results']:
+            if provider.get('provider_id') and provider.get('provider_name'):
+                priority = (provider.get('display_priorities') or {}).get(region, provider.get('display_priority', 999))
+                if provider['provider_id'] not in providers_by_id or priority < providers_by_id[provider['provider_id']]['priority']:
+                    providers_by_id[provider['provider_id']] = {**provider, 'priority': priority}
+    if not loaded_lists:
+        print(f"⚠️  Não foi possível carregar a lista de provedores de streaming do TMDb para {region}. Usando apenas os nomes conhecidos.") # User-facing: Portuguese
+    providers = sorted(providers_by_id.values(), key=lambda provider: provider['priority'])
+    return ProviderRegistry(region, providers, time.time(), complete=bool(loaded_lists))
+
+_provider_registries = {}
+_provider_registries_lock = threading.Lock()
+
+def get_provider_registry(watch_region):
+    # One registry per region, loaded on first use and kept in memory until its TTL expires.
+    region = (watch_region or TARGET_COUNTRY_CODE).upper()
+    registry = _provider_registries.get(region)
+    if registry is None or registry.is_stale():
+        with _provider_registries_lock:
+            registry = _provider_registries.get(region)
+            if registry is None or registry.is_stale():
+                registry = load_provider_registry(region)
+                _provider_registries[region] = registry
+    return registry
+
 def get_tmdb_provider_id_from_name(provider_name_input, watch_region="BR"):
-    # Simplified mapping of common streaming provider names to their TMDb IDs for Brazil.
-    # A production app would fetch and cache these dynamically.
-    provider_name_lower = provider_name_input.lower().strip()
-    common_provider_map = {
-        "netflix": 8, "amazon prime video": 9, "prime video": 9, "amazon video": 9,
-        "disney plus": 337, "disney+": 337, "max": 1899, "hbo max": 384, 
-        "apple tv plus": 350, "appletv+": 350, "apple tv+": 350,
-        "globoplay": 307, "star plus": 619, "star+": 619, "claro video": 167,
-        "looke": 484, "paramount plus": 531, "paramount+": 531,
-    }
-    return common_provider_map.get(provider_name_lower)
+    # Resolves a streaming service name typed by the user to its TMDb provider id in watch_region (or None).
+    return get_provider_registry(watch_region).resolve(provider_name_input)
 
 # def get_keyword_ids_from_tmdb(keyword_query_list):
 #     # Fetches keyword IDs from TMDb for a list of query strings.
@@ -93,8 +1059,466 @@ def get_tmdb_provider_id_from_name(provider_name_input, watch_region="BR"):
 #                 # print(f"    Encontrado ID de palavra-chave: {res['id']} para '{res['name']}' (de '{query}')") # Debug
 #     return list(keyword_ids)
 
+# --- CANDIDATE RECORDS ---
+# Prospects travel through Agents 2-5 as slotted records instead of dicts: no per-instance __dict__, no
+# per-stage copies, interned genre/provider names, and only the flatrate providers kept from TMDb's listing.
+# They keep dict-style access (item['title'], item.get('genres')) so the agents read them like before.
+
+class RecordFields:
+    __slots__ = ()
+    FIELDS = frozenset()
+
+    def __getitem__(self, field):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        if field not in self.FIELDS: # Unknown keys are a bug, not a new column
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in self.FIELDS and hasattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self.FIELDS else default
+
+class Prospect(RecordFields):
+    # One candidate title. Built by Agent 2, filled in place by Agent 3, then shared read-only
+    # (a cached candidate pool serves many users, possibly in several regions). Certifications and providers
+    # are kept for every region found in the details payload.
+    __slots__ = ('tmdb_id', 'media_type', 'title', 'overview', 'popularity',
+                 'genres', 'tmdb_vote_average', 'tmdb_vote_count', 'age_certifications', 'watch_providers')
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, tmdb_id, media_type, title, overview, popularity):
+        self.tmdb_id = tmdb_id
+        self.media_type = sys.intern(media_type)
+        self.title = title
+        self.overview = overview
+        self.popularity = popularity
+
+    def __repr__(self):
+        return f"Prospect({self.tmdb_id}, {self.media_type!r}, {self.title!r})"
+
+class UserCandidate(RecordFields):
+    # One user's view of a shared Prospect in one region (Agents 4-5 output). Title fields read through to the
+    # prospect, so checking availability for another user (or region) never copies the title.
+    OWN_FIELDS = frozenset(('available_on_user_platforms', 'age_certification_country', 'gemini_justification', 'used_fallback_search',
+                            'existence_verified_by_gemini', 'platform_mention_verified_by_gemini'))
+    __slots__ = ('prospect',) + tuple(sorted(OWN_FIELDS))
+    FIELDS = Prospect.FIELDS | OWN_FIELDS
+
+    def __init__(self, prospect, available_on_user_platforms, country_code):
+        self.prospect = prospect
+        self.available_on_user_platforms = available_on_user_platforms
+        self.age_certification_country = (prospect.get('age_certifications') or {}).get(country_code, "N/A")
+
+    def __getattr__(self, field): # Only reached for fields not set on the view itself
+        if field in Prospect.FIELDS:
+            return getattr(self.prospect, field)
+        raise AttributeError(field)
+
+    def __setitem__(self, field, value):
+        if field not in self.OWN_FIELDS:
+            raise KeyError(f"'{field}' pertence ao prospecto compartilhado") # Shared title data is read-only here
+        setattr(self, field, value)
+
+    def __repr__(self):
+        return f"UserCandidate({self.prospect!r}, {self.available_on_user_platforms!r})"
+
+def compact_watch_providers(watch_providers_results):
+    # TMDb's {region: {"link": ..., "flatrate": [{provider_id, provider_name, logo_path, ...}], "rent": ...}}
+    # -> {region: ((provider_id, interned provider_name), ...)} with only the regions that have flatrate offers.
+    compact_providers = {}
+    for region, region_providers in (watch_providers_results or {}).items():
+        flatrate = tuple(
+            (provider['provider_id'], sys.intern(provider.get('provider_name') or str(provider['provider_id'])))
+            for provider in region_providers.get('flatrate', ()) if provider.get('provider_id')
+        )
+        if flatrate:
+            compact_providers[sys.intern(region)] = flatrate
+    return compact_providers
+
+# --- LOCAL CATALOG INDEX ---
+
+TITLE_TOKEN_STOPWORDS = {
+    "a", "o", "as", "os", "e", "de", "da", "do", "das", "dos", "em", "no", "na", "nos", "nas",
+    "um", "uma", "com", "para", "por", "the", "of", "and", "in", "to",
+}
+
+def tokenize_title(text):
+    # Accent-insensitive, case-insensitive word tokens used by the local title index.
+    decomposed = unicodedata.normalize('NFKD', text or "")
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+    return [token for token in re.split(r"[^0-9a-z]+", without_accents) if len(token) > 1 and token not in TITLE_TOKEN_STOPWORDS]
+
+class LocalCatalog:
+    # Compact, column-oriented copy of the TMDb titles we care about, built offline by build_catalog.py.
+    # Row i of every column describes the same title; rows are stored in descending popularity, so
+    # posting lists (row ids) in the inverted indexes are already popularity-ordered.
+    MEDIA_TYPES = ('movie', 'tv')
+
+    def __init__(self, columns, title_index, genre_index, genre_names, provider_names, region, language, built_at):
+        self.tmdb_ids = array('q', columns['tmdb_id'])
+        self.media_type_codes = array('b', columns['media_type'])
+        self.titles = columns['title']
+        self.overviews = columns['overview']
+        self.popularity = array('d', columns['popularity'])
+        self.vote_average = array('d', columns['vote_average'])
+        self.vote_count = array('q', columns['vote_count'])
+        self.certifications = [sys.intern(cert) for cert in columns['certification']]
+        self.genre_ids = [array('i', ids) for ids in columns['genre_ids']]
+        self.provider_ids = [array('i', ids) for ids in columns['provider_ids']]
+        self.title_index = {token: array('i', rows) for token, rows in title_index.items()}
+        self.genre_index = {int(genre_id): array('i', rows) for genre_id, rows in genre_index.items()}
+        self.genre_names = {int(genre_id): sys.intern(name) for genre_id, name in genre_names.items()}
+        self.provider_names = {int(provider_id): sys.intern(name) for provider_id, name in provider_names.items()}
+        self.region = region
+        self.language = language
+        self.built_at = built_at
+        self._row_by_key = {(self.tmdb_ids[row], self.media_type_codes[row]): row for row in range(len(self.tmdb_ids))}
+
+    @classmethod
+    def from_records(cls, records, region, language, built_at=None):
+        # records: dicts with tmdb_id, media_type, title, original_title, overview, popularity, vote_average,
+        # vote_count, certification, genres [(id, name)], providers [(id, name)] (flatrate in `region`).
+        records = sorted(records, key=lambda record: record['popularity'], reverse=True)
+        columns = {name: [] for name in ('tmdb_id', 'media_type', 'title', 'overview', 'popularity', 'vote_average',
+                                         'vote_count', 'certification', 'genre_ids', 'provider_ids')}
+        title_index, genre_index, genre_names, provider_names = {}, {}, {}, {}
+        for row, record in enumerate(records):
+            columns['tmdb_id'].append(record['tmdb_id'])
+            columns['media_type'].append(cls.MEDIA_TYPES.index(record['media_type']))
+            columns['title'].append(record['title'])
+            columns['overview'].append(record.get('overview', ''))
+            columns['popularity'].append(float(record.get('popularity', 0.0)))
+            columns['vote_average'].append(float(record.get('vote_average', 0.0)))
+            columns['vote_count'].append(int(record.get('vote_count', 0)))
+            columns['certification'].append(record.get('certification', "N/A"))
+            columns['genre_ids'].append([genre_id for genre_id, _ in record.get('genres', [])])
+            columns['provider_ids'].append([provider_id for provider_id, _ in record.get('providers', [])])
+            for genre_id, genre_name in record.get('genres', []):
+                genre_names[genre_id] = genre_name
+                genre_index.setdefault(genre_id, []).append(row)
+            for provider_id, provider_name in record.get('providers', []):
+                provider_names[provider_id] = provider_name
+            for token in set(tokenize_title(record['title']) + tokenize_title(record.get('original_title', ''))):
+                title_index.setdefault(token, []).append(row)
+        return cls(columns, title_index, genre_index, genre_names, provider_names, region, language, built_at or time.time())
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as catalog_file:
+            payload = json.load(catalog_file)
+        return cls(payload['columns'], payload['title_index'], payload['genre_index'], payload['genre_names'],
+                   payload['provider_names'], payload['region'], payload['language'], payload['built_at'])
+
+    def save(self, path):
+        payload = {
+            'version': 1, 'region': self.region, 'language': self.language, 'built_at': self.built_at,
+            'columns': {
+                'tmdb_id': self.tmdb_ids.tolist(), 'media_type': self.media_type_codes.tolist(),
+                'title': self.titles, 'overview': self.overviews, 'popularity': self.popularity.tolist(),
+                'vote_average': self.vote_average.tolist(), 'vote_count': self.vote_count.tolist(),
+                'certification': self.certifications,
+                'genre_ids': [ids.tolist() for ids in self.genre_ids],
+                'provider_ids': [ids.tolist() for ids in self.provider_ids],
+            },
+            'title_index': {token: rows.tolist() for token, rows in self.title_index.items()},
+            'genre_index': {str(genre_id): rows.tolist() for genre_id, rows in self.genre_index.items()},
+            'genre_names': {str(genre_id): name for genre_id, name in self.genre_names.items()},
+            'provider_names': {str(provider_id): name for provider_id, name in self.provider_names.items()},
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as catalog_file:
+            json.dump(payload, catalog_file, ensure_ascii=False, separators=(',', ':'))
+
+    def __len__(self):
+        return len(self.tmdb_ids)
+
+    def prospect_for_row(self, row):
+        # Same shape as the prospects agent_content_prospector builds from TMDb search results.
+        return Prospect(self.tmdb_ids[row], self.MEDIA_TYPES[self.media_type_codes[row]], self.titles[row],
+                        self.overviews[row], self.popularity[row])
+
+    def search_titles(self, query, limit=20):
+        # Titles containing every (non-stopword) token of the query, most popular first.
+        tokens = tokenize_title(query)
+        if not tokens:
+            return []
+        postings = sorted((self.title_index.get(token, array('i')) for token in tokens), key=len)
+        matching_rows = set(postings[0])
+        for rows in postings[1:]:
+            matching_rows.intersection_update(rows)
+        return [self.prospect_for_row(row) for row in sorted(matching_rows)[:limit]]
+
+    def search_genres(self, genre_ids, min_vote_count=0, limit=40):
+        # Titles tagged with any of genre_ids (like /discover with_genres=a|b), most popular first.
+        matching_rows = set()
+        for genre_id in genre_ids:
+            matching_rows.update(self.genre_index.get(int(genre_id), ()))
+        ordered_rows = [row for row in sorted(matching_rows) if self.vote_count[row] >= min_vote_count]
+        return [self.prospect_for_row(row) for row in ordered_rows[:limit]]
+
+    def get_enrichment(self, tmdb_id, media_type, country_code):
+        # Agent 3/4 fields for a catalogued title, or None if it isn't catalogued for this region.
+        if country_code != self.region or media_type not in self.MEDIA_TYPES:
+            return None
+        row = self._row_by_key.get((tmdb_id, self.MEDIA_TYPES.index(media_type)))
+        if row is None:
+            return None
+        flatrate = tuple((provider_id, self.provider_names.get(provider_id, str(provider_id))) for provider_id in self.provider_ids[row])
+        return {
+            'genres': tuple(self.genre_names.get(genre_id, str(genre_id)) for genre_id in self.genre_ids[row]),
+            'tmdb_vote_average': self.vote_average[row],
+            'tmdb_vote_count': self.vote_count[row],
+            'age_certifications': {self.region: self.certifications[row]},
+            'watch_providers': {self.region: flatrate} if flatrate else {},
+        }
+
+def extract_semantic_features(text):
+    # Hashed-vectorizer features: word stems (first 6 chars) plus character 4-grams of every word, so
+    # "animais falantes" still overlaps an overview saying "animal que fala".
+    features = []
+    for token in tokenize_title(text):
+        features.append("w:" + token[:6])
+        padded_token = f"_{token}_"
+        features.extend("c:" + padded_token[start:start + 4] for start in range(len(padded_token) - 3))
+    return features
+
+class SemanticIndex:
+    # Flat matrix of L2-normalized TF-IDF hashed embeddings (one row per LocalCatalog row, same order).
+    # Runs on CPU with NumPy only; top-k cosine search is a single matrix-vector product.
+    EMBEDDING_DIM = 1024
+
+    def __init__(self, matrix, idf, tmdb_ids, catalog_built_at):
+        self.matrix = matrix.astype(np.float32)
+        self.idf = idf.astype(np.float32)
+        self.tmdb_ids = tmdb_ids
+        self.catalog_built_at = float(catalog_built_at)
+
+    @classmethod
+    def _hashed_term_frequencies(cls, text):
+        vector = np.zeros(cls.EMBEDDING_DIM, dtype=np.float32)
+        for feature in extract_semantic_features(text):
+            feature_hash = zlib.crc32(feature.encode('utf-8'))
+            bucket = feature_hash % cls.EMBEDDING_DIM
+            vector[bucket] += 1.0 if (feature_hash // cls.EMBEDDING_DIM) % 2 == 0 else -1.0 # Signed hashing cancels collisions
+        return vector
+
+    @staticmethod
+    def _normalize_rows(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    @classmethod
+    def build(cls, catalog):
+        term_frequencies = np.stack([
+            cls._hashed_term_frequencies(f"{catalog.titles[row]} {catalog.overviews[row]}") for row in range(len(catalog))
+        ]) if len(catalog) else np.zeros((0, cls.EMBEDDING_DIM), dtype=np.float32)
+        document_frequency = np.count_nonzero(term_frequencies, axis=0)
+        idf = np.log((1 + len(catalog)) / (1 + document_frequency)) + 1.0
+        matrix = cls._normalize_rows(np.sign(term_frequencies) * np.log1p(np.abs(term_frequencies)) * idf)
+        return cls(matrix, idf, np.asarray(catalog.tmdb_ids, dtype=np.int64), catalog.built_at)
+
+    def save(self, path):
+        with open(path, 'wb') as index_file: # np.savez would otherwise append ".npz" to the name
+            np.savez_compressed(index_file, matrix=self.matrix.astype(np.float16), idf=self.idf,
+                                tmdb_ids=self.tmdb_ids, catalog_built_at=np.float64(self.catalog_built_at))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            return cls(stored['matrix'], stored['idf'], stored['tmdb_ids'], stored['catalog_built_at'])
+
+    def embed_query(self, query):
+        term_frequencies = self._hashed_term_frequencies(query)
+        return self._normalize_rows(np.sign(term_frequencies) * np.log1p(np.abs(term_frequencies)) * self.idf)
+
+    def search(self, query, k=20, min_similarity=0.0):
+        # [(catalog row, cosine similarity)] for the k best rows above min_similarity, best first.
+        if k <= 0 or not len(self.matrix):
+            return []
+        similarities = self.matrix @ self.embed_query(query)
+        k = min(k, len(similarities))
+        best_rows = np.argpartition(-similarities, k - 1)[:k]
+        best_rows = best_rows[np.argsort(-similarities[best_rows], kind='stable')]
+        return [(int(row), float(similarities[row])) for row in best_rows if similarities[row] >= min_similarity]
+
+_local_catalog = None
+_local_catalog_loaded = False
+_local_catalog_lock = threading.Lock()
+
+def get_local_catalog():
+    # Loads the local catalog once per process. Returns None if it's missing, unreadable or too old.
+    global _local_catalog, _local_catalog_loaded
+    if not _local_catalog_loaded:
+        with _local_catalog_lock:
+            if not _local_catalog_loaded:
+                if LOCAL_CATALOG_PATH and os.path.exists(LOCAL_CATALOG_PATH):
+                    try:
+                        catalog = LocalCatalog.load(LOCAL_CATALOG_PATH)
+                        age_hours = (time.time() - catalog.built_at) / 3600
+                        if age_hours > LOCAL_CATALOG_MAX_AGE_HOURS:
+                            print(f"⚠️  Catálogo local '{LOCAL_CATALOG_PATH}' tem {age_hours:.0f}h (máx. {LOCAL_CATALOG_MAX_AGE_HOURS:.0f}h). Ignorando; rode build_catalog.py para atualizar.") # User-facing: Portuguese
+                        else:
+                            _local_catalog = catalog
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️  Não foi possível carregar o catálogo local '{LOCAL_CATALOG_PATH}': {e}. Usando apenas o TMDb online.") # User-facing: Portuguese
+                _local_catalog_loaded = True
+    return _local_catalog
+
+_semantic_index = None
+_semantic_index_loaded = False
+
+def get_semantic_index():
+    # Loads the overview embeddings once; only returned when they were built from the loaded local catalog.
+    global _semantic_index, _semantic_index_loaded
+    local_catalog = get_local_catalog()
+    if not _semantic_index_loaded:
+        with _local_catalog_lock:
+            if not _semantic_index_loaded:
+                if local_catalog and SEMANTIC_INDEX_PATH and os.path.exists(SEMANTIC_INDEX_PATH):
+                    try:
+                        semantic_index = SemanticIndex.load(SEMANTIC_INDEX_PATH)
+                        if semantic_index.catalog_built_at == float(local_catalog.built_at) and len(semantic_index.tmdb_ids) == len(local_catalog):
+                            _semantic_index = semantic_index
+                        else:
+                            print(f"⚠️  Índice semântico '{SEMANTIC_INDEX_PATH}' não corresponde ao catálogo local. Ignorando; rode build_catalog.py novamente.") # User-facing: Portuguese
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️  Não foi possível carregar o índice semântico '{SEMANTIC_INDEX_PATH}': {e}.") # User-facing: Portuguese
+                _semantic_index_loaded = True
+    return _semantic_index if local_catalog else None
+
+# --- AVAILABILITY INDEX ---
+
+class AvailabilityIndex:
+    # Inverted index (region, provider_id, media_type) -> sorted array of TMDb ids streaming there (flatrate),
+    # filled from /discover?with_watch_providers by refresh_availability_index. A posting list whose crawl
+    # reached TMDb's last page is "complete": a title missing from it is known NOT to be available.
+    # Otherwise (popular titles only) a miss just means "unknown".
+    def __init__(self, postings, complete_keys, built_at):
+        self.postings = {tuple(key): array('q', sorted(set(ids))) for key, ids in postings}
+        self.complete_keys = {tuple(key) for key in complete_keys}
+        self.built_at = built_at
+
+    def contains(self, region, provider_id, media_type, tmdb_id):
+        # True / False, or None when the index can't tell.
+        key = (region, provider_id, media_type)
+        ids = self.postings.get(key)
+        if ids is None:
+            return None
+        position = bisect.bisect_left(ids, tmdb_id)
+        if position < len(ids) and ids[position] == tmdb_id:
+            return True
+        return False if key in self.complete_keys else None
+
+    def providers_for(self, region, media_type, tmdb_id, provider_ids):
+        # Provider ids (of provider_ids) carrying the title, or None if any of them is unknown for it.
+        available_provider_ids = []
+        for provider_id in provider_ids:
+            verdict = self.contains(region, provider_id, media_type, tmdb_id)
+            if verdict is None:
+                return None
+            if verdict:
+                available_provider_ids.append(provider_id)
+        return available_provider_ids
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as index_file:
+            payload = json.load(index_file)
+        return cls([(key, ids) for key, ids in payload['postings']], payload['complete_keys'], payload['built_at'])
+
+    def save(self, path):
+        payload = {
+            'version': 1, 'built_at': self.built_at,
+            'postings': [[list(key), ids.tolist()] for key, ids in self.postings.items()],
+            'complete_keys': [list(key) for key in self.complete_keys],
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as index_file:
+            json.dump(payload, index_file, separators=(',', ':'))
+
+def fetch_provider_title_ids(region, provider_id, media_type, max_pages):
+    # All flatrate titles of one provider via /discover (page 1 first for total_pages, then the rest concurrently).
+    # Returns (ids, complete); complete is False if a page failed or max_pages/TMDb's 500-page cap cut the crawl.
+    def fetch_page(page_num):
+        return make_tmdb_request(f"/discover/{media_type}", params={
+            'with_watch_providers': provider_id, 'watch_region': region, 'with_watch_monetization_types': 'flatrate',
+            'include_adult': 'false', 'sort_by': 'popularity.desc', 'page': page_num,
+        })
+    first_page = fetch_page(1)
+    if not first_page or 'results' not in first_page:
+        return [], False
+    total_pages = first_page.get('total_pages', 1)
+    last_page = min(total_pages, max_pages, 500)
+    pages = [first_page] + run_bounded_concurrently(fetch_page, range(2, last_page + 1))
+    ids = [item['id'] for page in pages if page for item in page.get('results', []) if item.get('id')]
+    return ids, last_page == total_pages and all(pages)
+
+def refresh_availability_index(regions, provider_ids=None, max_pages=None, path=None):
+    # Rebuilds the index for the given regions (default providers: the region's top AVAILABILITY_PROVIDERS_PER_REGION),
+    # saves it to path and swaps it in for this process. Meant for cron/build_availability_index.py or a service thread.
+    global _availability_index, _availability_index_loaded
+    max_pages = max_pages or AVAILABILITY_MAX_PAGES
+    postings, complete_keys = [], []
+    for region in regions:
+        region = region.upper()
+        region_provider_ids = provider_ids or list(get_provider_registry(region).provider_names)[:AVAILABILITY_PROVIDERS_PER_REGION]
+        for provider_id in region_provider_ids:
+            for media_type in ('movie', 'tv'):
+                ids, complete = fetch_provider_title_ids(region, provider_id, media_type, max_pages)
+                postings.append(((region, provider_id, media_type), ids))
+                if complete:
+                    complete_keys.append((region, provider_id, media_type))
+    availability_index = AvailabilityIndex(postings, complete_keys, time.time())
+    if path:
+        availability_index.save(path)
+    with _availability_index_lock:
+        _availability_index = availability_index
+        _availability_index_loaded = True
+    return availability_index
+
+_availability_index = None
+_availability_index_loaded = False
+_availability_index_lock = threading.Lock()
+
+def get_availability_index():
+    # Loads the availability index once per process (or returns the last refreshed one). None if missing or too old.
+    global _availability_index, _availability_index_loaded
+    if not _availability_index_loaded:
+        with _availability_index_lock:
+            if not _availability_index_loaded:
+                if AVAILABILITY_INDEX_PATH and os.path.exists(AVAILABILITY_INDEX_PATH):
+                    try:
+                        _availability_index = AvailabilityIndex.load(AVAILABILITY_INDEX_PATH)
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️  Não foi possível carregar o índice de disponibilidade '{AVAILABILITY_INDEX_PATH}': {e}.") # User-facing: Portuguese
+                _availability_index_loaded = True
+    availability_index = _availability_index
+    if availability_index and (time.time() - availability_index.built_at) / 3600 > AVAILABILITY_INDEX_MAX_AGE_HOURS:
+        return None
+    return availability_index
+
 # --- AGENT FUNCTION DEFINITIONS ---
 
+def get_age_band(child_age):
+    # Age bands used by the Stage 4 genre fallback (the only place the prospector looks at the age).
+    if child_age <= 7: return "ate_7"
+    elif child_age <= 12: return "8_a_12"
+    else: return "13_mais"
+
+def get_fallback_genre_ids(child_age):
+    age_band = get_age_band(child_age)
+    if age_band == "ate_7": return [16, 10751]  # Animation, Family
+    elif age_band == "8_a_12": return [10751, 12, 16, 35] # Family, Adventure, Animation, Comedy
+    else: return [12, 14, 878, 35, 18] # Adventure, Fantasy, Sci-Fi, Comedy, Drama
+
+@traced("agent")
 def agent_user_context_collector():
     # Agent 1: Collects user preferences.
     print("\n--- 🙋 Agente 1: Coletor de Contexto do Usuário ---") # User-facing: Portuguese
@@ -109,7 +1533,7 @@ def agent_user_context_collector():
     interests_query = input("➡️  Quais são os interesses da criança hoje (ex: 'animação divertida com animais falantes', 'filmes de aventura espacial')? ") # User-facing: Portuguese
     if not interests_query.strip():
         print("ℹ️  Nenhum interesse específico fornecido. Buscando por conteúdo popular infantil.") # User-facing: Portuguese
-        interests_query = "filmes infantis populares animação família" # Default fallback
+        interests_query = DEFAULT_INTERESTS_QUERY # Default fallback
     else:
         # Normaliza a string para tentar corrigir problemas de codificação com caracteres especiais
         interests_query = unicodedata.normalize('NFC', interests_query)
@@ -117,7 +1541,7 @@ def agent_user_context_collector():
     platforms_input_str = input("➡️  Digite as plataformas de streaming preferidas, separadas por vírgula (ex: 'Netflix, Disney Plus, Globoplay'): ") # User-facing: Portuguese
     preferred_platform_names_cleaned = [p.strip().lower() for p in platforms_input_str.split(',') if p.strip()]
     
-    print("✅ Contexto coletado. País definido como Brasil.") # User-facing: Portuguese
+    print(f"✅ Contexto coletado. País definido como {get_region_names(TARGET_COUNTRY_CODE)[0]}.") # User-facing: Portuguese
     return {
         "age": age,
         "interests_query": interests_query,
@@ -125,10 +1549,21 @@ def agent_user_context_collector():
         "country_code": TARGET_COUNTRY_CODE 
     }
 
-def agent_content_prospector(user_context):
+@traced("agent")
+def agent_content_prospector(user_context, on_prospect_found=None, fan_out=None, use_local_index=True, fallback_only=False):
     # Agent 2: Finds content on TMDb using multiple strategies.
     # This version reverts to the multi-stage search without the aggressive secondary keyword filtering
     # inside genre searches, and adds a flag if broad fallbacks were primarily used.
+    # on_prospect_found (optional) is called with each new prospect as soon as it is discovered,
+    # which lets the async pipeline start enriching before all stages have finished.
+    # fan_out (defaults to PROSPECTOR_FAN_OUT) issues each stage's queries concurrently; results are still
+    # merged in the original order, so dedup precedence and the popularity sort are unchanged.
+    # When a fresh local catalog (build_catalog.py) exists for the region, each stage queries it first and
+    # TMDb is only hit for the gap left below the 30-candidate budget. If overview embeddings were built
+    # too, a semantic top-k over the interest query is added before the title-keyword searches.
+    # use_local_index=False skips both (used by benchmark_retrieval.py for the baseline).
+    # fallback_only=True runs only the Stage 4 age-band genre fallback (flagged as fallback), e.g. when a run's
+    # TMDb budget ran out: those pages are the same for every user in the band, so they are usually cached.
     print("\n--- 🔎 Agente 2: Investigador de Conteúdo (Estratégias Múltiplas no TMDb) ---")
     if not TMDB_API_KEY: return [], False # Return prospects and fallback_engaged flag
 
@@ -136,141 +1571,192 @@ def agent_content_prospector(user_context):
     child_age = user_context['age']
     country_code = user_context['country_code']
     
+    if fan_out is None:
+        fan_out = PROSPECTOR_FAN_OUT
     all_prospects_map = {} 
     fallback_engaged = False # Flag to indicate if broad genre fallback was the main source
+    local_catalog = get_local_catalog() if use_local_index else None
+    if local_catalog and (local_catalog.region != country_code or local_catalog.language != TARGET_LANGUAGE_TMDB):
+        local_catalog = None
+    semantic_index = get_semantic_index() if local_catalog else None
+    provider_filter_params = {} # With PROSPECTOR_RESTRICT_TO_USER_PROVIDERS, /discover only returns titles on the user's platforms
+    if PROSPECTOR_RESTRICT_TO_USER_PROVIDERS:
+        user_provider_ids = sorted(set(map_user_platforms_to_provider_ids(user_context.get('preferred_platform_names', []), country_code).values()))
+        if user_provider_ids:
+            provider_filter_params = {
+                'with_watch_providers': '|'.join(map(str, user_provider_ids)), 'watch_region': country_code,
+                'with_watch_monetization_types': 'flatrate',
+            }
 
-    # STAGE 1: Gemini Interest Expansion for search terms and genre hints
-    print(f"🧠 Consultando o Gemini para expandir e categorizar o interesse: '{original_interest_query}'...")
-    search_terms_from_gemini = {original_interest_query} 
-    genre_hints_from_gemini = []
-    if gemini_model:
-        try:
-            prompt_for_gemini_analysis = (
-                f"Uma criança no Brasil está interessada em '{original_interest_query}'.\n"
-                f"1. Sugira de 2 a 4 frases ou palavras-chave alternativas e diversas para buscar filmes/séries sobre este tema no TMDb. Não inclua a frase original.\n"
-                f"2. Quais seriam os 2 ou 3 principais IDs de gênero do TMDb (ex: Animação=16, Aventura=12, Ficção científica=878, Família=10751, Comédia=35, Drama=18, Fantasia=14) que melhor se encaixam nesse interesse? Se não tiver certeza, não sugira IDs.\n"
-                f"Formato da resposta esperada:\n"
-                f"TERMOS: termo1, termo2, termo3\n"
-                f"GENEROS_IDS: 16, 10751"
-            )
-            response = gemini_model.generate_content(prompt_for_gemini_analysis)
-            if hasattr(response, 'text') and response.text:
-                lines = response.text.split('\n')
-                for line in lines:
-                    if line.upper().startswith("TERMOS:"):
-                        terms_str = line.split(":", 1)[1]
-                        additional_terms = [term.strip() for term in terms_str.split(',') if term.strip()]
-                        if additional_terms:
-                            for term in additional_terms: search_terms_from_gemini.add(term)
-                    elif line.upper().startswith("GENEROS_IDS:"):
-                        ids_str = line.split(":", 1)[1]
-                        try:
-                            genre_hints_from_gemini = [int(gid.strip()) for gid in ids_str.split(',') if gid.strip()]
-                        except ValueError:
-                            print("⚠️ Gemini sugeriu IDs de gênero em formato inválido.")
-                if search_terms_from_gemini != {original_interest_query}:
-                    print(f"💡 Termos de busca (original + Gemini): {search_terms_from_gemini}")
-                if genre_hints_from_gemini:
-                    print(f"💡 IDs de Gênero sugeridos por Gemini: {genre_hints_from_gemini}")
-            else:
-                print("⚠️ Gemini não forneceu análise utilizável.")
-        except Exception as e:
-            print(f"🔴 Erro durante a análise de interesses com Gemini: {e}.")
+    def add_local_prospects(local_prospects):
+        # Adds catalog hits with the same filters/dedup as the TMDb stages, stopping at the budget.
+        added_count = 0
+        for prospect in local_prospects:
+            if len(all_prospects_map) >= 30: break
+            if prospect['title'] and len(prospect['overview']) > 10 and prospect['tmdb_id'] not in all_prospects_map:
+                all_prospects_map[prospect['tmdb_id']] = prospect
+                if on_prospect_found: on_prospect_found(prospect)
+                added_count += 1
+        return added_count
+
+    initial_results_count = 0
+    if fallback_only:
+        print("ℹ️  Buscando apenas os gêneros populares para a idade (ETAPA 4).") # User-facing: Portuguese
     else:
-        print("ℹ️ Modelo Gemini não disponível. Usando apenas a consulta de interesse original.")
-
-    # STAGE 2: TMDb search using /search/multi with collected terms
-    print(f"\nETAPA 2: Tentando /search/multi com termos de busca...")
-    search_queries_to_try = list(search_terms_from_gemini)[:3] 
-    for page_num in range(1, 3): 
-        if len(all_prospects_map) >= 30: break
-        for term_query in search_queries_to_try:
-            if not term_query: continue
-            search_params = {
+        # STAGE 1: Gemini Interest Expansion for search terms and genre hints
+        print(f"🧠 Consultando o Gemini para expandir e categorizar o interesse: '{original_interest_query}'...")
+        search_terms_from_gemini = {original_interest_query} 
+        genre_hints_from_gemini = []
+        if is_gemini_available():
+            try:
+                prompt_for_gemini_analysis = (
+                    f"Uma criança no Brasil está interessada em '{original_interest_query}'.\n"
+                    f"1. Sugira de 2 a 4 frases ou palavras-chave alternativas e diversas para buscar filmes/séries sobre este tema no TMDb. Não inclua a frase original.\n"
+                    f"2. Quais seriam os 2 ou 3 principais IDs de gênero do TMDb (ex: Animação=16, Aventura=12, Ficção científica=878, Família=10751, Comédia=35, Drama=18, Fantasia=14) que melhor se encaixam nesse interesse? Se não tiver certeza, não sugira IDs.\n"
+                    f"Formato da resposta esperada:\n"
+                    f"TERMOS: termo1, termo2, termo3\n"
+                    f"GENEROS_IDS: 16, 10751"
+                )
+                normalized_interest_query = normalize_interests_query(original_interest_query)
+                response_text = generate_gemini_text(prompt_for_gemini_analysis, "interest_analysis", [normalized_interest_query],
+                                                     near_duplicate_text=normalized_interest_query)
+                if response_text:
+                    lines = response_text.split('\n')
+                    for line in lines:
+                        if line.upper().startswith("TERMOS:"):
+                            terms_str = line.split(":", 1)[1]
+                            additional_terms = [term.strip() for term in terms_str.split(',') if term.strip()]
+                            if additional_terms:
+                                for term in additional_terms: search_terms_from_gemini.add(term)
+                        elif line.upper().startswith("GENEROS_IDS:"):
+                            ids_str = line.split(":", 1)[1]
+                            try:
+                                genre_hints_from_gemini = [int(gid.strip()) for gid in ids_str.split(',') if gid.strip()]
+                            except ValueError:
+                                print("⚠️ Gemini sugeriu IDs de gênero em formato inválido.")
+                    if search_terms_from_gemini != {original_interest_query}:
+                        print(f"💡 Termos de busca (original + Gemini): {search_terms_from_gemini}")
+                    if genre_hints_from_gemini:
+                        print(f"💡 IDs de Gênero sugeridos por Gemini: {genre_hints_from_gemini}")
+                else:
+                    print("⚠️ Gemini não forneceu análise utilizável.")
+            except Exception as e:
+                print(f"🔴 Erro durante a análise de interesses com Gemini: {e}.")
+        else:
+            print("ℹ️ Modelo Gemini não disponível. Usando apenas a consulta de interesse original.")
+
+        # STAGE 2: TMDb search using /search/multi with collected terms
+        print(f"\nETAPA 2: Tentando /search/multi com termos de busca...")
+        search_queries_to_try = list(search_terms_from_gemini)[:3] 
+        if semantic_index and SEMANTIC_TOP_K > 0:
+            semantic_query = " ".join([original_interest_query] + sorted(search_terms_from_gemini - {original_interest_query}))
+            semantic_matches = semantic_index.search(semantic_query, SEMANTIC_TOP_K, SEMANTIC_MIN_SIMILARITY)
+            local_added = add_local_prospects(local_catalog.prospect_for_row(row) for row, _ in semantic_matches)
+            print(f"🧭 Busca semântica local: {local_added} títulos com sinopses parecidas com o interesse.")
+        if local_catalog:
+            local_added = sum(add_local_prospects(local_catalog.search_titles(term_query)) for term_query in search_queries_to_try if term_query)
+            print(f"📚 Catálogo local: {local_added} títulos encontrados pelos termos de busca.")
+        search_batch = TMDbFetchBatch({
+            (page_num, term_query): ("/search/multi", {
                 'query': term_query, 'include_adult': 'false',
                 'language': TARGET_LANGUAGE_TMDB, 'region': country_code, 'page': page_num
-            }
-            data = make_tmdb_request("/search/multi", params=search_params)
-            if data and 'results' in data:
-                for item in data['results']:
-                    media_type = item.get('media_type')
-                    if media_type in ['movie', 'tv']:
-                        title = item.get('title') if media_type == 'movie' else item.get('name')
-                        tmdb_id = item.get('id')
-                        overview = item.get('overview', '')
-                        if title and tmdb_id and len(overview) > 10 and tmdb_id not in all_prospects_map:
-                            all_prospects_map[tmdb_id] = {
-                                'tmdb_id': tmdb_id, 'title': title, 'media_type': media_type,
-                                'overview': overview, 'popularity': item.get('popularity', 0.0)
-                            }
-            if not data or not data.get('results'): break 
+            })
+            for page_num in range(1, 3) for term_query in search_queries_to_try if term_query
+        }, fan_out and len(all_prospects_map) < 30)
+        for page_num in range(1, 3): 
+            if len(all_prospects_map) >= 30: break
+            search_batch.prefetch((page_num, term_query) for term_query in search_queries_to_try if term_query)
+            for term_query in search_queries_to_try:
+                if not term_query: continue
+                data = search_batch.get((page_num, term_query))
+                if data and 'results' in data:
+                    for item in data['results']:
+                        media_type = item.get('media_type')
+                        if media_type in ['movie', 'tv']:
+                            title = item.get('title') if media_type == 'movie' else item.get('name')
+                            tmdb_id = item.get('id')
+                            overview = item.get('overview', '')
+                            if title and tmdb_id and len(overview) > 10 and tmdb_id not in all_prospects_map:
+                                all_prospects_map[tmdb_id] = Prospect(tmdb_id, media_type, title, overview, item.get('popularity', 0.0))
+                                if on_prospect_found: on_prospect_found(all_prospects_map[tmdb_id])
+                if not data or not data.get('results'): break 
+        search_batch.close()
     
-    initial_results_count = len(all_prospects_map)
+        initial_results_count = len(all_prospects_map)
 
-    # STAGE 3: If /search/multi yielded few results, try /discover with GENRE hints from Gemini
-    if len(all_prospects_map) < 15 and genre_hints_from_gemini:
-        print(f"\nETAPA 3: Buscas anteriores renderam {len(all_prospects_map)} resultados. Tentando /discover com GÊNEROS do Gemini: {genre_hints_from_gemini}...")
-        genre_ids_str = '|'.join(map(str, genre_hints_from_gemini))
-        for page_num in range(1, 3):
-            if len(all_prospects_map) >= 30: break
-            for media_type_to_discover in ['movie', 'tv']:
-                discover_params = {
+        # STAGE 3: If /search/multi yielded few results, try /discover with GENRE hints from Gemini
+        if len(all_prospects_map) < 15 and genre_hints_from_gemini:
+            print(f"\nETAPA 3: Buscas anteriores renderam {len(all_prospects_map)} resultados. Tentando /discover com GÊNEROS do Gemini: {genre_hints_from_gemini}...")
+            genre_ids_str = '|'.join(map(str, genre_hints_from_gemini))
+            if local_catalog:
+                local_added = add_local_prospects(local_catalog.search_genres(genre_hints_from_gemini, min_vote_count=20))
+                print(f"📚 Catálogo local: {local_added} títulos encontrados pelos gêneros sugeridos.")
+            discover_batch = TMDbFetchBatch({
+                (page_num, media_type_to_discover): (f"/discover/{media_type_to_discover}", {
                     'with_genres': genre_ids_str, 'include_adult': 'false',
                     'language': TARGET_LANGUAGE_TMDB, 'region': country_code,
                     'sort_by': 'popularity.desc', 'vote_count.gte': 20, 
-                    'page': page_num
-                }
-                data = make_tmdb_request(f"/discover/{media_type_to_discover}", params=discover_params)
-                if data and 'results' in data:
-                    for item in data['results']:
-                        title = item.get('title') if media_type_to_discover == 'movie' else item.get('name')
-                        tmdb_id = item.get('id')
-                        overview = item.get('overview', '')
-                        if title and tmdb_id and len(overview) > 10 and tmdb_id not in all_prospects_map:
-                            all_prospects_map[tmdb_id] = {
-                                'tmdb_id': tmdb_id, 'title': title, 'media_type': media_type_to_discover,
-                                'overview': overview, 'popularity': item.get('popularity', 0.0)
-                            }
+                    'page': page_num, **provider_filter_params
+                })
+                for page_num in range(1, 3) for media_type_to_discover in ['movie', 'tv']
+            }, fan_out and len(all_prospects_map) < 30)
+            for page_num in range(1, 3):
+                if len(all_prospects_map) >= 30: break
+                discover_batch.prefetch((page_num, media_type_to_discover) for media_type_to_discover in ['movie', 'tv'])
+                for media_type_to_discover in ['movie', 'tv']:
+                    data = discover_batch.get((page_num, media_type_to_discover))
+                    if data and 'results' in data:
+                        for item in data['results']:
+                            title = item.get('title') if media_type_to_discover == 'movie' else item.get('name')
+                            tmdb_id = item.get('id')
+                            overview = item.get('overview', '')
+                            if title and tmdb_id and len(overview) > 10 and tmdb_id not in all_prospects_map:
+                                all_prospects_map[tmdb_id] = Prospect(tmdb_id, media_type_to_discover, title, overview, item.get('popularity', 0.0))
+                                if on_prospect_found: on_prospect_found(all_prospects_map[tmdb_id])
+                    if not data or not data.get('results'): break 
                 if not data or not data.get('results'): break 
-            if not data or not data.get('results'): break 
+            discover_batch.close()
 
     # STAGE 4: Generic popular genres fallback if still few results
-    if len(all_prospects_map) < 10:
+    if len(all_prospects_map) < 10 or fallback_only:
         print(f"\nETAPA 4: Buscas anteriores renderam {len(all_prospects_map)} resultados. Tentando /discover por GÊNEROS populares genéricos para a idade...")
         if initial_results_count < 5 : # Consider fallback engaged if initial specific searches were poor
             fallback_engaged = True 
             print("INFO: Modo de fallback por gênero popular ativado devido a poucos resultados específicos.")
 
 
-        genre_ids_for_fallback = []
-        if child_age <= 7: genre_ids_for_fallback = [16, 10751]  # Animation, Family
-        elif child_age <= 12: genre_ids_for_fallback = [10751, 12, 16, 35] # Family, Adventure, Animation, Comedy
-        else: genre_ids_for_fallback = [12, 14, 878, 35, 18] # Adventure, Fantasy, Sci-Fi, Comedy, Drama
+        genre_ids_for_fallback = get_fallback_genre_ids(child_age)
 
         if genre_ids_for_fallback:
             genre_ids_str = '|'.join(map(str, genre_ids_for_fallback))
+            if local_catalog:
+                local_added = add_local_prospects(local_catalog.search_genres(genre_ids_for_fallback, min_vote_count=50))
+                print(f"📚 Catálogo local: {local_added} títulos encontrados pelos gêneros populares para a idade.")
+            fallback_batch = TMDbFetchBatch({
+                (page_num, media_type_to_discover): (f"/discover/{media_type_to_discover}", {
+                    'with_genres': genre_ids_str, 'include_adult': 'false',
+                    'language': TARGET_LANGUAGE_TMDB, 'region': country_code,
+                    'sort_by': 'popularity.desc', 'vote_count.gte': 50,
+                    'page': page_num, **provider_filter_params
+                })
+                for page_num in range(1, 3) for media_type_to_discover in ['movie', 'tv']
+            }, fan_out and len(all_prospects_map) < 30)
             for page_num in range(1,3): 
                 if len(all_prospects_map) >= 30: break
+                fallback_batch.prefetch((page_num, media_type_to_discover) for media_type_to_discover in ['movie', 'tv'])
                 for media_type_to_discover in ['movie', 'tv']:
-                    discover_params = {
-                        'with_genres': genre_ids_str, 'include_adult': 'false',
-                        'language': TARGET_LANGUAGE_TMDB, 'region': country_code,
-                        'sort_by': 'popularity.desc', 'vote_count.gte': 50,
-                        'page': page_num
-                    }
-                    data = make_tmdb_request(f"/discover/{media_type_to_discover}", params=discover_params)
+                    data = fallback_batch.get((page_num, media_type_to_discover))
                     if data and 'results' in data:
                         for item in data['results']:
                             title = item.get('title') if media_type_to_discover == 'movie' else item.get('name')
                             tmdb_id = item.get('id')
                             overview = item.get('overview', '')
                             if title and tmdb_id and len(overview) > 10 and tmdb_id not in all_prospects_map:
-                                all_prospects_map[tmdb_id] = {
-                                    'tmdb_id': tmdb_id, 'title': title, 'media_type': media_type_to_discover,
-                                    'overview': overview, 'popularity': item.get('popularity', 0.0)
-                                }
+                                all_prospects_map[tmdb_id] = Prospect(tmdb_id, media_type_to_discover, title, overview, item.get('popularity', 0.0))
+                                if on_prospect_found: on_prospect_found(all_prospects_map[tmdb_id])
                     if not data or not data.get('results'): break
                 if not data or not data.get('results'): break
+            fallback_batch.close()
     
     final_prospects_list = sorted(list(all_prospects_map.values()), key=lambda x: x['popularity'], reverse=True)[:30]
 
@@ -282,125 +1768,320 @@ def agent_content_prospector(user_context):
     # Return the list and the flag indicating if broad fallback was likely the main source of results
     return final_prospects_list, fallback_engaged
 
-def agent_detailed_enrichment(prospects_list, country_code_target):
-    # Agent 3: Enriches prospects with details like genres, TMDb rating, and country-specific age certification.
+def extract_age_certifications(details, media_type):
+    # Reads every region's age rating from one details payload (release_dates for movies, content_ratings for TV),
+    # so a title fetched once serves all regions. Returns {region: certification}; regions without one are left out.
+    age_certifications = {}
+    if media_type == 'movie' and 'release_dates' in details:
+        for release_region_info in details['release_dates'].get('results', []):
+            region = release_region_info.get('iso_3166_1')
+            if not region or region in age_certifications: continue
+            for date_entry in release_region_info.get('release_dates') or []:
+                cert = date_entry.get('certification')
+                if cert and cert.strip() and date_entry.get('type') in [3, 4, 5, 6]: 
+                    age_certifications[sys.intern(region)] = sys.intern(cert.strip())
+                    break
+    elif media_type == 'tv' and 'content_ratings' in details:
+        for rating_region_info in details['content_ratings'].get('results', []):
+            region = rating_region_info.get('iso_3166_1')
+            cert = rating_region_info.get('rating')
+            if region and region not in age_certifications and cert and cert.strip():
+                age_certifications[sys.intern(region)] = sys.intern(cert.strip())
+    return age_certifications
+
+def extract_age_certification(details, media_type, country_code_target):
+    # The country's age rating from a details payload ("N/A" when it has none).
+    return extract_age_certifications(details, media_type).get(country_code_target, "N/A")
+
+@traced("stage")
+def enrich_single_prospect(prospect, country_code_target, extra_regions=()):
+    # Fetches details + age certifications for one prospect and fills them in. Returns it, or None if the fetch failed.
+    # Titles present in a fresh local catalog for the same region are enriched from it without any HTTP call.
+    # The catalog only holds its own region, so it is skipped when the prospect will also be judged in extra_regions.
+    # print(f"Enriching '{prospect['title']}' (ID: {prospect['tmdb_id']}, Type: {prospect['media_type']})...") # Debug
+    local_catalog = get_local_catalog()
+    catalog_enrichment = local_catalog.get_enrichment(prospect['tmdb_id'], prospect['media_type'], country_code_target) if local_catalog and not extra_regions else None
+    if catalog_enrichment:
+        for field, value in catalog_enrichment.items():
+            prospect[field] = value
+        return prospect
+    endpoint = f"/{prospect['media_type']}/{prospect['tmdb_id']}"
+    # watch/providers rides along on the same call, so Agent 4 doesn't need a second request per title.
+    append_param = "release_dates" if prospect['media_type'] == 'movie' else "content_ratings"
+    append_param += ",watch/providers"
+    details = make_tmdb_request(endpoint, params={'append_to_response': append_param, 'language': TARGET_LANGUAGE_TMDB})
+    if not details:
+        # print(f"  Pulando '{prospect['title']}' - falha ao buscar detalhes.") # Debug
+        return None
+    return apply_tmdb_details(prospect, details)
+
+def apply_tmdb_details(prospect, details):
+    # Fills a prospect in place from its TMDb details payload. No copy: the prospect was built for this pool
+    # and nobody else holds it yet. The payload is region-independent; every region's data is kept.
+    prospect['genres'] = tuple(sys.intern(genre['name']) for genre in details.get('genres', []))
+    prospect['tmdb_vote_average'] = details.get('vote_average', 0.0)
+    prospect['tmdb_vote_count'] = details.get('vote_count', 0)
+    prospect['age_certifications'] = extract_age_certifications(details, prospect['media_type']) # {"BR": "L", "US": "PG", ...}
+    # Flatrate providers per region ({"BR": ((8, "Netflix"), ...), ...}), read by check_streaming_for_item
+    prospect['watch_providers'] = compact_watch_providers(details.get('watch/providers', {}).get('results', {}))
+    # print(f"  -> Gêneros: {prospect['genres']}, Nota TMDb: {prospect['tmdb_vote_average']:.1f} ({prospect['tmdb_vote_count']} votos), Class. Etárias: {prospect['age_certifications']}") # Debug
+    return prospect
+
+@traced("agent")
+def agent_detailed_enrichment(prospects_list, country_code_target, max_workers=None, extra_regions=()):
+    # Agent 3: Enriches prospects with details like genres, TMDb rating, and per-region age certifications.
+    # Detail fetches run concurrently (bounded by max_workers / TMDB_MAX_CONCURRENCY); output keeps the input order.
     print("\n--- 🧩 Agente 3: Enriquecimento Detalhado (Buscando Detalhes e Classificação Etária) ---") # User-facing: Portuguese
     if not TMDB_API_KEY or not prospects_list: return []
-    enriched_prospects = []
-    for prospect in prospects_list:
-        # print(f"Enriching '{prospect['title']}' (ID: {prospect['tmdb_id']}, Type: {prospect['media_type']})...") # Debug
-        endpoint = f"/{prospect['media_type']}/{prospect['tmdb_id']}"
-        append_param = "release_dates" if prospect['media_type'] == 'movie' else "content_ratings"
-        details = make_tmdb_request(endpoint, params={'append_to_response': append_param, 'language': TARGET_LANGUAGE_TMDB})
-        if not details:
-            # print(f"  Pulando '{prospect['title']}' - falha ao buscar detalhes.") # Debug
-            continue
-        enriched_item = prospect.copy()
-        enriched_item['genres'] = [genre['name'] for genre in details.get('genres', [])]
-        enriched_item['tmdb_vote_average'] = details.get('vote_average', 0.0)
-        enriched_item['tmdb_vote_count'] = details.get('vote_count', 0)
-        age_certification_in_country = "N/A"
-        if prospect['media_type'] == 'movie' and 'release_dates' in details:
-            for release_region_info in details['release_dates'].get('results', []):
-                if release_region_info.get('iso_3166_1') == country_code_target:
-                    if release_region_info.get('release_dates'):
-                        for date_entry in release_region_info['release_dates']:
-                            cert = date_entry.get('certification')
-                            if cert and cert.strip() and date_entry.get('type') in [3, 4, 5, 6]: 
-                                age_certification_in_country = cert.strip()
-                                break
-                        if age_certification_in_country != "N/A": break
-        elif prospect['media_type'] == 'tv' and 'content_ratings' in details:
-            for rating_region_info in details['content_ratings'].get('results', []):
-                if rating_region_info.get('iso_3166_1') == country_code_target:
-                    cert = rating_region_info.get('rating')
-                    if cert and cert.strip():
-                        age_certification_in_country = cert.strip()
-                        break
-        enriched_item['age_certification_country'] = age_certification_in_country
-        enriched_prospects.append(enriched_item)
-        # print(f"  -> Gêneros: {enriched_item['genres']}, Nota TMDb: {enriched_item['tmdb_vote_average']:.1f} ({enriched_item['tmdb_vote_count']} votos), Class. Etária ({country_code_target}): {age_certification_in_country}") # Debug
+    enriched_results = run_bounded_concurrently(
+        lambda prospect: enrich_single_prospect(prospect, country_code_target, extra_regions), prospects_list, max_workers
+    )
+    enriched_prospects = [item for item in enriched_results if item is not None]
+    if len(enriched_prospects) < len(prospects_list):
+        print(f"⚠️  {len(prospects_list) - len(enriched_prospects)} títulos ficaram de fora: não foi possível obter seus detalhes no TMDb.") # User-facing: Portuguese
     print("✅ Processo de enriquecimento completo.") # User-facing: Portuguese
     return enriched_prospects
 
-def agent_streaming_availability_verifier(enriched_prospects_list, user_context_details):
+def enrich_age_band_fallback(user_context, known_prospects, extra_regions=()):
+    # Run-budget degradation: the TMDb budget ran out before every candidate got its details. Instead of a short
+    # pool, the run adds the Stage 4 age-band fallback, enriched from the cache (cache hits don't spend budget).
+    # Returns the enriched fallback titles not already among known_prospects.
+    print("\nℹ️  Orçamento do TMDb esgotado antes de detalhar todos os candidatos. Completando com gêneros populares para a idade.") # User-facing: Portuguese
+    fallback_prospects, _ = agent_content_prospector(user_context, fallback_only=True)
+    known_keys = {(prospect['media_type'], prospect['tmdb_id']) for prospect in known_prospects}
+    new_prospects = [prospect for prospect in fallback_prospects if (prospect['media_type'], prospect['tmdb_id']) not in known_keys]
+    return agent_detailed_enrichment(new_prospects, user_context['country_code'], extra_regions=extra_regions)
+
+def map_user_platforms_to_provider_ids(platform_names, watch_region):
+    # {platform name typed by the user: TMDb provider id} for the names we can resolve.
+    target_provider_ids_map = {}
+    for platform_name_clean in platform_names:
+        provider_id = get_tmdb_provider_id_from_name(platform_name_clean, watch_region=watch_region)
+        if provider_id:
+            target_provider_ids_map[platform_name_clean] = provider_id
+    return target_provider_ids_map
+
+@traced("stage")
+def check_streaming_for_item(item, target_country_code, target_provider_ids):
+    # Looks up flatrate providers for one title and records which of the user's platforms carry it.
+    # Returns a per-user view of the prospect; the prospect itself (shared by a cached pool) is not touched.
+    # print(f"Verificando streaming para '{item['title']}'...") # Debug
+    availability_index = get_availability_index()
+    available_provider_ids = availability_index.providers_for(
+        target_country_code, item['media_type'], item['tmdb_id'], target_provider_ids
+    ) if availability_index and target_provider_ids else None
+    if available_provider_ids is not None: # The index knows every one of the user's providers: a membership check
+        provider_registry = get_provider_registry(target_country_code)
+        return UserCandidate(item, sorted({
+            provider_registry.provider_names.get(provider_id, str(provider_id)) for provider_id in available_provider_ids
+        }), target_country_code)
+    if 'watch_providers' in item: # Already fetched by Agent 3 via append_to_response
+        watch_providers = item['watch_providers']
+    else:
+        providers_data = make_tmdb_request(f"/{item['media_type']}/{item['tmdb_id']}/watch/providers")
+        watch_providers = compact_watch_providers(providers_data.get('results')) if providers_data else {}
+    available_on_user_platforms = sorted({
+        provider_name for provider_id, provider_name in watch_providers.get(target_country_code, ())
+        if provider_id in target_provider_ids
+    })
+    # if available_on_user_platforms: print(f"  -> ✅ Disponível em: {', '.join(available_on_user_platforms)}") # Debug
+    # else: # Commented out for less verbose output
+        # print(f"  -> ℹ️ Não encontrado nos seus serviços de streaming preferidos em {target_country_code} (ou sem mapeamento para seus serviços).") # User-facing: Portuguese
+    return UserCandidate(item, available_on_user_platforms, target_country_code)
+
+@traced("agent")
+def agent_streaming_availability_verifier(enriched_prospects_list, user_context_details, max_workers=None):
     # Agent 4: Checks streaming availability on user's preferred platforms in their country.
+    # Provider lookups run concurrently (bounded by max_workers / TMDB_MAX_CONCURRENCY); output keeps the input order.
     print("\n--- 📺 Agente 4: Verificador de Disponibilidade em Streaming ---") # User-facing: Portuguese
     if not TMDB_API_KEY or not enriched_prospects_list: return []
     target_country_code = user_context_details['country_code']
     user_preferred_platform_names_clean = user_context_details['preferred_platform_names']
-    target_provider_ids_map = {}
-    for platform_name_clean in user_preferred_platform_names_clean:
-        provider_id = get_tmdb_provider_id_from_name(platform_name_clean, watch_region=target_country_code)
-        if provider_id:
-            target_provider_ids_map[platform_name_clean] = provider_id
+    target_provider_ids_map = map_user_platforms_to_provider_ids(user_preferred_platform_names_clean, target_country_code)
     if not target_provider_ids_map:
         print(f"⚠️  Não foi possível mapear nenhuma das suas plataformas preferidas ({', '.join(user_preferred_platform_names_clean)}) para IDs conhecidos do TMDb. Não é possível verificar o streaming com precisão.") # User-facing: Portuguese
     # print(f"Verificando disponibilidade nas plataformas reconhecidas (IDs: {list(target_provider_ids_map.values())}) em {target_country_code}") # Debug
-    prospects_with_streaming_info = []
-    for item in enriched_prospects_list:
-        # print(f"Verificando streaming para '{item['title']}'...") # Debug
-        item_copy = item.copy()
-        item_copy['available_on_user_platforms'] = []
-        providers_data = make_tmdb_request(f"/{item['media_type']}/{item['tmdb_id']}/watch/providers")
-        if providers_data and 'results' in providers_data and target_country_code in providers_data['results']:
-            country_specific_providers = providers_data['results'][target_country_code]
-            if 'flatrate' in country_specific_providers:
-                for tmdb_provider_info in country_specific_providers['flatrate']:
-                    tmdb_provider_id = tmdb_provider_info.get('provider_id')
-                    tmdb_provider_name_from_api = tmdb_provider_info.get('provider_name')
-                    if tmdb_provider_id in target_provider_ids_map.values():
-                        item_copy['available_on_user_platforms'].append(tmdb_provider_name_from_api)
-        if item_copy['available_on_user_platforms']:
-            item_copy['available_on_user_platforms'] = sorted(list(set(item_copy['available_on_user_platforms'])))
-            # print(f"  -> ✅ Disponível em: {', '.join(item_copy['available_on_user_platforms'])}") # Debug
-        # else: # Commented out for less verbose output
-            # print(f"  -> ℹ️ Não encontrado nos seus serviços de streaming preferidos em {target_country_code} (ou sem mapeamento para seus serviços).") # User-facing: Portuguese
-        prospects_with_streaming_info.append(item_copy)
+    target_provider_ids = set(target_provider_ids_map.values())
+    prospects_with_streaming_info = run_bounded_concurrently(
+        lambda item: check_streaming_for_item(item, target_country_code, target_provider_ids), enriched_prospects_list, max_workers
+    )
     print("✅ Verificação de disponibilidade em streaming completa.") # User-facing: Portuguese
     return prospects_with_streaming_info
 
+NEVER_APPROPRIATE_MIN_AGE = 99 # Sentinel minimum age for certifications the POC rules never accept
+UNRATED_CERTIFICATIONS = frozenset(("N/A", "NOT RATED", "UNRATED", ""))
+
+# Per-region certification tables: certification -> minimum child age (a key ending in "*" matches by prefix).
+# Ratings missing from a region's table are never accepted, and regions without a table only accept unrated titles.
+# More regions (or overrides) plug in via register_certification_table or a CERTIFICATION_TABLES_PATH JSON file.
+CERTIFICATION_TABLES = {
+    "BR": {"L": 0, "AL*": 0, "10": 10, "12": 12, "14": 14, "16": 16, "18": 18},
+    "PT": {"M/3": 3, "M/4": 4, "M/6": 6, "M/12": 12, "M/14": 14, "M/16": 16, "M/18": 18, "T": 0, "10AP": 10, "12AP": 12, "16": 16, "18": 18},
+    "US": {"G": 0, "PG": 8, "PG-13": 13, "R": 17, "NC-17": 18, "NR": 0, # "NR" is the US "not rated" tag
+           "TV-Y": 0, "TV-Y7": 7, "TV-G": 0, "TV-PG": 8, "TV-14": 14, "TV-MA": 17},
+    "GB": {"U": 0, "UC": 0, "PG": 8, "12A": 12, "12": 12, "15": 15, "18": 18, "R18": 18},
+    "MX": {"AA": 0, "A": 0, "B": 12, "B-15": 15, "B15": 15, "C": 18, "D": 18},
+    "AR": {"ATP": 0, "+13": 13, "+16": 16, "+18": 18, "C": 18},
+    "ES": {"A": 0, "APTA": 0, "TP": 0, "7": 7, "10": 10, "12": 12, "13": 13, "16": 16, "18": 18},
+    "DE": {"0": 0, "6": 6, "12": 12, "16": 16, "18": 18},
+}
+REGION_NAMES = { # region -> (name, "in <region>" phrase) for prompts and messages, in Portuguese
+    "BR": ("Brasil", "no Brasil"), "PT": ("Portugal", "em Portugal"), "US": ("Estados Unidos", "nos Estados Unidos"),
+    "GB": ("Reino Unido", "no Reino Unido"), "MX": ("México", "no México"), "AR": ("Argentina", "na Argentina"),
+    "ES": ("Espanha", "na Espanha"), "DE": ("Alemanha", "na Alemanha"),
+}
+_certification_tables_loaded = False
+
+def get_region_names(country_code):
+    return REGION_NAMES.get(country_code, (country_code, f"em {country_code}"))
+
+def register_certification_table(region, min_age_by_certification):
+    # Adds (or replaces entries of) a region's certification table.
+    table = CERTIFICATION_TABLES.setdefault(region.upper(), {})
+    table.update({str(certification).strip().upper(): int(min_age) for certification, min_age in min_age_by_certification.items()})
+    certification_min_age.cache_clear()
+
+def load_certification_tables(tables_path=None):
+    # Merges {"REGION": {"certification": min_age}} from a JSON file over the built-in tables.
+    tables_path = tables_path or CERTIFICATION_TABLES_PATH
+    try:
+        with open(tables_path, encoding='utf-8') as tables_file:
+            for region, table in json.load(tables_file).items():
+                register_certification_table(region, table)
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        print(f"⚠️  Não foi possível carregar as tabelas de classificação de '{tables_path}': {e}") # User-facing: Portuguese
+
+@functools.lru_cache(maxsize=4096)
+def certification_min_age(certification, country_code):
+    # Minimum child age for which the POC rules accept this certification (NEVER_APPROPRIATE_MIN_AGE = never).
+    # Unrated titles are accepted everywhere; rated ones follow the region's certification table.
+    global _certification_tables_loaded
+    if not _certification_tables_loaded:
+        _certification_tables_loaded = True
+        if CERTIFICATION_TABLES_PATH:
+            load_certification_tables()
+    certification_str = (certification or "N/A").strip().upper()
+    if certification_str in UNRATED_CERTIFICATIONS:
+        return 0
+    table = CERTIFICATION_TABLES.get(country_code, {})
+    if certification_str in table:
+        return table[certification_str]
+    for key, min_age in table.items():
+        if key.endswith("*") and certification_str.startswith(key[:-1]):
+            return min_age
+    return NEVER_APPROPRIATE_MIN_AGE
+
+def is_age_appropriate(certification, child_age, country_code):
+    return certification_min_age(certification, country_code) <= child_age
+
+def is_suitable_and_available(item, user_context_data):
+    # True when the title is on one of the user's platforms and passes the age rule.
+    if not item.get('available_on_user_platforms'):
+        return False
+    return is_age_appropriate(item.get('age_certification_country', "N/A"), user_context_data['age'], user_context_data['country_code'])
+
+class CandidateTable:
+    # Struct-of-arrays view over enriched + availability-checked candidates, so the age/availability
+    # filter and the popularity top-k run as NumPy array operations instead of a per-item Python loop.
+    MAX_PLATFORM_BITS = 64
+
+    def __init__(self, items, country_code):
+        self.items = list(items)
+        item_count = len(self.items)
+        self.min_age = np.fromiter(
+            (certification_min_age(item.get('age_certification_country', "N/A"), country_code) for item in self.items),
+            dtype=np.int16, count=item_count,
+        )
+        self.platform_bits = {} # platform name -> bit position in platform_mask
+        self.platform_mask = np.zeros(item_count, dtype=np.uint64)
+        for row, item in enumerate(self.items):
+            row_mask = 0
+            for platform_name in item.get('available_on_user_platforms') or ():
+                if platform_name not in self.platform_bits:
+                    # Past 64 distinct platforms the extra names share the last bit (availability stays correct).
+                    self.platform_bits[platform_name] = min(len(self.platform_bits), self.MAX_PLATFORM_BITS - 1)
+                row_mask |= 1 << self.platform_bits[platform_name]
+            self.platform_mask[row] = row_mask
+        self.popularity = np.fromiter((item.get('popularity', 0.0) for item in self.items), dtype=np.float64, count=item_count)
+        self.vote_average = np.fromiter((item.get('tmdb_vote_average', 0.0) for item in self.items), dtype=np.float32, count=item_count)
+        self.vote_count = np.fromiter((item.get('tmdb_vote_count', 0) for item in self.items), dtype=np.int32, count=item_count)
+
+    def eligible_mask(self, child_age):
+        return (self.platform_mask != 0) & (self.min_age <= child_age)
+
+    def top_k(self, child_age, k=3):
+        # Most popular eligible items; the stable sort keeps input order on ties, like sorted(..., reverse=True).
+        eligible_rows = np.flatnonzero(self.eligible_mask(child_age))
+        ranked_rows = eligible_rows[np.argsort(-self.popularity[eligible_rows], kind='stable')][:k]
+        return [self.items[row] for row in ranked_rows]
+
+@traced("stage")
+def select_top_recommendations(fully_enriched_prospects, user_context_data, top_n=3):
+    # Filters by availability + age and returns the top_n most popular survivors.
+    candidate_table = CandidateTable(fully_enriched_prospects, user_context_data['country_code'])
+    return candidate_table.top_k(user_context_data['age'], top_n)
+
+@traced("stage")
+def generate_recommendation_justification(rec_item, user_context_data, fallback_mode_engaged):
+    # Asks Gemini for a short parent-facing paragraph about one title. Always returns a usable string.
+    print(f"🤖 Gerando justificativa com Gemini para '{rec_item['title']}'...") 
+    platforms_str = ', '.join(rec_item['available_on_user_platforms']) if rec_item['available_on_user_platforms'] else "serviços de streaming selecionados"
+    region_name, in_region = get_region_names(user_context_data['country_code'])
+    try:
+        genres_str = ', '.join(rec_item['genres']) if rec_item['genres'] else "diversos gêneros interessantes"
+        
+        disclaimer_prefix = ""
+        if fallback_mode_engaged:
+            disclaimer_prefix = (
+                f"Não encontramos um resultado perfeito para '{user_context_data['interests_query']}' nas plataformas e idade indicadas. "
+                f"No entanto, com base em gêneros populares para {user_context_data['age']} anos, encontramos '{rec_item['title']}'. "
+            )
+
+        prompt_for_gemini = (
+            f"{disclaimer_prefix}"
+            f"O usuário é um pai/mãe {in_region} procurando um(a) {rec_item['media_type']} para seu/sua filho(a) de {user_context_data['age']} anos. "
+            f"O interesse original era '{user_context_data['interests_query']}'.\n"
+            f"A opção encontrada é: '{rec_item['title']}'.\n"
+            f"Sinopse breve: {rec_item['overview']}\n"
+            f"Gêneros: {genres_str}.\n"
+            f"Nota TMDb: {rec_item['tmdb_vote_average']:.1f}/10 ({rec_item['tmdb_vote_count']} votos).\n"
+            f"Classificação Indicativa ({region_name}): '{rec_item['age_certification_country']}'.\n"
+            f"Disponível em: {platforms_str}.\n\n"
+            f"Por favor, escreva um parágrafo curto (2-3 frases), amigável e envolvente para o pai/mãe. "
+            f"{ 'Mesmo que não seja uma combinação exata com o interesse original, e' if fallback_mode_engaged else 'E'}xplique por que '{rec_item['title']}' ainda assim poderia ser uma boa escolha para a criança hoje. " # Ajuste na frase
+            f"Destaque aspectos positivos (gêneros, temas, apelo geral). "
+            f"Encoraje-os a assistir. Soe entusiasmado e prestativo. Mantenha conciso e em português do Brasil."
+        )
+        response_text = generate_gemini_text(prompt_for_gemini, "justification", [
+            rec_item['media_type'], rec_item['tmdb_id'], normalize_interests_query(user_context_data['interests_query']),
+            user_context_data['age'], bool(fallback_mode_engaged), platforms_str, rec_item['age_certification_country'],
+            user_context_data['country_code'],
+        ])
+        if response_text.strip():
+            return response_text.strip()
+        else:
+            print(f"⚠️  Resposta do Gemini para '{rec_item['title']}' vazia ou em formato inesperado.") 
+            return f"'{rec_item['title']}' parece uma boa opção com base nos seus critérios! Você pode encontrá-lo em {platforms_str}." 
+    except Exception as e:
+        print(f"🔴 Erro durante a justificativa com Gemini para '{rec_item['title']}': {e}") 
+        return f"Não foi possível gerar uma justificativa detalhada devido a um erro, mas '{rec_item['title']}' parece promissor e está em {platforms_str}!" 
+
+@traced("agent")
 def agent_recommendation_selector_and_justifier(fully_enriched_prospects, user_context_data, fallback_mode_engaged): # Novo parâmetro
     # Agent 5: Filters, selects, and gets Gemini justification, aware of fallback mode.
     print("\n--- ⭐ Agente 5: Seletor de Recomendações e Justificador ---") 
-    # ... (início da função e filtros de disponibilidade/idade permanecem os mesmos) ...
     if not fully_enriched_prospects:
         print("⚠️  Nenhum prospecto disponível para selecionar.")
         return []
-    child_s_age = user_context_data['age']
-    target_country = user_context_data['country_code'] 
-    suitable_and_available_options = []
-    for item in fully_enriched_prospects:
-        if not item.get('available_on_user_platforms'):
-            continue
-        certification_str = item.get('age_certification_country', "N/A").upper()
-        is_age_appropriate_for_child = False
-        if certification_str == "N/A" or certification_str == "NOT RATED" or certification_str == "UNRATED" or certification_str == "":
-            is_age_appropriate_for_child = True 
-        elif target_country == "BR": 
-            if certification_str == "L" : is_age_appropriate_for_child = True
-            elif certification_str.startswith("AL") : is_age_appropriate_for_child = True
-            elif certification_str == "10" and child_s_age >= 10: is_age_appropriate_for_child = True
-            elif certification_str == "12" and child_s_age >= 12: is_age_appropriate_for_child = True
-            elif certification_str == "14" and child_s_age >= 14: is_age_appropriate_for_child = True
-            elif certification_str == "16" and child_s_age >= 16: is_age_appropriate_for_child = True
-            elif certification_str == "18" and child_s_age >= 18: is_age_appropriate_for_child = True
-            else: is_age_appropriate_for_child = False 
-        else: 
-            is_age_appropriate_for_child = certification_str == "N/A" 
-        
-        if not is_age_appropriate_for_child:
-            continue
-        suitable_and_available_options.append(item)
+    recommendations_to_justify = select_top_recommendations(fully_enriched_prospects, user_context_data)
 
-    if not suitable_and_available_options:
+    if not recommendations_to_justify:
         print("⚠️  Nenhuma recomendação encontrada que seja apropriada para a idade (baseado na lógica da POC) e disponível em suas plataformas.")
         return []
     
-    recommendations_to_justify = sorted(suitable_and_available_options, key=lambda x: x.get('popularity', 0.0), reverse=True)[:3] 
     final_recommendations_with_text = []
 
-    if not gemini_model:
+    if not is_gemini_available():
         print("⚠️  Modelo Gemini não disponível. Pulando justificativas.") 
         for rec in recommendations_to_justify:
              rec['gemini_justification'] = "Justificativa não disponível (API do Gemini não configurada)."
@@ -410,109 +2091,65 @@ def agent_recommendation_selector_and_justifier(fully_enriched_prospects, user_c
 
     for rec_item in recommendations_to_justify:
         rec_item['used_fallback_search'] = fallback_mode_engaged # Propagar a flag para cada item
-        print(f"🤖 Gerando justificativa com Gemini para '{rec_item['title']}'...") 
-        try:
-            platforms_str = ', '.join(rec_item['available_on_user_platforms']) if rec_item['available_on_user_platforms'] else "serviços de streaming selecionados"
-            genres_str = ', '.join(rec_item['genres']) if rec_item['genres'] else "diversos gêneros interessantes"
-            
-            disclaimer_prefix = ""
-            if fallback_mode_engaged:
-                disclaimer_prefix = (
-                    f"Não encontramos um resultado perfeito para '{user_context_data['interests_query']}' nas plataformas e idade indicadas. "
-                    f"No entanto, com base em gêneros populares para {user_context_data['age']} anos, encontramos '{rec_item['title']}'. "
-                )
-
-            prompt_for_gemini = (
-                f"{disclaimer_prefix}"
-                f"O usuário é um pai/mãe no Brasil procurando um(a) {rec_item['media_type']} para seu/sua filho(a) de {user_context_data['age']} anos. "
-                f"O interesse original era '{user_context_data['interests_query']}'.\n"
-                f"A opção encontrada é: '{rec_item['title']}'.\n"
-                f"Sinopse breve: {rec_item['overview']}\n"
-                f"Gêneros: {genres_str}.\n"
-                f"Nota TMDb: {rec_item['tmdb_vote_average']:.1f}/10 ({rec_item['tmdb_vote_count']} votos).\n"
-                f"Classificação Indicativa (Brasil): '{rec_item['age_certification_country']}'.\n"
-                f"Disponível em: {platforms_str}.\n\n"
-                f"Por favor, escreva um parágrafo curto (2-3 frases), amigável e envolvente para o pai/mãe. "
-                f"{ 'Mesmo que não seja uma combinação exata com o interesse original, e' if fallback_mode_engaged else 'E'}xplique por que '{rec_item['title']}' ainda assim poderia ser uma boa escolha para a criança hoje. " # Ajuste na frase
-                f"Destaque aspectos positivos (gêneros, temas, apelo geral). "
-                f"Encoraje-os a assistir. Soe entusiasmado e prestativo. Mantenha conciso e em português do Brasil."
-            )
-            response = gemini_model.generate_content(prompt_for_gemini)
-            # ... (resto da lógica de tratamento da resposta do Gemini) ...
-            if hasattr(response, 'text') and response.text:
-                rec_item['gemini_justification'] = response.text.strip()
-            elif hasattr(response, 'parts') and response.parts: 
-                rec_item['gemini_justification'] = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
-            else:
-                print(f"⚠️  Resposta do Gemini para '{rec_item['title']}' vazia ou em formato inesperado.") 
-                rec_item['gemini_justification'] = f"'{rec_item['title']}' parece uma boa opção com base nos seus critérios! Você pode encontrá-lo em {platforms_str}." 
-        except Exception as e:
-            print(f"🔴 Erro durante a justificativa com Gemini para '{rec_item['title']}': {e}") 
-            rec_item['gemini_justification'] = f"Não foi possível gerar uma justificativa detalhada devido a um erro, mas '{rec_item['title']}' parece promissor e está em {platforms_str}!" 
+        rec_item['gemini_justification'] = generate_recommendation_justification(rec_item, user_context_data, fallback_mode_engaged)
         final_recommendations_with_text.append(rec_item)
     print("✅ Recomendações selecionadas e tentativas de justificativas completas.") 
     return final_recommendations_with_text
 
-def agent_existence_verifier(recommendations_list, user_context_details, fallback_mode_engaged): # Novo parâmetro
-    # Optional Agent: Verifies title existence and relevance.
-    print("\n--- 🤔 Agente Extra: Verificador de Existência e Relevância (Consultando Gemini com Pesquisa Google) ---")
-    # ... (lógica interna pode permanecer a mesma ou usar fallback_mode_engaged para ajustar o prompt/interpretação) ...
-    # Por ora, manteremos a lógica interna igual, mas a flag está disponível.
-    if not gemini_model or not recommendations_list:
-        if not gemini_model: print("⚠️  Modelo Gemini não disponível. Pulando verificação de existência.")
-        return recommendations_list 
+@traced("stage")
+def verify_single_recommendation(rec_item, user_context_details, fallback_mode_engaged):
+    # Asks Gemini whether one title is real/suitable. Sets the verification flags on rec_item and
+    # returns True if the title should be kept.
+    title_to_check = rec_item['title']
+    media_type_to_check = rec_item['media_type']
+    platform_to_check_mention = rec_item['available_on_user_platforms'][0] if rec_item['available_on_user_platforms'] else "alguma plataforma de streaming"
 
-    verified_recommendations = []
-    for rec_item in recommendations_list:
-        title_to_check = rec_item['title']
-        media_type_to_check = rec_item['media_type']
-        platform_to_check_mention = rec_item['available_on_user_platforms'][0] if rec_item['available_on_user_platforms'] else "alguma plataforma de streaming"
-
-        # print(f"Verificando '{title_to_check}' ({media_type_to_check})...") 
-        
-        try:
-            disclaimer_prefix_verifier = ""
-            if fallback_mode_engaged and rec_item.get('used_fallback_search', False): # Check if this specific item was from fallback
-                 disclaimer_prefix_verifier = (
-                    f"Este título '{title_to_check}' foi sugerido como uma alternativa, pois a busca específica por "
-                    f"'{user_context_details['interests_query']}' não retornou resultados diretos. "
-                )
-            
-            prompt_for_verification = (
-                f"{disclaimer_prefix_verifier}"
-                f"Com base em informações da Pesquisa Google, o {media_type_to_check} chamado '{title_to_check}' "
-                f"é um título real e conhecido? Ele parece ser adequado para uma criança de {user_context_details['age']} anos interessada em '{user_context_details['interests_query']}' (mesmo que seja uma sugestão alternativa)? "
-                f"Além disso, há alguma menção de que esteja disponível em '{platform_to_check_mention}' no Brasil? "
-                f"Responda sobre a existência (SIM/NÃO/INCERTO). Se SIM, comente brevemente sobre a adequação à idade/interesse e sobre a plataforma se houver dados claros. Responda em português do Brasil."
+    # print(f"Verificando '{title_to_check}' ({media_type_to_check})...") 
+    
+    try:
+        disclaimer_prefix_verifier = ""
+        if fallback_mode_engaged and rec_item.get('used_fallback_search', False): # Check if this specific item was from fallback
+             disclaimer_prefix_verifier = (
+                f"Este título '{title_to_check}' foi sugerido como uma alternativa, pois a busca específica por "
+                f"'{user_context_details['interests_query']}' não retornou resultados diretos. "
             )
-            
-            response = gemini_model.generate_content(prompt_for_verification)
-            # ... (resto da lógica de interpretação da resposta do Gemini) ...
-            verification_text = ""
-            if hasattr(response, 'text') and response.text:
-                verification_text = response.text.strip() 
-            elif hasattr(response, 'parts') and response.parts:
-                verification_text = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
-
-            # print(f"  -> Resposta da verificação Gemini: '{verification_text}'") 
-
-            if "SIM" in verification_text.upper() or title_to_check.lower() in verification_text.lower():
-                if "NÃO SER IDEAL" in verification_text.upper() or "NÃO ADEQUADO" in verification_text.upper() or "NÃO RECOMENDADO PARA A IDADE" in verification_text.upper():
-                    pass 
-                else:
-                    rec_item['existence_verified_by_gemini'] = True
-                    if platform_to_check_mention.lower() in verification_text.lower() or "ENCONTRADO EM" in verification_text.upper() or "DISPONÍVEL EM" in verification_text.upper():
-                        rec_item['platform_mention_verified_by_gemini'] = True
-                    verified_recommendations.append(rec_item)
-            elif "INCERTO" in verification_text.upper():
-                rec_item['existence_verified_by_gemini'] = "INCERTO"
-                verified_recommendations.append(rec_item) 
         
-        except Exception as e:
-            print(f"🔴 Erro durante a verificação de existência com Gemini para '{title_to_check}': {e}") 
-            rec_item['existence_verified_by_gemini'] = "ERRO_NA_VERIFICACAO"
-            verified_recommendations.append(rec_item) 
+        prompt_for_verification = (
+            f"{disclaimer_prefix_verifier}"
+            f"Com base em informações da Pesquisa Google, o {media_type_to_check} chamado '{title_to_check}' "
+            f"é um título real e conhecido? Ele parece ser adequado para uma criança de {user_context_details['age']} anos interessada em '{user_context_details['interests_query']}' (mesmo que seja uma sugestão alternativa)? "
+            f"Além disso, há alguma menção de que esteja disponível em '{platform_to_check_mention}' {get_region_names(user_context_details['country_code'])[1]}? "
+            f"Responda sobre a existência (SIM/NÃO/INCERTO). Se SIM, comente brevemente sobre a adequação à idade/interesse e sobre a plataforma se houver dados claros. Responda em português do Brasil."
+        )
+        
+        # Keyed on the age band rather than the exact age: the verdict, not the wording, is what gets used.
+        verification_text = generate_gemini_text(prompt_for_verification, "existence_verification", [
+            media_type_to_check, rec_item['tmdb_id'], normalize_interests_query(user_context_details['interests_query']),
+            get_age_band(user_context_details['age']), bool(disclaimer_prefix_verifier), platform_to_check_mention,
+            user_context_details['country_code'],
+        ]).strip()
 
+        # print(f"  -> Resposta da verificação Gemini: '{verification_text}'") 
+
+        if "SIM" in verification_text.upper() or title_to_check.lower() in verification_text.lower():
+            if "NÃO SER IDEAL" in verification_text.upper() or "NÃO ADEQUADO" in verification_text.upper() or "NÃO RECOMENDADO PARA A IDADE" in verification_text.upper():
+                return False
+            rec_item['existence_verified_by_gemini'] = True
+            if platform_to_check_mention.lower() in verification_text.lower() or "ENCONTRADO EM" in verification_text.upper() or "DISPONÍVEL EM" in verification_text.upper():
+                rec_item['platform_mention_verified_by_gemini'] = True
+            return True
+        elif "INCERTO" in verification_text.upper():
+            rec_item['existence_verified_by_gemini'] = "INCERTO"
+            return True
+        return False
+    
+    except Exception as e:
+        print(f"🔴 Erro durante a verificação de existência com Gemini para '{title_to_check}': {e}") 
+        rec_item['existence_verified_by_gemini'] = "ERRO_NA_VERIFICACAO"
+        return True
+
+def finalize_verified_recommendations(verified_recommendations, recommendations_list):
+    # If Gemini rejected every title, fall back to the unverified TMDb list (flagged as such).
     if not verified_recommendations and recommendations_list: 
         print("⚠️  Nenhuma recomendação pôde ser verificada com confiança pelo Gemini, ou todas foram consideradas não existentes/adequadas. Verifique as recomendações originais do TMDb com cautela.") 
         for rec in recommendations_list:
@@ -524,6 +2161,139 @@ def agent_existence_verifier(recommendations_list, user_context_details, fallbac
     print("✅ Verificação de existência e relevância (com Gemini) completa.") 
     return verified_recommendations
 
+@traced("agent")
+def agent_existence_verifier(recommendations_list, user_context_details, fallback_mode_engaged): # Novo parâmetro
+    # Optional Agent: Verifies title existence and relevance.
+    print("\n--- 🤔 Agente Extra: Verificador de Existência e Relevância (Consultando Gemini com Pesquisa Google) ---")
+    if not is_gemini_available() or not recommendations_list:
+        if not is_gemini_available(): print("⚠️  Modelo Gemini não disponível. Pulando verificação de existência.")
+        return recommendations_list 
+
+    verified_recommendations = [
+        rec_item for rec_item in recommendations_list
+        if verify_single_recommendation(rec_item, user_context_details, fallback_mode_engaged)
+    ]
+    return finalize_verified_recommendations(verified_recommendations, recommendations_list)
+
+def parse_batched_gemini_verdicts(response_text):
+    # Parses the JSON array returned by the batched prompt into {tmdb_id: verdict dict}.
+    # Tolerates ```json fences and a wrapping object; returns {} when nothing usable is found.
+    cleaned_text = (response_text or "").strip()
+    if cleaned_text.startswith("```"):
+        cleaned_text = cleaned_text.strip("`")
+        if cleaned_text.lower().startswith("json"):
+            cleaned_text = cleaned_text[4:]
+    try:
+        parsed = json.loads(cleaned_text)
+    except ValueError:
+        return {}
+    if isinstance(parsed, dict):
+        parsed = next((value for value in parsed.values() if isinstance(value, list)), [])
+    verdicts = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            verdicts[int(entry.get('id'))] = entry
+        except (TypeError, ValueError):
+            continue
+    return verdicts
+
+def apply_batched_existence_verdict(rec_item, verdict):
+    # Same keep/drop rules as verify_single_recommendation, driven by the structured verdict.
+    # Returns None when the verdict is unusable (so the caller can verify this item on its own).
+    existence = str(verdict.get('existencia', '')).strip().upper()
+    if existence == "SIM":
+        if verdict.get('adequado') is False:
+            return False
+        rec_item['existence_verified_by_gemini'] = True
+        if verdict.get('plataforma_mencionada') is True:
+            rec_item['platform_mention_verified_by_gemini'] = True
+        return True
+    elif existence == "INCERTO":
+        rec_item['existence_verified_by_gemini'] = "INCERTO"
+        return True
+    elif existence in ("NÃO", "NAO"):
+        return False
+    return None
+
+@traced("agent")
+def agent_batched_justifier_and_verifier(fully_enriched_prospects, user_context_data, fallback_mode_engaged):
+    # Agent 5 + Extra Agent in a single Gemini round trip: selects the top titles, then asks for every
+    # justification and existence verdict at once as JSON. Items missing from (or malformed in) the
+    # response fall back to the per-title calls, so a bad parse never loses a recommendation.
+    print("\n--- ⭐ Agentes 5 + Extra: Seleção, Justificativa e Verificação em lote (uma chamada ao Gemini) ---") # User-facing: Portuguese
+    if not is_gemini_available():
+        recommendations = agent_recommendation_selector_and_justifier(fully_enriched_prospects, user_context_data, fallback_mode_engaged)
+        return agent_existence_verifier(recommendations, user_context_data, fallback_mode_engaged)
+    if not fully_enriched_prospects:
+        print("⚠️  Nenhum prospecto disponível para selecionar.")
+        return []
+    recommendations = select_top_recommendations(fully_enriched_prospects, user_context_data)
+    if not recommendations:
+        print("⚠️  Nenhuma recomendação encontrada que seja apropriada para a idade (baseado na lógica da POC) e disponível em suas plataformas.")
+        return []
+
+    titles_payload = []
+    for rec_item in recommendations:
+        rec_item['used_fallback_search'] = fallback_mode_engaged
+        titles_payload.append({
+            'id': rec_item['tmdb_id'], 'titulo': rec_item['title'], 'tipo': rec_item['media_type'],
+            'sinopse': rec_item['overview'], 'generos': rec_item['genres'],
+            'nota_tmdb': round(rec_item['tmdb_vote_average'], 1), 'votos': rec_item['tmdb_vote_count'],
+            'classificacao_indicativa': rec_item['age_certification_country'],
+            'plataformas': rec_item['available_on_user_platforms'],
+        })
+    disclaimer = ""
+    if fallback_mode_engaged:
+        disclaimer = (
+            f"Não encontramos um resultado perfeito para '{user_context_data['interests_query']}'; os títulos abaixo são alternativas "
+            f"baseadas em gêneros populares para {user_context_data['age']} anos. Deixe isso claro nas justificativas. "
+        )
+    in_region = get_region_names(user_context_data['country_code'])[1]
+    prompt_for_batch = (
+        f"{disclaimer}"
+        f"Um pai/mãe {in_region} procura algo para seu/sua filho(a) de {user_context_data['age']} anos, "
+        f"interessado(a) em '{user_context_data['interests_query']}'. Títulos selecionados (JSON):\n"
+        f"{json.dumps(titles_payload, ensure_ascii=False)}\n\n"
+        f"Para CADA título, com base em informações da Pesquisa Google:\n"
+        f"- escreva uma justificativa curta (2-3 frases), amigável e entusiasmada, em português do Brasil, explicando por que ele pode ser uma boa escolha hoje;\n"
+        f"- diga se é um título real e conhecido (SIM/NÃO/INCERTO);\n"
+        f"- diga se parece adequado para a idade e o interesse (true/false);\n"
+        f"- diga se há menção de que esteja disponível na primeira plataforma listada {in_region} (true/false).\n"
+        f"Responda SOMENTE com um array JSON, um objeto por título, no formato: "
+        f'[{{"id": 123, "justificativa": "...", "existencia": "SIM", "adequado": true, "plataforma_mencionada": false}}]'
+    )
+    print(f"🤖 Gerando justificativas e verificações com Gemini para {len(recommendations)} títulos em uma única chamada...") # User-facing: Portuguese
+    verdicts = {}
+    try:
+        response_text = generate_gemini_text(prompt_for_batch, "batched_justification_verification", [
+            normalize_interests_query(user_context_data['interests_query']), user_context_data['age'], bool(fallback_mode_engaged),
+            user_context_data['country_code'],
+            [(title['tipo'], title['id'], title['classificacao_indicativa'], title['plataformas']) for title in titles_payload],
+        ], generation_config={"response_mime_type": "application/json"})
+        verdicts = parse_batched_gemini_verdicts(response_text)
+        if not verdicts:
+            print("⚠️  Resposta em lote do Gemini não pôde ser interpretada. Usando chamadas individuais.") # User-facing: Portuguese
+    except Exception as e:
+        print(f"🔴 Erro na chamada em lote ao Gemini: {e}. Usando chamadas individuais.") # User-facing: Portuguese
+
+    verified_recommendations = []
+    for rec_item in recommendations:
+        verdict = verdicts.get(rec_item['tmdb_id'], {})
+        justification = verdict.get('justificativa')
+        if isinstance(justification, str) and justification.strip():
+            rec_item['gemini_justification'] = justification.strip()
+        else:
+            rec_item['gemini_justification'] = generate_recommendation_justification(rec_item, user_context_data, fallback_mode_engaged)
+        keep_item = apply_batched_existence_verdict(rec_item, verdict)
+        if keep_item is None:
+            keep_item = verify_single_recommendation(rec_item, user_context_data, fallback_mode_engaged)
+        if keep_item:
+            verified_recommendations.append(rec_item)
+    return finalize_verified_recommendations(verified_recommendations, recommendations)
+
+@traced("agent")
 def agent_console_display_final(final_recommendations_list, original_user_context, fallback_mode_overall_engaged): # Novo parâmetro
     # Agent 6: Displays the final, justified recommendations.
     print("\n--- 🎬 Agente 6: Exibição Final das Recomendações ---") 
@@ -533,7 +2303,7 @@ def agent_console_display_final(final_recommendations_list, original_user_contex
         return
 
     print(f"\n✨ Aqui estão algumas sugestões personalizadas para sua criança de {original_user_context['age']} anos, "
-          f"interessada em '{original_user_context['interests_query']}', no Brasil ({original_user_context['country_code']}): ✨") 
+          f"interessada em '{original_user_context['interests_query']}', {get_region_names(original_user_context['country_code'])[1]} ({original_user_context['country_code']}): ✨") 
     
     # Se o modo de fallback geral foi ativado E as recomendações atuais vieram desse modo, mostre um aviso geral
     # Para fazer isso de forma mais precisa, cada 'rec' teria que carregar sua própria flag 'used_fallback_search'
@@ -570,6 +2340,733 @@ def agent_console_display_final(final_recommendations_list, original_user_contex
     print("\n" + "="*50)
     print("Lembre-se de sempre usar seu próprio julgamento e verificar os avisos de conteúdo ao selecionar para sua criança. Aproveitem o filme/série! 🎉")
 
+# --- PIPELINE RUNNERS ---
+
+DEFAULT_INTERESTS_QUERY = "filmes infantis populares animação família"
+
+def build_user_context(raw_profile):
+    # Validates/cleans a profile coming from a file or an HTTP request into the dict
+    # agent_user_context_collector produces. Raises KeyError/TypeError/ValueError on invalid input.
+    age = int(raw_profile['age'])
+    if not 1 <= age <= 18:
+        raise ValueError("a idade deve estar entre 1 e 18")
+    platforms = raw_profile.get('preferred_platform_names') or []
+    if isinstance(platforms, str):
+        platforms = re.split(r"[,;|]", platforms)
+    interests_query = unicodedata.normalize('NFC', str(raw_profile.get('interests_query') or "").strip())
+    user_context = {
+        "age": age,
+        "interests_query": interests_query or DEFAULT_INTERESTS_QUERY,
+        "preferred_platform_names": [str(platform).strip().lower() for platform in platforms if str(platform).strip()],
+        "country_code": str(raw_profile.get('country_code') or TARGET_COUNTRY_CODE).strip().upper(),
+    }
+    if str(raw_profile.get('profile_id') or "").strip(): # Optional: keys the profile's seen/rejected titles (sessions)
+        user_context['profile_id'] = str(raw_profile['profile_id']).strip()
+    return user_context
+
+def normalize_interests_query(interests_query):
+    # NFC + casefold + collapsed whitespace, so equivalent interest queries share work.
+    return " ".join(unicodedata.normalize('NFC', interests_query or "").casefold().split())
+
+def get_candidate_pool_key(user_context):
+    # Everything the prospector + enrichment depend on: the interest, the Stage 4 age band and the country
+    # (plus the user's providers when the /discover stages are restricted to them).
+    pool_key = (normalize_interests_query(user_context['interests_query']), get_age_band(user_context['age']), user_context['country_code'])
+    if PROSPECTOR_RESTRICT_TO_USER_PROVIDERS:
+        provider_ids = map_user_platforms_to_provider_ids(user_context.get('preferred_platform_names', []), user_context['country_code'])
+        pool_key += (tuple(sorted(set(provider_ids.values()))),)
+    return pool_key
+
+@traced("pipeline")
+def build_candidate_pool(user_context, extra_regions=(), use_warm_pools=True):
+    # Agents 2-3: the enriched candidate pool for a user context. Unless PROSPECTOR_RESTRICT_TO_USER_PROVIDERS is on,
+    # it does not depend on the user's platforms (providers are carried per title), so it can be shared by every
+    # profile with the same pool key. With extra_regions, the pool can also be judged in those regions.
+    # A TMDb run budget that runs out mid-way degrades the pool to the Stage 4 fallback (enrich_age_band_fallback).
+    # A fresh warm pool for the same key (refresh_warm_pools) is returned as is, unless use_warm_pools=False.
+    if use_warm_pools and not extra_regions:
+        warm_pool = get_warm_pool_store().get(get_candidate_pool_key(user_context))
+        if warm_pool is not None:
+            print(f"\n♨️  Pool de candidatos pré-aquecido encontrado ({len(warm_pool['enriched_prospects'])} títulos): Agentes 2 e 3 não precisam consultar o TMDb.") # User-facing: Portuguese
+            return warm_pool
+    with run_budget():
+        initial_prospects, fallback_mode_was_engaged = agent_content_prospector(user_context) 
+        enriched_prospects = []
+        if initial_prospects:
+            enriched_prospects = agent_detailed_enrichment(initial_prospects, user_context['country_code'], extra_regions=extra_regions)
+        else:
+            print("\nNenhum filme ou série inicial encontrado com base na sua consulta. Os agentes subsequentes não serão executados.") 
+        if is_run_budget_exhausted("tmdb") and len(enriched_prospects) < len(initial_prospects) and not fallback_mode_was_engaged:
+            fallback_enriched = enrich_age_band_fallback(user_context, initial_prospects, extra_regions)
+            if fallback_enriched:
+                enriched_prospects += fallback_enriched
+                fallback_mode_was_engaged = True
+    return {'enriched_prospects': enriched_prospects, 'fallback_mode_was_engaged': fallback_mode_was_engaged}
+
+@traced("pipeline")
+def recommend_from_candidate_pool(candidate_pool, user_context):
+    # Agents 4-5 and the existence check for one user on top of a (possibly shared) candidate pool.
+    # Returns (final_recommendations, fallback_mode_was_engaged).
+    fallback_mode_was_engaged = candidate_pool['fallback_mode_was_engaged']
+    final_recommendations = [] 
+    if candidate_pool['enriched_prospects']:
+        with run_budget():
+            prospects_with_streaming = agent_streaming_availability_verifier(candidate_pool['enriched_prospects'], user_context)
+            final_recommendations = recommend_from_checked_candidates(prospects_with_streaming, user_context, fallback_mode_was_engaged)
+    return final_recommendations, fallback_mode_was_engaged
+
+def recommend_from_checked_candidates(prospects_with_streaming, user_context, fallback_mode_was_engaged):
+    # Agent 5 and the existence check on availability-checked candidates (within the caller's run budget, or a new one).
+    with run_budget():
+        if GEMINI_BATCHED_CALLS:
+            return agent_batched_justifier_and_verifier(prospects_with_streaming, user_context, fallback_mode_was_engaged)
+
+        # Passar o sinalizador para o seletor e justificador
+        selected_and_justified_recs = agent_recommendation_selector_and_justifier(
+            prospects_with_streaming, 
+            user_context, 
+            fallback_mode_was_engaged # Novo argumento
+        )
+        if not selected_and_justified_recs:
+            return []
+        # Passar o sinalizador para o verificador (opcional, mas pode ser útil)
+        return agent_existence_verifier(
+            selected_and_justified_recs, 
+            user_context,
+            fallback_mode_was_engaged # Novo argumento
+        ) 
+
+@traced("pipeline")
+def run_recommendation_pipeline(user_context):
+    # Runs Agents 2-5 and the existence check strictly one after another.
+    # Returns (final_recommendations, fallback_mode_was_engaged).
+    with run_budget():
+        return recommend_from_candidate_pool(build_candidate_pool(user_context), user_context)
+
+def parse_region_codes(raw_regions):
+    # "BR, pt;US" or ["BR", "pt"] -> ["BR", "PT", "US"] (deduplicated, order kept).
+    if isinstance(raw_regions, str):
+        raw_regions = re.split(r"[,;|\s]+", raw_regions)
+    return list(dict.fromkeys(str(region).strip().upper() for region in raw_regions or () if str(region).strip()))
+
+@traced("pipeline")
+def run_recommendation_pipeline_multi_region(user_context, regions):
+    # Agents 2-3 run once, prospecting in the first region. Each title's details payload carries every region's
+    # certifications and providers, so Agents 4-5 then run per region without fetching any title again.
+    # Returns {region: (final_recommendations, fallback_mode_was_engaged)}.
+    regions = parse_region_codes(regions) or [user_context['country_code']]
+    results_by_region = {}
+    with run_budget():
+        candidate_pool = build_candidate_pool({**user_context, 'country_code': regions[0]}, extra_regions=tuple(regions[1:]))
+        for region in regions:
+            print(f"\n--- 🌎 Recomendações para {get_region_names(region)[0]} ({region}) ---") # User-facing: Portuguese
+            results_by_region[region] = recommend_from_candidate_pool(candidate_pool, {**user_context, 'country_code': region})
+    return results_by_region
+
+def iter_checked_candidates(prospects, country_code, target_provider_ids, lookahead):
+    # Yields each prospect enriched and availability-checked, in prospect order, keeping at most `lookahead`
+    # of them in flight. Closing the generator cancels whatever hasn't started yet.
+    def enrich_and_check(prospect):
+        enriched_item = enrich_single_prospect(prospect, country_code)
+        return check_streaming_for_item(enriched_item, country_code, target_provider_ids) if enriched_item else None
+
+    prospect_iterator = iter(prospects)
+    if lookahead <= 1:
+        for prospect in prospect_iterator:
+            checked_item = enrich_and_check(prospect)
+            if checked_item is not None:
+                yield checked_item
+        return
+    executor = ThreadPoolExecutor(max_workers=lookahead)
+    pending = deque()
+    try:
+        for prospect in prospect_iterator:
+            pending.append(submit_with_context(executor, enrich_and_check, prospect))
+            if len(pending) >= lookahead:
+                break
+        while pending:
+            checked_item = pending.popleft().result()
+            next_prospect = next(prospect_iterator, None)
+            if next_prospect is not None:
+                pending.append(submit_with_context(executor, enrich_and_check, next_prospect))
+            if checked_item is not None:
+                yield checked_item
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+@traced("pipeline")
+@run_budget()
+def run_recommendation_pipeline_lazy(user_context, top_n=3, lookahead=None):
+    # Same result as run_recommendation_pipeline, but candidates flow one at a time (in the prospector's
+    # popularity order) through enrichment, availability and the age filter, and fetching stops at the
+    # top_n-th suitable title. Selection is "top_n most popular suitable titles" and enrichment never changes
+    # popularity, so no later candidate could displace those: the eager top_n is already final.
+    # lookahead (defaults to LAZY_PIPELINE_LOOKAHEAD) bounds how many candidates are fetched ahead.
+    initial_prospects, fallback_mode_was_engaged = agent_content_prospector(user_context)
+    if not initial_prospects:
+        print("\nNenhum filme ou série inicial encontrado com base na sua consulta. Os agentes subsequentes não serão executados.")
+        return [], fallback_mode_was_engaged
+
+    print("\n--- ⚡ Agentes 3 e 4 sob demanda: enriquecendo candidatos até a seleção estar definida ---") # User-facing: Portuguese
+    country_code = user_context['country_code']
+    target_provider_ids_map = map_user_platforms_to_provider_ids(user_context['preferred_platform_names'], country_code)
+    if not target_provider_ids_map:
+        print(f"⚠️  Não foi possível mapear nenhuma das suas plataformas preferidas ({', '.join(user_context['preferred_platform_names'])}) para IDs conhecidos do TMDb. Não é possível verificar o streaming com precisão.") # User-facing: Portuguese
+    suitable_candidates = []
+    checked_count = 0
+    checked_candidates = iter_checked_candidates(initial_prospects, country_code, set(target_provider_ids_map.values()), lookahead or LAZY_PIPELINE_LOOKAHEAD)
+    try:
+        for checked_item in checked_candidates:
+            checked_count += 1
+            if is_suitable_and_available(checked_item, user_context):
+                suitable_candidates.append(checked_item)
+                if len(suitable_candidates) >= top_n:
+                    break
+    finally:
+        checked_candidates.close()
+    print(f"✅ {checked_count} de {len(initial_prospects)} candidatos verificados; {len(suitable_candidates)} adequados e disponíveis.") # User-facing: Portuguese
+    if len(suitable_candidates) < top_n and is_run_budget_exhausted("tmdb") and not fallback_mode_was_engaged:
+        fallback_enriched = enrich_age_band_fallback(user_context, initial_prospects)
+        fallback_suitable = [item for item in agent_streaming_availability_verifier(fallback_enriched, user_context)
+                             if is_suitable_and_available(item, user_context)]
+        if fallback_suitable:
+            suitable_candidates += fallback_suitable
+            fallback_mode_was_engaged = True
+    if not suitable_candidates:
+        print("⚠️  Nenhuma recomendação encontrada que seja apropriada para a idade (baseado na lógica da POC) e disponível em suas plataformas.")
+        return [], fallback_mode_was_engaged
+    return recommend_from_checked_candidates(suitable_candidates, user_context, fallback_mode_was_engaged), fallback_mode_was_engaged
+
+RECOMMENDATION_OUTPUT_FIELDS = (
+    'tmdb_id', 'title', 'media_type', 'overview', 'popularity', 'genres', 'tmdb_vote_average', 'tmdb_vote_count',
+    'age_certification_country', 'available_on_user_platforms', 'gemini_justification', 'used_fallback_search',
+    'existence_verified_by_gemini', 'platform_mention_verified_by_gemini',
+)
+
+def recommendation_to_output(rec_item):
+    # JSON-friendly subset of a final recommendation (drops bulky internals such as watch_providers).
+    return {field: rec_item[field] for field in RECOMMENDATION_OUTPUT_FIELDS if field in rec_item}
+
+async def run_recommendation_pipeline_async(user_context, top_n=3):
+    with run_budget(): # One budget for the whole run; asyncio.to_thread carries it into the worker threads
+        return await run_overlapped_stages(user_context, top_n)
+
+async def run_overlapped_stages(user_context, top_n):
+    # Same result as run_recommendation_pipeline, but the stages overlap:
+    # - each prospect is enriched as soon as the prospector finds it (first /search/multi page onwards), as long as
+    #   it is still among the 30 most popular found so far; one pushed out of them is cancelled (it can't come back),
+    # - its availability is checked as soon as its details arrive,
+    # - once prospecting is done, Gemini justifications start as soon as the final top_n is known (the top_n most
+    #   popular suitable titles, confirmed in popularity order) while less popular candidates are still checked.
+    # The final pool is still the prospector's top-30 by popularity, so selection, TMDb calls and Gemini calls
+    # match the sequential mode (plus any candidate already in flight when it got pushed out of the top 30).
+    # The blocking TMDb/Gemini calls run in worker threads and still go through the global TMDb in-flight cap.
+    print("\n--- ⚡ Pipeline assíncrono: etapas sobrepostas (Agentes 2 a 5) ---") # User-facing: Portuguese
+    loop = asyncio.get_running_loop()
+    country_code = user_context['country_code']
+    target_provider_ids_map = map_user_platforms_to_provider_ids(user_context['preferred_platform_names'], country_code)
+    if not target_provider_ids_map:
+        print(f"⚠️  Não foi possível mapear nenhuma das suas plataformas preferidas ({', '.join(user_context['preferred_platform_names'])}) para IDs conhecidos do TMDb. Não é possível verificar o streaming com precisão.") # User-facing: Portuguese
+    target_provider_ids = set(target_provider_ids_map.values())
+
+    prospect_pool_size = 30 # The prospector keeps its 30 most popular prospects
+    prospect_tasks = {} # tmdb_id -> task resolving to the enriched + availability-checked item (or None)
+    found_prospects = [] # Every prospect reported so far, in discovery order
+    early_justifications = {} # tmdb_id -> justification task for a title already known to be in the final top_n
+
+    async def process_prospect(prospect):
+        enriched_item = await asyncio.to_thread(enrich_single_prospect, prospect, country_code)
+        if enriched_item is None:
+            return None
+        return await asyncio.to_thread(check_streaming_for_item, enriched_item, country_code, target_provider_ids)
+
+    def schedule_prospect(prospect):
+        if any(found_prospect['tmdb_id'] == prospect['tmdb_id'] for found_prospect in found_prospects):
+            return
+        found_prospects.append(prospect)
+        # Same stable popularity order as the prospector's final sort (ties keep discovery order). A prospect outside
+        # the current top 30 never gets back in: later ones can only add more prospects ahead of it.
+        top_ids = {found_prospect['tmdb_id'] for found_prospect in sorted(found_prospects, key=lambda x: x['popularity'], reverse=True)[:prospect_pool_size]}
+        for tmdb_id in [tmdb_id for tmdb_id in prospect_tasks if tmdb_id not in top_ids]:
+            prospect_tasks.pop(tmdb_id).cancel()
+        if prospect['tmdb_id'] in top_ids:
+            prospect_tasks[prospect['tmdb_id']] = asyncio.create_task(process_prospect(prospect))
+
+    def on_prospect_found(prospect): # Called from the prospector's worker thread
+        loop.call_soon_threadsafe(schedule_prospect, prospect)
+
+    initial_prospects, fallback_mode_was_engaged = await asyncio.to_thread(agent_content_prospector, user_context, on_prospect_found)
+    for prospect in initial_prospects: # Normally a no-op: each found-callback ran before the prospector's result was delivered
+        task = prospect_tasks.get(prospect['tmdb_id'])
+        if task is None or task.cancelled():
+            prospect_tasks[prospect['tmdb_id']] = asyncio.create_task(process_prospect(prospect))
+
+    if not initial_prospects:
+        print("\nNenhum filme ou série inicial encontrado com base na sua consulta. Os agentes subsequentes não serão executados.") 
+        return [], fallback_mode_was_engaged
+
+    # Justifications may start before every candidate is checked only when the selection can no longer change:
+    # no TMDb run budget (whose exhaustion would add fallback titles and the fallback disclaimer) and no batched call.
+    current_budget = _current_run_budget.get()
+    justify_early = is_gemini_available() and not GEMINI_BATCHED_CALLS and not (current_budget and current_budget.max_tmdb_calls)
+    processed_items = []
+    suitable_so_far = []
+    for prospect in initial_prospects: # Popularity order: the first top_n suitable titles are the final selection
+        item_with_streaming = await prospect_tasks[prospect['tmdb_id']]
+        processed_items.append(item_with_streaming)
+        if justify_early and len(suitable_so_far) < top_n and item_with_streaming is not None and is_suitable_and_available(item_with_streaming, user_context):
+            suitable_so_far.append(item_with_streaming)
+            if len(suitable_so_far) == top_n:
+                for rec_item in suitable_so_far:
+                    early_justifications[rec_item['tmdb_id']] = asyncio.create_task(
+                        asyncio.to_thread(generate_recommendation_justification, rec_item, user_context, fallback_mode_was_engaged)
+                    )
+    prospects_with_streaming = [item for item in processed_items if item is not None]
+    if is_run_budget_exhausted("tmdb") and len(prospects_with_streaming) < len(initial_prospects) and not fallback_mode_was_engaged:
+        fallback_enriched = await asyncio.to_thread(enrich_age_band_fallback, user_context, initial_prospects)
+        if fallback_enriched:
+            prospects_with_streaming += await asyncio.to_thread(agent_streaming_availability_verifier, fallback_enriched, user_context)
+            fallback_mode_was_engaged = True
+
+    if GEMINI_BATCHED_CALLS:
+        final_recommendations = await asyncio.to_thread(agent_batched_justifier_and_verifier, prospects_with_streaming, user_context, fallback_mode_was_engaged)
+        return final_recommendations, fallback_mode_was_engaged
+
+    print("\n--- ⭐ Agente 5: Seletor de Recomendações e Justificador ---") 
+    recommendations = select_top_recommendations(prospects_with_streaming, user_context, top_n)
+    if not recommendations:
+        print("⚠️  Nenhuma recomendação encontrada que seja apropriada para a idade (baseado na lógica da POC) e disponível em suas plataformas.")
+        return [], fallback_mode_was_engaged
+
+    justification_tasks = []
+    for rec_item in recommendations:
+        rec_item['used_fallback_search'] = fallback_mode_was_engaged
+        early_task = early_justifications.get(rec_item['tmdb_id'])
+        if not is_gemini_available():
+            justification_tasks.append(asyncio.sleep(0, result="Justificativa não disponível (API do Gemini não configurada)."))
+        elif early_task:
+            justification_tasks.append(early_task)
+        else:
+            justification_tasks.append(asyncio.to_thread(generate_recommendation_justification, rec_item, user_context, fallback_mode_was_engaged))
+    if not is_gemini_available():
+        print("⚠️  Modelo Gemini não disponível. Pulando justificativas.") 
+    for rec_item, justification in zip(recommendations, await asyncio.gather(*justification_tasks)):
+        rec_item['gemini_justification'] = justification
+    print("✅ Recomendações selecionadas e tentativas de justificativas completas.") 
+
+    final_recommendations = await asyncio.to_thread(agent_existence_verifier, recommendations, user_context, fallback_mode_was_engaged)
+    return final_recommendations, fallback_mode_was_engaged
+
+def agent_console_follow_ups(session, shown_recommendations):
+    # CLI follow-ups over the session's candidate pool: "mais" shows 3 more, "não N" swaps suggestion N.
+    while True:
+        command = input("\n➡️  Digite 'mais' para outras 3 sugestões, 'não N' para trocar a sugestão N, ou Enter para sair: ").strip().casefold() # User-facing: Portuguese
+        if not command:
+            return
+        if command == "mais":
+            shown_recommendations = session.next_recommendations()
+            if not shown_recommendations:
+                print("ℹ️  Não há mais sugestões adequadas entre os títulos encontrados. Tente outro interesse.") # User-facing: Portuguese
+                return
+        else:
+            reject_match = re.fullmatch(r"n[ãa]o\s+(\d+)", command)
+            if not reject_match or not 1 <= int(reject_match.group(1)) <= len(shown_recommendations):
+                print("⚠️  Comando não reconhecido.") # User-facing: Portuguese
+                continue
+            rejected_index = int(reject_match.group(1)) - 1
+            rejected_item = shown_recommendations[rejected_index]
+            replacement = session.reject(rejected_item['tmdb_id'], rejected_item['media_type'])
+            shown_recommendations = shown_recommendations[:rejected_index] + replacement + shown_recommendations[rejected_index + 1:]
+        agent_console_display_final(shown_recommendations, session.user_context, session.fallback_mode_was_engaged)
+
+# --- WARM CANDIDATE POOLS ---
+# Stage 4's /discover pages only depend on the age band and the region, and a few interest queries make up most
+# of the traffic. refresh_warm_pools (warm_pools.py from cron, or a service.py thread) builds those candidate pools
+# ahead of time, in the background lane, and keeps them ready to rank: build_candidate_pool serves a query's warm
+# pool without any TMDb call, and service.py answers a cold query from its age-band pool while the query's own
+# pool is built in the background. Agent 4 still runs per request, on the providers each pooled title carries.
+
+WARM_POOL_AGE_BAND_AGES = {"ate_7": 5, "8_a_12": 10, "13_mais": 15} # One age per Stage 4 age band
+
+_interest_query_log_lock = threading.Lock()
+
+def record_interest_query(user_context):
+    # Appends what the request's candidate pool depends on to INTEREST_QUERY_LOG_PATH (no profile_id). Never raises.
+    if not INTEREST_QUERY_LOG_PATH:
+        return
+    log_line = json.dumps({
+        'at': round(time.time(), 1), 'interests_query': user_context['interests_query'], 'age': user_context['age'],
+        'country_code': user_context['country_code'], 'preferred_platform_names': user_context.get('preferred_platform_names', []),
+    }, ensure_ascii=False)
+    with _interest_query_log_lock:
+        try:
+            with open(INTEREST_QUERY_LOG_PATH, 'a', encoding='utf-8') as log_file:
+                log_file.write(log_line + "\n")
+        except OSError:
+            pass
+
+def read_top_interest_contexts(top_n, window_days, log_path=None):
+    # The top_n most frequent candidate-pool keys logged in the last window_days, one user context each,
+    # most frequent first. Malformed lines are skipped.
+    log_path = INTEREST_QUERY_LOG_PATH if log_path is None else log_path
+    if not log_path or not os.path.exists(log_path):
+        return []
+    logged_since = time.time() - window_days * 86400
+    pool_key_counts = Counter()
+    user_context_by_pool_key = {}
+    with open(log_path, encoding='utf-8') as log_file:
+        for log_line in log_file:
+            try:
+                entry = json.loads(log_line)
+                if entry.get('at', 0) < logged_since:
+                    continue
+                user_context = build_user_context(entry)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue
+            pool_key = get_candidate_pool_key(user_context)
+            pool_key_counts[pool_key] += 1
+            user_context_by_pool_key.setdefault(pool_key, user_context)
+    return [user_context_by_pool_key[pool_key] for pool_key, _ in pool_key_counts.most_common(top_n)]
+
+def get_fallback_pool_key(user_context):
+    # The age-band pool a query falls back to: its candidate-pool key without the interest.
+    return (None,) + get_candidate_pool_key(user_context)[1:]
+
+def build_age_band_fallback_pool(user_context):
+    # Agents 2-3 for the Stage 4 genre fallback alone (the interest query is not used).
+    fallback_prospects, fallback_mode_was_engaged = agent_content_prospector(user_context, fallback_only=True)
+    return {'enriched_prospects': agent_detailed_enrichment(fallback_prospects, user_context['country_code']),
+            'fallback_mode_was_engaged': fallback_mode_was_engaged}
+
+class WarmPoolStore:
+    # pool key (get_candidate_pool_key / get_fallback_pool_key) -> (candidate pool, built_at). Pools older than
+    # WARM_POOL_TTL_SECONDS are not served. Saved as one gzipped pickle, written and read only by this application.
+    def __init__(self, pools=None):
+        self._pools = dict(pools or {})
+        self._lock = threading.Lock()
+
+    def get(self, pool_key):
+        with self._lock:
+            candidate_pool, built_at = self._pools.get(pool_key, (None, 0))
+        if candidate_pool is None or time.time() - built_at > WARM_POOL_TTL_SECONDS:
+            return None
+        return candidate_pool
+
+    def put(self, pool_key, candidate_pool, built_at=None):
+        with self._lock:
+            self._pools[pool_key] = (candidate_pool, time.time() if built_at is None else built_at)
+
+    def items(self):
+        # [(pool key, (candidate pool, built_at))], expired ones included.
+        with self._lock:
+            return list(self._pools.items())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pools)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as pools_file:
+            payload = pickle.load(pools_file)
+        return cls(payload['pools'])
+
+    def save(self, path):
+        # Written beside the target and renamed over it, so a process loading the file never reads half of it.
+        temporary_path = f"{path}.tmp"
+        with gzip.open(temporary_path, 'wb') as pools_file:
+            pickle.dump({'version': 1, 'pools': dict(self.items())}, pools_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+def refresh_warm_pools(regions, top_queries=None, window_days=None, path=None):
+    # Rebuilds the warm pools for the given regions: the age-band fallback pools (also one per provider set of the
+    # logged queries when PROSPECTOR_RESTRICT_TO_USER_PROVIDERS is on) and the pools of the top_queries most
+    # frequent logged queries (WARM_POOLS_TOP_QUERIES over WARM_POOLS_LOG_WINDOW_DAYS by default). Calls queue in
+    # the background lane, with no run budget (a degraded pool would be served for hours), and empty pools are
+    # left out. Fresh pools of the current store that weren't rebuilt (e.g. refined by service.py) are kept.
+    # Saves to path and swaps the store in for this process. Meant for cron/warm_pools.py or a service thread.
+    global _warm_pool_store, _warm_pool_store_loaded
+    regions = [region.upper() for region in regions]
+    top_queries = WARM_POOLS_TOP_QUERIES if top_queries is None else top_queries
+    window_days = WARM_POOLS_LOG_WINDOW_DAYS if window_days is None else window_days
+    logged_contexts = [user_context for user_context in read_top_interest_contexts(top_queries, window_days) if user_context['country_code'] in regions]
+    fallback_contexts = {}
+    for region in regions:
+        platform_name_sets = [[]]
+        if PROSPECTOR_RESTRICT_TO_USER_PROVIDERS:
+            platform_name_sets += [user_context['preferred_platform_names'] for user_context in logged_contexts if user_context['country_code'] == region]
+        for age in WARM_POOL_AGE_BAND_AGES.values():
+            for platform_names in platform_name_sets:
+                user_context = {'age': age, 'interests_query': DEFAULT_INTERESTS_QUERY, 'preferred_platform_names': platform_names, 'country_code': region}
+                fallback_contexts.setdefault(get_fallback_pool_key(user_context), user_context)
+
+    warm_pool_store = WarmPoolStore()
+    with upstream_lane(UPSTREAM_LANE_BACKGROUND):
+        for pool_key, user_context in fallback_contexts.items():
+            with run_budget(max_tmdb_calls=0, max_gemini_tokens=0):
+                candidate_pool = build_age_band_fallback_pool(user_context)
+            if candidate_pool['enriched_prospects']:
+                warm_pool_store.put(pool_key, candidate_pool)
+        for user_context in logged_contexts:
+            with run_budget(max_tmdb_calls=0, max_gemini_tokens=0):
+                candidate_pool = build_candidate_pool(user_context, use_warm_pools=False)
+            if candidate_pool['enriched_prospects']:
+                warm_pool_store.put(get_candidate_pool_key(user_context), candidate_pool)
+    rebuilt_pool_keys = {pool_key for pool_key, _ in warm_pool_store.items()}
+    for pool_key, (candidate_pool, built_at) in get_warm_pool_store().items():
+        if pool_key not in rebuilt_pool_keys and time.time() - built_at <= WARM_POOL_TTL_SECONDS:
+            warm_pool_store.put(pool_key, candidate_pool, built_at)
+    if path:
+        warm_pool_store.save(path)
+    with _warm_pool_store_lock:
+        _warm_pool_store = warm_pool_store
+        _warm_pool_store_loaded = True
+    return warm_pool_store
+
+_warm_pool_store = None
+_warm_pool_store_loaded = False
+_warm_pool_store_lock = threading.Lock()
+
+def get_warm_pool_store():
+    # Loads the warm pools once per process (or returns the last refreshed ones). Empty if there is no file.
+    global _warm_pool_store, _warm_pool_store_loaded
+    if not _warm_pool_store_loaded:
+        with _warm_pool_store_lock:
+            if not _warm_pool_store_loaded:
+                _warm_pool_store = WarmPoolStore()
+                if WARM_POOLS_PATH and os.path.exists(WARM_POOLS_PATH):
+                    try:
+                        _warm_pool_store = WarmPoolStore.load(WARM_POOLS_PATH)
+                    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError) as e:
+                        print(f"⚠️  Não foi possível carregar os pools pré-aquecidos '{WARM_POOLS_PATH}': {e}.") # User-facing: Portuguese
+                _warm_pool_store_loaded = True
+    return _warm_pool_store
+
+# --- RECOMMENDATION SESSIONS ---
+# A session keeps one user's availability-checked candidate pool (the output of Agents 2-4), so "3 more" and
+# "not this one" re-rank that pool instead of searching again: follow-ups make no TMDb call, only Agent 5 runs
+# (its Gemini answers go through the Gemini cache). With a profile_id, titles shown to or rejected by the profile
+# are persisted and later sessions of the same profile skip them too. Without one nothing outlives the session,
+# so its first page is exactly what run_recommendation_pipeline returns.
+
+def get_profile_key(user_context):
+    # Key of the profile's seen/rejected history, or None for anonymous users (they keep no history).
+    if user_context.get('profile_id'):
+        return f"id:{user_context['profile_id']}"
+    return None
+
+def get_title_key(item):
+    return (item['media_type'], item['tmdb_id'])
+
+class RecommendationSessionStore:
+    # Sessions (pickled, expiring after SESSION_TTL_SECONDS) and per-profile feedback
+    # ((profile_key, media_type, tmdb_id) -> 'seen' | 'rejected') in one SQLite file. The most recently used
+    # sessions also stay in memory. Without a file (or if it can't be used), both only last for the process.
+    def __init__(self, db_path, max_in_memory):
+        self.max_in_memory = max_in_memory
+        self._live_sessions = OrderedDict() # session_id -> (session, expires_at), least recently used first
+        self._memory_feedback = {} # profile_key -> {title_key: (status, updated_at)}, used when there is no file
+        self._lock = threading.Lock()
+        self._connection = None
+        if db_path:
+            try:
+                self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, payload BLOB, expires_at REAL)")
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS profile_feedback (profile_key TEXT, media_type TEXT, tmdb_id INTEGER, status TEXT, "
+                    "updated_at REAL, PRIMARY KEY (profile_key, media_type, tmdb_id))"
+                )
+                self._connection.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️  Não foi possível abrir o arquivo de sessões '{db_path}': {e}. Sessões ficarão só em memória.") # User-facing: Portuguese
+                self._connection = None
+
+    def get_profile_feedback(self, profile_key):
+        # {title_key: 'seen' | 'rejected'} still in effect for the profile (seen titles expire after PROFILE_SEEN_TTL_DAYS).
+        seen_since = time.time() - PROFILE_SEEN_TTL_DAYS * 86400
+        with self._lock:
+            if self._connection is None:
+                return {key: status for key, (status, updated_at) in self._memory_feedback.get(profile_key, {}).items()
+                        if status == "rejected" or updated_at >= seen_since}
+            try:
+                rows = self._connection.execute(
+                    "SELECT media_type, tmdb_id, status FROM profile_feedback WHERE profile_key = ? AND (status = 'rejected' OR updated_at >= ?)",
+                    (profile_key, seen_since)
+                ).fetchall()
+            except sqlite3.Error:
+                return {}
+        return {(media_type, tmdb_id): status for media_type, tmdb_id, status in rows}
+
+    def mark_titles(self, profile_key, title_keys, status):
+        # Records titles as 'seen' or 'rejected'. A rejection is never downgraded back to 'seen'.
+        now = time.time()
+        with self._lock:
+            if self._connection is None:
+                profile_feedback = self._memory_feedback.setdefault(profile_key, {})
+                for title_key in title_keys:
+                    if profile_feedback.get(title_key, ("",))[0] != "rejected":
+                        profile_feedback[title_key] = (status, now)
+                return
+            try:
+                self._connection.executemany(
+                    "INSERT INTO profile_feedback (profile_key, media_type, tmdb_id, status, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (profile_key, media_type, tmdb_id) DO UPDATE SET updated_at = excluded.updated_at, "
+                    "status = CASE WHEN profile_feedback.status = 'rejected' THEN 'rejected' ELSE excluded.status END",
+                    [(profile_key, media_type, tmdb_id, status, now) for media_type, tmdb_id in title_keys]
+                )
+                self._connection.commit()
+            except sqlite3.Error:
+                pass
+
+    def save_session(self, session):
+        expires_at = time.time() + SESSION_TTL_SECONDS
+        with self._lock:
+            self._remember(session, expires_at)
+            if self._connection is None:
+                return
+            try:
+                # Written and read back only by this application, so unpickling it is as safe as the file itself.
+                self._connection.execute("INSERT OR REPLACE INTO sessions (session_id, payload, expires_at) VALUES (?, ?, ?)",
+                                         (session.session_id, zlib.compress(pickle.dumps(session)), expires_at))
+                self._connection.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+                self._connection.commit()
+            except (sqlite3.Error, pickle.PicklingError):
+                pass
+
+    def load_session(self, session_id):
+        # The live session, or None when it is unknown or has expired.
+        now = time.time()
+        with self._lock:
+            session, expires_at = self._live_sessions.get(session_id, (None, 0))
+            if session is not None and expires_at >= now:
+                self._live_sessions.move_to_end(session_id)
+                return session
+            if self._connection is None:
+                return None
+            try:
+                row = self._connection.execute("SELECT payload, expires_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                if row is None or row[1] < now:
+                    return None
+                session = pickle.loads(zlib.decompress(row[0]))
+            except (sqlite3.Error, zlib.error, pickle.UnpicklingError, EOFError, AttributeError):
+                return None
+            self._remember(session, row[1])
+        return session
+
+    def _remember(self, session, expires_at):
+        self._live_sessions[session.session_id] = (session, expires_at)
+        self._live_sessions.move_to_end(session.session_id)
+        while len(self._live_sessions) > self.max_in_memory:
+            self._live_sessions.popitem(last=False)
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = RecommendationSessionStore(SESSION_STORE_PATH, SESSION_MAX_IN_MEMORY)
+    return _session_store
+
+class RecommendationSession:
+    # One user's follow-ups over a fixed, availability-checked candidate pool.
+    def __init__(self, session_id, user_context, checked_candidates, fallback_mode_was_engaged, profile_feedback):
+        self.session_id = session_id
+        self.user_context = user_context
+        self.checked_candidates = checked_candidates
+        self.fallback_mode_was_engaged = fallback_mode_was_engaged
+        self.profile_key = get_profile_key(user_context)
+        self.excluded_keys = set(profile_feedback) # Shown, rejected or dropped by the verifier (plus a profile_id's history)
+        self.rejected_genre_counts = {} # genre -> titles with it rejected in this session
+        self.pages_served = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def rank_remaining(self, top_n):
+        # Unseen, suitable candidates by popularity, demoted for every genre shared with a title rejected in the session.
+        # Without rejections this is the same order select_top_recommendations uses.
+        remaining = [item for item in self.checked_candidates
+                     if get_title_key(item) not in self.excluded_keys and is_suitable_and_available(item, self.user_context)]
+        def feedback_score(item):
+            shared_genres = sum(self.rejected_genre_counts.get(genre, 0) for genre in item.get('genres') or ())
+            return item.get('popularity', 0.0) * SESSION_REJECTED_GENRE_WEIGHT ** shared_genres
+        return sorted(remaining, key=feedback_score, reverse=True)[:top_n]
+
+    def next_recommendations(self, top_n=3):
+        # "3 more": the next top_n titles, justified and verified (Agent 5). No TMDb call.
+        with self._lock:
+            page_candidates = self.rank_remaining(top_n)
+            recommendations = []
+            if page_candidates:
+                recommendations = recommend_from_checked_candidates(page_candidates, self.user_context, self.fallback_mode_was_engaged)
+            self.excluded_keys.update(get_title_key(item) for item in page_candidates) # Titles the verifier dropped aren't retried either
+            self.pages_served += 1
+        session_store = get_session_store()
+        if self.profile_key:
+            session_store.mark_titles(self.profile_key, [get_title_key(rec) for rec in recommendations], "seen")
+        session_store.save_session(self)
+        return recommendations
+
+    def reject(self, tmdb_id, media_type=None, replacement_count=1):
+        # "Not this one": the rejection is remembered for the profile, similar titles are demoted in this session,
+        # and replacement_count new titles are returned in its place.
+        with self._lock:
+            rejected_items = [item for item in self.checked_candidates
+                              if item['tmdb_id'] == tmdb_id and (media_type is None or item['media_type'] == media_type)]
+            rejected_keys = {get_title_key(item) for item in rejected_items} or ({(media_type, tmdb_id)} if media_type else set())
+            for item in rejected_items:
+                for genre in item.get('genres') or ():
+                    self.rejected_genre_counts[genre] = self.rejected_genre_counts.get(genre, 0) + 1
+            self.excluded_keys.update(rejected_keys)
+        if self.profile_key:
+            get_session_store().mark_titles(self.profile_key, rejected_keys, "rejected")
+        return self.next_recommendations(replacement_count) if replacement_count > 0 else []
+
+@traced("pipeline")
+@run_budget()
+def start_recommendation_session(user_context, candidate_pool=None, top_n=3):
+    # Agents 2-4 once (on a shared candidate pool when given), then the first page.
+    # Returns (session, recommendations); follow-ups go through session.next_recommendations / session.reject.
+    if candidate_pool is None:
+        candidate_pool = build_candidate_pool(user_context)
+    checked_candidates = []
+    if candidate_pool['enriched_prospects']:
+        checked_candidates = agent_streaming_availability_verifier(candidate_pool['enriched_prospects'], user_context)
+    profile_key = get_profile_key(user_context)
+    profile_feedback = get_session_store().get_profile_feedback(profile_key) if profile_key else {}
+    session = RecommendationSession(uuid.uuid4().hex, user_context, checked_candidates, candidate_pool['fallback_mode_was_engaged'], profile_feedback)
+    return session, session.next_recommendations(top_n)
+
+def get_recommendation_session(session_id):
+    return get_session_store().load_session(session_id)
+
+def run_cli_recommendations(user_context):
+    # The CLI run for the configured regions and PIPELINE_MODE.
+    # Returns ({region: (final_recommendations, fallback_mode_was_engaged)}, session for follow-ups or None).
+    if len(RECOMMENDATION_REGIONS) > 1:
+        return run_recommendation_pipeline_multi_region(user_context, RECOMMENDATION_REGIONS), None
+    if PIPELINE_MODE == "async":
+        with trace_span("run_recommendation_pipeline_async", "pipeline"):
+            return {user_context['country_code']: asyncio.run(run_recommendation_pipeline_async(user_context))}, None
+    if PIPELINE_MODE == "lazy":
+        return {user_context['country_code']: run_recommendation_pipeline_lazy(user_context)}, None
+    # Sequential: the checked candidate pool stays in a session, so follow-ups don't search again
+    recommendation_session, first_recommendations = start_recommendation_session(user_context)
+    return {user_context['country_code']: (first_recommendations, recommendation_session.fallback_mode_was_engaged)}, recommendation_session
+
 # --- MAIN EXECUTION BLOCK ---
 if __name__ == "__main__":
     print("🎬 Bem-vindo à POC do Selecionador de Filmes (Backend Python)! 🎬") 
@@ -577,37 +3074,30 @@ if __name__ == "__main__":
         print("\n🔴 CRÍTICO: TMDB_API_KEY está ausente. Esta aplicação depende fortemente do TMDb. Por favor, defina-a no seu arquivo .env e reinicie.") 
     else:
         user_context = agent_user_context_collector()
-        # Atualizado para receber dois valores:
-        initial_prospects, fallback_mode_was_engaged = agent_content_prospector(user_context) 
-        
-        final_recommendations = [] 
-        if initial_prospects:
-            enriched_prospects = agent_detailed_enrichment(initial_prospects, user_context['country_code'])
-            prospects_with_streaming = agent_streaming_availability_verifier(enriched_prospects, user_context)
-            
-            # Passar o sinalizador para o seletor e justificador
-            selected_and_justified_recs = agent_recommendation_selector_and_justifier(
-                prospects_with_streaming, 
-                user_context, 
-                fallback_mode_was_engaged # Novo argumento
-            )
-            
-            if selected_and_justified_recs:
-                # Passar o sinalizador para o verificador (opcional, mas pode ser útil)
-                final_recommendations = agent_existence_verifier(
-                    selected_and_justified_recs, 
-                    user_context,
+        record_interest_query(user_context)
+        with trace_run() as tracer:
+            results_by_region, recommendation_session = run_cli_recommendations(user_context)
+                
+            for region, (final_recommendations, fallback_mode_was_engaged) in results_by_region.items():
+                # Passar o sinalizador para a exibição final
+                agent_console_display_final(
+                    final_recommendations, 
+                    {**user_context, 'country_code': region}, 
                     fallback_mode_was_engaged # Novo argumento
-                ) 
-            
-        else:
-            print("\nNenhum filme ou série inicial encontrado com base na sua consulta. Os agentes subsequentes não serão executados.") 
-            
-        # Passar o sinalizador para a exibição final
-        agent_console_display_final(
-            final_recommendations, 
-            user_context, 
-            fallback_mode_was_engaged # Novo argumento
-        )
+                )
+            if recommendation_session is not None and final_recommendations:
+                agent_console_follow_ups(recommendation_session, final_recommendations)
+
+        cache_stats = get_tmdb_cache_stats()
+        if cache_stats['hits'] or cache_stats['misses']:
+            print(f"\nℹ️  Cache do TMDb: {cache_stats['hits']} acertos, {cache_stats['misses']} falhas.") # User-facing: Portuguese
+        gemini_cache_stats = get_gemini_cache_stats()
+        if gemini_cache_stats['hits'] or gemini_cache_stats['near_duplicate_hits']:
+            print(f"ℹ️  Cache do Gemini: {gemini_cache_stats['hits']} acertos exatos, {gemini_cache_stats['near_duplicate_hits']} por consulta semelhante.") # User-facing: Portuguese
+
+        if tracer is not None:
+            print(f"\n📊 Resumo do rastreamento (por etapa):\n{tracer.format_summary()}") # User-facing: Portuguese
+            if tracer.exported_path:
+                print(f"📊 Trace salvo em '{tracer.exported_path}' (abra em chrome://tracing ou ui.perfetto.dev).") # User-facing: Portuguese
 
     print("\n👋 POC do Selecionador de Filmes finalizada. Até logo!")
\ No newline at end of file
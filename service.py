@@ -0,0 +1,326 @@
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+
+# Long-running HTTP/JSON recommendation service. Module import and Gemini setup happen once at startup.
+# Usage: python service.py [--host 127.0.0.1] [--port 8080] [--quiet]
+#   POST /recommendations  {"age": 8, "interests_query": "dinossauros", "preferred_platform_names": ["netflix"], "country_code": "BR"}
+#                          add "country_codes": ["BR", "PT"] for one result per region (titles are fetched once for all of them)
+#   POST /sessions         same profile (+ optional "profile_id") -> {"session_id", "recommendations", ...}
+#   POST /sessions/<id>/next    {"count": 3}                              -> the next titles from the session's pool
+#   POST /sessions/<id>/reject  {"tmdb_id": 123, "media_type": "movie"}   -> a replacement for the rejected title
+#                          follow-ups make no TMDb call; 404 once the session has expired
+#   GET  /metrics/latency  latency histogram per route (+ coalescing counters, rate limiter state per upstream)
+#   GET  /health
+# Identical in-flight work is coalesced (single-flight): concurrent requests with the same candidate-pool
+# key share one run of Agents 2-3, and identical TMDb GETs share one HTTP call, so 50 parents asking
+# for "dinossauros" at once trigger a single set of TMDb calls.
+# --availability-refresh-hours N keeps the availability index (build_availability_index.py) fresh in a background thread.
+# Warm pools (warm_pools.py, or --warm-pools-refresh-hours N here) answer popular queries without TMDb calls. A query
+# without one of its own is answered from its age-band pool ("warm_pool": "age_band", "refining": true) while its
+# real pool is built in the background; the next identical request gets that one. Requests feed the interest query log.
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000) # Upper bounds; one overflow bucket after them
+LATENCY_SAMPLES_KEPT = 1000 # Recent samples used for percentiles
+
+class LatencyHistogram:
+    # Fixed-bucket latency histogram plus a window of recent samples for p50/p95/p99.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.recent_samples_ms = deque(maxlen=LATENCY_SAMPLES_KEPT)
+
+    def observe(self, elapsed_seconds):
+        elapsed_ms = elapsed_seconds * 1000
+        with self._lock:
+            self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.recent_samples_ms.append(elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            ordered_samples = sorted(self.recent_samples_ms)
+            bucket_labels = [f"<={upper_bound}ms" for upper_bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+            percentiles = {}
+            for percentile in (50, 95, 99):
+                if ordered_samples:
+                    percentiles[f"p{percentile}_ms"] = round(ordered_samples[min(len(ordered_samples) - 1, int(len(ordered_samples) * percentile / 100))], 1)
+            return {
+                'count': self.count,
+                'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+                'buckets': dict(zip(bucket_labels, self.bucket_counts)),
+                **percentiles,
+            }
+
+latency_by_route = {}
+latency_by_route_lock = threading.Lock()
+candidate_pool_single_flight = main.SingleFlight()
+refining_pool_keys = set()
+refining_pool_keys_lock = threading.Lock()
+
+def observe_latency(route, elapsed_seconds):
+    with latency_by_route_lock:
+        histogram = latency_by_route.setdefault(route, LatencyHistogram())
+    histogram.observe(elapsed_seconds)
+
+def refine_candidate_pool_in_background(user_context, pool_key):
+    # Builds the query's own pool in the background lane (coalesced with live requests for it) and keeps it among
+    # the warm pools, so the next identical request is answered from it. One refinement per pool key at a time.
+    with refining_pool_keys_lock:
+        if pool_key in refining_pool_keys:
+            return
+        refining_pool_keys.add(pool_key)
+
+    def refine():
+        try:
+            with main.upstream_lane(main.UPSTREAM_LANE_BACKGROUND), main.trace_run(), main.run_budget():
+                candidate_pool = candidate_pool_single_flight.do(pool_key + ((),), lambda: main.build_candidate_pool(user_context, use_warm_pools=False))
+                if candidate_pool['enriched_prospects'] and not main.is_run_budget_exhausted("tmdb"):
+                    main.get_warm_pool_store().put(pool_key, candidate_pool)
+        except Exception as e:
+            sys.stderr.write(f"[pools pré-aquecidos] falha ao refinar '{user_context['interests_query']}': {e}\n")
+        finally:
+            with refining_pool_keys_lock:
+                refining_pool_keys.discard(pool_key)
+
+    threading.Thread(target=refine, daemon=True).start()
+
+def get_candidate_pool(user_context, extra_regions=()):
+    # Agents 2-3, coalesced per candidate-pool key. Returns (candidate pool, answered from the age-band warm pool).
+    pool_key = main.get_candidate_pool_key(user_context)
+    if main.WARM_POOLS_ANSWER_COLD_REQUESTS and not extra_regions:
+        warm_pool_store = main.get_warm_pool_store()
+        if warm_pool_store.get(pool_key) is None:
+            age_band_pool = warm_pool_store.get(main.get_fallback_pool_key(user_context))
+            if age_band_pool is not None:
+                refine_candidate_pool_in_background(user_context, pool_key)
+                return age_band_pool, True
+    candidate_pool = candidate_pool_single_flight.do(
+        pool_key + (extra_regions,), lambda: main.build_candidate_pool(user_context, extra_regions=extra_regions)
+    )
+    return candidate_pool, False
+
+def recommend(user_context, regions=()):
+    # Agents 2-3 are coalesced per candidate-pool key (or served from a warm pool); Agents 4-5 run per request
+    # (platforms differ). With several regions, one pool (prospected in the first) is judged in each of them.
+    # The request is one run: its TMDb calls and Gemini tokens share one budget (RUN_MAX_*), and its spans one trace.
+    extra_regions = tuple(region for region in regions if region != user_context['country_code'])
+    results_by_region = {}
+    with main.trace_run(), main.run_budget():
+        candidate_pool, answered_from_age_band_pool = get_candidate_pool(user_context, extra_regions)
+        for region in (user_context['country_code'],) + extra_regions:
+            final_recommendations, fallback_mode_was_engaged = main.recommend_from_candidate_pool(candidate_pool, {**user_context, 'country_code': region})
+            results_by_region[region] = {
+                'used_fallback_search': fallback_mode_was_engaged,
+                'recommendations': [main.recommendation_to_output(rec) for rec in final_recommendations],
+            }
+    if answered_from_age_band_pool: # Only without extra regions
+        return {'profile': user_context, **results_by_region[user_context['country_code']], 'warm_pool': 'age_band', 'refining': True}
+    if not extra_regions:
+        return {'profile': user_context, **results_by_region[user_context['country_code']]}
+    return {'profile': user_context, 'regions': results_by_region}
+
+def start_session(user_context):
+    # Agents 2-3 coalesced with recommend() (same single-flight key as a single-region request); the session keeps
+    # the user's checked pool for follow-ups. It never starts from the age-band warm pool, which follow-ups would be stuck with.
+    with main.trace_run(), main.run_budget():
+        candidate_pool = candidate_pool_single_flight.do(main.get_candidate_pool_key(user_context) + ((),), lambda: main.build_candidate_pool(user_context))
+        session, first_recommendations = main.start_recommendation_session(user_context, candidate_pool=candidate_pool)
+    return {**session_to_output(session, first_recommendations), 'profile': user_context}
+
+def session_to_output(session, recommendations):
+    return {
+        'session_id': session.session_id,
+        'used_fallback_search': session.fallback_mode_was_engaged,
+        'recommendations': [main.recommendation_to_output(rec) for rec in recommendations],
+    }
+
+class RecommendationRequestHandler(BaseHTTPRequestHandler):
+    server_version = "FilmRecommendationService/1.0"
+
+    def send_json(self, status_code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        started_at = time.perf_counter()
+        if self.path == "/health":
+            self.send_json(200, {'status': 'ok', 'gemini': main.is_gemini_available(), 'tmdb': bool(main.TMDB_API_KEY)})
+        elif self.path == "/metrics/latency":
+            with latency_by_route_lock:
+                routes = {route: histogram.snapshot() for route, histogram in latency_by_route.items()}
+            self.send_json(200, {
+                'routes': routes,
+                'coalesced': {
+                    'candidate_pools': candidate_pool_single_flight.coalesced_calls,
+                    'tmdb_requests': main.tmdb_single_flight.coalesced_calls,
+                },
+                'tmdb_cache': main.get_tmdb_cache_stats(),
+                'warm_pools': {'pools': len(main.get_warm_pool_store()), 'refining': len(refining_pool_keys)},
+                'rate_limits': main.get_rate_limit_stats(),
+                'gemini_cache': main.get_gemini_cache_stats(),
+            })
+        else:
+            self.send_json(404, {'error': 'rota não encontrada'})
+            return
+        observe_latency(f"GET {self.path}", time.perf_counter() - started_at)
+
+    def read_json_body(self):
+        # The request's JSON object; anything else raises ValueError, which the handlers answer with a 400.
+        content_length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(content_length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("o corpo da requisição deve ser um objeto JSON")
+        return body
+
+    def do_POST(self):
+        started_at = time.perf_counter()
+        if self.path == "/sessions":
+            self.handle_session_start()
+            observe_latency("POST /sessions", time.perf_counter() - started_at)
+            return
+        path_parts = self.path.strip("/").split("/")
+        if len(path_parts) == 3 and path_parts[0] == "sessions" and path_parts[2] in ("next", "reject"):
+            self.handle_session_follow_up(path_parts[1], path_parts[2])
+            observe_latency(f"POST /sessions/<id>/{path_parts[2]}", time.perf_counter() - started_at)
+            return
+        if self.path != "/recommendations":
+            self.send_json(404, {'error': 'rota não encontrada'})
+            return
+        try:
+            raw_profile = self.read_json_body()
+            user_context = main.build_user_context(raw_profile)
+            regions = main.parse_region_codes(raw_profile.get('country_codes'))
+            if regions and not raw_profile.get('country_code'):
+                user_context['country_code'] = regions[0]
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {'error': f"perfil inválido: {e}"})
+            return
+        main.record_interest_query(user_context)
+        try:
+            self.send_json(200, recommend(user_context, regions))
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+        observe_latency("POST /recommendations", time.perf_counter() - started_at)
+
+    def handle_session_start(self):
+        try:
+            user_context = main.build_user_context(self.read_json_body())
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {'error': f"perfil inválido: {e}"})
+            return
+        main.record_interest_query(user_context)
+        try:
+            self.send_json(200, start_session(user_context))
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def handle_session_follow_up(self, session_id, action):
+        session = main.get_recommendation_session(session_id)
+        if session is None:
+            self.send_json(404, {'error': 'sessão não encontrada ou expirada'})
+            return
+        try:
+            body = self.read_json_body()
+            if action == "next":
+                count = int(body.get('count', 3))
+                if not 1 <= count <= 10:
+                    raise ValueError("count deve estar entre 1 e 10")
+            else:
+                tmdb_id = int(body['tmdb_id'])
+                media_type = body.get('media_type')
+                if media_type not in (None, 'movie', 'tv'):
+                    raise ValueError("media_type deve ser 'movie' ou 'tv'")
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {'error': f"pedido inválido: {e}"})
+            return
+        try:
+            with main.trace_run():
+                if action == "next":
+                    recommendations = session.next_recommendations(count)
+                else:
+                    recommendations = session.reject(tmdb_id, media_type)
+            self.send_json(200, session_to_output(session, recommendations))
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"[{self.log_date_time_string()}] {self.address_string()} {format % args}\n")
+
+def refresh_availability_periodically(interval_hours, regions):
+    # Background job: rebuilds the availability index every interval_hours and swaps it in (and onto disk).
+    # Its TMDb calls queue in the background lane, behind the users' requests.
+    while True:
+        try:
+            with main.upstream_lane(main.UPSTREAM_LANE_BACKGROUND):
+                main.refresh_availability_index(regions, path=main.AVAILABILITY_INDEX_PATH or None)
+            sys.stderr.write(f"[disponibilidade] índice atualizado para {', '.join(regions)}\n")
+        except Exception as e:
+            sys.stderr.write(f"[disponibilidade] falha ao atualizar o índice: {e}\n")
+        time.sleep(interval_hours * 3600)
+
+def refresh_warm_pools_periodically(interval_hours, regions):
+    # Background job: rebuilds the warm pools every interval_hours and swaps them in (and onto disk).
+    while True:
+        try:
+            warm_pool_store = main.refresh_warm_pools(regions, path=main.WARM_POOLS_PATH or None)
+            sys.stderr.write(f"[pools pré-aquecidos] {len(warm_pool_store)} pools atualizados para {', '.join(regions)}\n")
+        except Exception as e:
+            sys.stderr.write(f"[pools pré-aquecidos] falha ao atualizar os pools: {e}\n")
+        time.sleep(interval_hours * 3600)
+
+class RecommendationServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Room for bursts of simultaneous parents (the default backlog is 5)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP/JSON de recomendações de filmes e séries infantis.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--quiet", action="store_true", help="Oculta as mensagens de progresso dos agentes.")
+    parser.add_argument("--availability-refresh-hours", type=float, default=0,
+                        help="Atualiza o índice de disponibilidade em segundo plano a cada N horas (0 = desligado).")
+    parser.add_argument("--availability-regions", default=main.TARGET_COUNTRY_CODE, help="Países do índice de disponibilidade (ex.: BR,US).")
+    parser.add_argument("--warm-pools-refresh-hours", type=float, default=0,
+                        help="Reconstrói os pools pré-aquecidos (faixas etárias + consultas mais frequentes) a cada N horas (0 = desligado).")
+    parser.add_argument("--warm-pools-regions", default=main.TARGET_COUNTRY_CODE, help="Países dos pools pré-aquecidos (ex.: BR,PT).")
+    args = parser.parse_args()
+
+    if not main.TMDB_API_KEY:
+        sys.exit("🔴 TMDB_API_KEY ausente. Configure-a no arquivo .env.")
+    main.preload_heavy_modules() # Warm-up: the first request doesn't pay the deferred imports or the Gemini client setup
+    main.get_gemini_model()
+    main.get_provider_registry(main.TARGET_COUNTRY_CODE) # Warm-up: provider names resolve from memory from the first request on
+    if args.availability_refresh_hours > 0:
+        availability_regions = [region.strip().upper() for region in args.availability_regions.split(',') if region.strip()]
+        threading.Thread(target=refresh_availability_periodically, args=(args.availability_refresh_hours, availability_regions), daemon=True).start()
+    if args.warm_pools_refresh_hours > 0:
+        warm_pools_regions = main.parse_region_codes(args.warm_pools_regions)
+        threading.Thread(target=refresh_warm_pools_periodically, args=(args.warm_pools_refresh_hours, warm_pools_regions), daemon=True).start()
+    server = RecommendationServer((args.host, args.port), RecommendationRequestHandler)
+    print(f"🚀 Serviço de recomendações ouvindo em http://{args.host}:{args.port} (POST /recommendations, POST /sessions, GET /metrics/latency)") # User-facing: Portuguese
+    with contextlib.ExitStack() as stack:
+        if args.quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,70 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+# Limiters are built at import time; the simulated TMDb/Gemini don't need them.
+os.environ.setdefault("TMDB_RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("GEMINI_RATE_LIMIT_PER_MINUTE", "0")
+
+import benchmark_pipeline
+import main
+
+# The CLI's sequential path (sessions) against benchmark_pipeline's simulated TMDb and Gemini, offline.
+# Run from the repository root: python -m unittest discover tests
+
+class RecommendationSessionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_directory = tempfile.TemporaryDirectory()
+        cls.saved_settings = {name: getattr(main, name) for name in (
+            'TMDB_API_KEY', 'TMDB_BASE_URL', 'TMDB_CACHE_PATH', 'GEMINI_CACHE_PATH', 'LOCAL_CATALOG_PATH', 'AVAILABILITY_INDEX_PATH',
+            'WARM_POOLS_PATH', 'INTEREST_QUERY_LOG_PATH', 'SESSION_STORE_PATH', 'PIPELINE_MODE', 'RECOMMENDATION_REGIONS', 'gemini_model',
+        )}
+        cls.server = benchmark_pipeline.MockTMDbServer(benchmark_pipeline.BENCHMARK_SCENARIOS['enrichment_30'], 0, 0, 42)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        main.TMDB_API_KEY = "test"
+        main.TMDB_BASE_URL = cls.server.base_url
+        main.TMDB_CACHE_PATH = main.GEMINI_CACHE_PATH = main.LOCAL_CATALOG_PATH = ""
+        main.AVAILABILITY_INDEX_PATH = main.WARM_POOLS_PATH = main.INTEREST_QUERY_LOG_PATH = ""
+        main.SESSION_STORE_PATH = os.path.join(cls.temporary_directory.name, "sessions.sqlite3") # The CLI default: a file that outlives the run
+        main.PIPELINE_MODE = "sequential"
+        main.RECOMMENDATION_REGIONS = []
+        main.gemini_model = benchmark_pipeline.FakeGeminiModel(0, 0, 42)
+        main._session_store = None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        for name, value in cls.saved_settings.items():
+            setattr(main, name, value)
+        main._session_store = None
+        cls.temporary_directory.cleanup()
+
+    def user_context(self, **overrides):
+        return main.build_user_context({'age': 9, 'interests_query': "dinossauros", 'preferred_platform_names': ["netflix", "disney+"], **overrides})
+
+    def recommended_titles(self, results_by_region):
+        return {region: [rec['tmdb_id'] for rec in final_recommendations] for region, (final_recommendations, _) in results_by_region.items()}
+
+    def test_cli_path_is_repeatable_for_an_anonymous_profile(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            first_run, _ = main.run_cli_recommendations(self.user_context())
+            second_run, _ = main.run_cli_recommendations(self.user_context())
+            pipeline_recommendations, _ = main.run_recommendation_pipeline(self.user_context())
+        self.assertTrue(self.recommended_titles(first_run)["BR"])
+        self.assertEqual(self.recommended_titles(first_run), self.recommended_titles(second_run))
+        self.assertEqual(self.recommended_titles(first_run)["BR"], [rec['tmdb_id'] for rec in pipeline_recommendations])
+
+    def test_profile_id_skips_titles_already_shown(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, first_page = main.start_recommendation_session(self.user_context(profile_id="familia-1"))
+            _, second_page = main.start_recommendation_session(self.user_context(profile_id="familia-1"))
+        self.assertTrue(first_page)
+        self.assertFalse({rec['tmdb_id'] for rec in first_page} & {rec['tmdb_id'] for rec in second_page})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+import main
+
+# Warmer for the candidate pools: the Stage 4 age-band fallback pools of each region plus the pools of the most
+# frequent interest queries in the query log (INTEREST_QUERY_LOG_PATH, written by main.py and service.py), built
+# through Agents 2-3 and saved ready to rank. Run it from cron (a few times a day, within WARM_POOL_TTL_SECONDS),
+# or let service.py rebuild them in the background with --warm-pools-refresh-hours.
+# Usage: python warm_pools.py [--regions BR,PT] [--top-queries 50] [--window-days 7] [--output warm_pools.pkl.gz]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pré-aquece os pools de candidatos (faixas etárias e consultas mais frequentes).")
+    parser.add_argument("--regions", default=main.TARGET_COUNTRY_CODE, help="Países separados por vírgula (ex.: BR,PT).")
+    parser.add_argument("--top-queries", type=int, default=main.WARM_POOLS_TOP_QUERIES, help="Consultas mais frequentes do log pré-aquecidas.")
+    parser.add_argument("--window-days", type=float, default=main.WARM_POOLS_LOG_WINDOW_DAYS, help="Dias do log de consultas considerados.")
+    parser.add_argument("--output", default=main.WARM_POOLS_PATH or "warm_pools.pkl.gz", help="Arquivo de saída.")
+    args = parser.parse_args()
+
+    if not main.TMDB_API_KEY:
+        raise SystemExit("🔴 TMDB_API_KEY ausente. Configure-a no arquivo .env.")
+    regions = main.parse_region_codes(args.regions)
+    started_at = time.time()
+    warm_pool_store = main.refresh_warm_pools(regions, args.top_queries, args.window_days, args.output)
+    for pool_key, (candidate_pool, _) in warm_pool_store.items():
+        interests_query, age_band, region = pool_key[:3]
+        print(f"  {region} {age_band:<8} {interests_query or '(gêneros populares da faixa etária)'}: {len(candidate_pool['enriched_prospects']):>3} títulos") # User-facing: Portuguese
+    print(f"✅ {len(warm_pool_store)} pools pré-aquecidos salvos em '{args.output}' ({time.time() - started_at:.1f}s).") # User-facing: Portuguese